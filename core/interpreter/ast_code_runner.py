@@ -42,11 +42,14 @@ class ASTCodeRunner:
         finally:
             sys.stdout = old_stdout
 
-    def run(self, code: str, global_vars: Dict[str, Any]={}) -> Dict[str, Any]:
+    def run(self, code: str, global_vars: Dict[str, Any]={}, redirect_std: bool = True) -> Dict[str, Any]:
         """
         input:
             code: 代码字符串
             global_vars: 全局变量字典
+            redirect_std: 是否替换 sys.stdout/sys.stderr 来捕获输出。
+                多个线程同时执行代码时应设为 False，改为只替换代码中的 print，
+                否则各线程互相覆盖全局的 sys.stdout
         output:
             result: 执行结果字典
                 output: 标准输出
@@ -59,8 +62,9 @@ class ASTCodeRunner:
         old_stderr = sys.stderr
         redirected_output = io.StringIO()
         redirected_error = io.StringIO()
-        sys.stdout = redirected_output
-        sys.stderr = redirected_error
+        if redirect_std:
+            sys.stdout = redirected_output
+            sys.stderr = redirected_error
 
         result = {
             "output": "",
@@ -75,6 +79,8 @@ class ASTCodeRunner:
 
             # 准备执行环境
             exec_globals = global_vars.copy()
+            if not redirect_std:
+                exec_globals['print'] = lambda *args, **kwargs: print(*args, **{**kwargs, 'file': redirected_output})
             
             # 执行代码
             exec(code, exec_globals)
@@ -90,8 +96,9 @@ class ASTCodeRunner:
             result["error"] += f"\n{redirected_error.getvalue()}"
         finally:
             # 恢复标准输出和错误流
-            sys.stdout = old_stdout
-            sys.stderr = old_stderr
+            if redirect_std:
+                sys.stdout = old_stdout
+                sys.stderr = old_stderr
 
         return result
 
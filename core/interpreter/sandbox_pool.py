@@ -0,0 +1,331 @@
+import ast
+import io
+import multiprocessing
+import pickle
+import queue
+import signal
+import sys
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, Iterable, Optional
+
+try:
+    import resource  # 只有 POSIX 有，Windows 上只能依靠超时
+except ImportError:
+    resource = None
+
+# worker 启动时预先导入的模块，生成的代码几乎都会用到
+DEFAULT_PRELOAD = ('numpy', 'pandas', 'akshare')
+
+
+class CpuLimitExceeded(Exception):
+    pass
+
+
+def _raise_cpu_limit(signum, frame):
+    raise CpuLimitExceeded("CPU 时间超过限制")
+
+
+def _check_security(tree):
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+            if isinstance(node.func.value, ast.Name) and node.func.value.id == 'os':
+                if node.func.attr == 'remove':
+                    raise PermissionError("禁止删除文件")
+                if node.func.attr == 'rename':
+                    raise PermissionError("禁止重命名文件")
+
+
+def _set_cpu_limit(seconds: Optional[float]):
+    """RLIMIT_CPU 是进程累计的 CPU 时间，每个任务在已用时间上加上本任务的额度"""
+    if resource is None or not seconds:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime + usage.ru_stime + seconds) + 1
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _clear_cpu_limit():
+    if resource is not None:
+        _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+        resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+
+
+def _worker_main(conn, initializer: Optional[Callable], initargs: tuple, preload: Iterable[str],
+                 memory_limit_mb: Optional[int]):
+    """worker 进程：预先导入常用模块并初始化 code_tools，然后循环执行任务"""
+    for module in preload:
+        try:
+            __import__(module)
+        except ImportError:
+            pass
+    if resource is not None:
+        if memory_limit_mb:
+            limit = memory_limit_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        signal.signal(signal.SIGXCPU, _raise_cpu_limit)
+
+    from core.utils.code_tools import code_tools
+    if initializer is not None:
+        # 初始化得到的对象（数据提供者、LLM 客户端等）在每个任务开始时恢复
+        for name, value in (initializer(*initargs) or {}).items():
+            code_tools.add_with_recover(name, value)
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        code, inputs, cpu_seconds = job
+        conn.send(_run_job(code_tools, code, inputs, cpu_seconds))
+
+
+def _run_job(code_tools, code: str, inputs: Dict[str, bytes], cpu_seconds: Optional[float]) -> Dict[str, Any]:
+    result = {"output": "", "error": None, "updated_vars": {}, "debug": None, "code_tools": {}, "unpicklable": []}
+    # 回收上一个任务留下的状态
+    code_tools.clear()
+    for name, payload in inputs.items():
+        code_tools.set_var(name, pickle.loads(payload))
+    before = {name: id(value) for name, value in code_tools.data.items()}
+
+    old_stdout, old_stderr = sys.stdout, sys.stderr
+    sys.stdout = output = io.StringIO()
+    sys.stderr = error_output = io.StringIO()
+    exec_globals = {'__name__': '__sandbox__'}
+    started = time.time()
+    try:
+        tree = ast.parse(code)
+        _check_security(tree)
+        _set_cpu_limit(cpu_seconds)
+        exec(compile(tree, '<sandbox>', 'exec'), exec_globals)
+    except (Exception, SystemExit) as e:
+        result["error"] = f"{type(e).__name__}: {str(e)}\n{error_output.getvalue()}{traceback.format_exc()}"
+    finally:
+        _clear_cpu_limit()
+        sys.stdout, sys.stderr = old_stdout, old_stderr
+    result["output"] = output.getvalue()
+    result["elapsed"] = time.time() - started
+
+    # 只传回本次任务新增或修改的 code_tools 变量，无法序列化的变量只报告名字
+    for name, value in code_tools.data.items():
+        if before.get(name) == id(value):
+            continue
+        try:
+            result["code_tools"][name] = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            result["unpicklable"].append(name)
+    for name, value in exec_globals.items():
+        if name.startswith('__'):
+            continue
+        try:
+            result["updated_vars"][name] = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            pass
+    if resource is not None:
+        # Linux 上 ru_maxrss 单位为 KB
+        result["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+
+class _Worker:
+    def __init__(self, ctx, initializer, initargs, preload, memory_limit_mb):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, name="sandbox-worker", daemon=True,
+                                   args=(child_conn, initializer, initargs, tuple(preload), memory_limit_mb))
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+
+    def alive(self) -> bool:
+        return self.process.is_alive()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (OSError, EOFError):
+            pass
+        self.process.join(timeout=2)
+        self.kill()
+
+
+class SandboxPool:
+    """
+    执行 LLM 生成代码的子进程池。
+
+    worker 进程启动时已经导入 pandas/numpy/akshare，并由 initializer 创建数据提供者和 LLM 客户端，
+    之后每个任务只传入代码和输入变量，启动代价只付一次。每个任务：
+    - 在独立进程中执行，stdout/stderr 的替换不影响主进程，多个查询可以同时执行；
+    - 有超时（超时后杀掉 worker 并补充新的）、CPU 时间和内存上限（POSIX 下用 setrlimit）；
+    - 开始前把 code_tools 恢复到初始化后的状态，执行 max_jobs_per_worker 次或内存超过 max_rss_mb 后换新进程。
+    结果中的变量通过 pickle 传回。
+    """
+
+    def __init__(self, size: int = 2, initializer: Optional[Callable[..., Dict[str, Any]]] = None,
+                 initargs: tuple = (), preload: Iterable[str] = DEFAULT_PRELOAD, timeout: float = 300.0,
+                 cpu_seconds: Optional[float] = None, memory_limit_mb: Optional[int] = 4096,
+                 max_jobs_per_worker: int = 50, max_rss_mb: Optional[float] = 2048):
+        """
+        :param initializer: 在 worker 中调用，返回 {变量名: 对象}，放入 worker 的 code_tools，必须可以被 pickle（模块级函数）
+        :param timeout: 单个任务的墙钟时间上限（秒）
+        :param cpu_seconds: 单个任务的 CPU 时间上限，默认等于 timeout
+        :param memory_limit_mb: worker 的虚拟内存上限，None 表示不限制
+        """
+        self.size = max(1, size)
+        self.initializer = initializer
+        self.initargs = initargs
+        self.preload = tuple(preload)
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds or timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.max_rss_mb = max_rss_mb
+        methods = multiprocessing.get_all_start_methods()
+        self._ctx = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        if self._ctx.get_start_method() == 'forkserver':
+            # 之后补充的 worker 从已经导入这些模块的 forkserver 分叉，替换 worker 也很快
+            self._ctx.set_forkserver_preload(list(self.preload))
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self) -> "SandboxPool":
+        with self._lock:
+            if not self._started:
+                for _ in range(self.size):
+                    self._add_worker()
+                self._started = True
+        return self
+
+    def _add_worker(self):
+        worker = _Worker(self._ctx, self.initializer, self.initargs, self.preload, self.memory_limit_mb)
+        self._workers.append(worker)
+        self._idle.put(worker)
+
+    def _replace(self, worker: _Worker):
+        worker.kill()
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+            if self._started:
+                self._add_worker()
+
+    def run(self, code: str, inputs: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        在空闲的 worker 中执行代码，阻塞到完成或超时。
+
+        :param inputs: 执行前放入 worker 的 code_tools 的变量
+        :return: 与 ASTCodeRunner.run 相同的字段，另有 code_tools（新增或修改的 code_tools 变量）和 elapsed
+        """
+        self.start()
+        timeout = timeout or self.timeout
+        payload = {}
+        for name, value in (inputs or {}).items():
+            payload[name] = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+        worker = self._idle.get()
+        result = None
+        try:
+            worker.conn.send((code, payload, self.cpu_seconds))
+            worker.jobs += 1
+            if not worker.conn.poll(timeout):
+                return self._failure(f"SandboxTimeout: 代码执行超过 {timeout} 秒，已终止")
+            result = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            # worker 被 SIGXCPU/OOM 等杀掉
+            return self._failure(f"SandboxWorkerDied: 执行代码的进程异常退出 ({type(e).__name__})")
+        finally:
+            recycle = (result is None or not worker.alive() or worker.jobs >= self.max_jobs_per_worker
+                       or (self.max_rss_mb and result.get("max_rss_mb", 0) > self.max_rss_mb))
+            if recycle:
+                self._replace(worker)
+            else:
+                self._idle.put(worker)
+
+        result["code_tools"] = {name: pickle.loads(data) for name, data in result["code_tools"].items()}
+        result["updated_vars"] = {name: pickle.loads(data) for name, data in result["updated_vars"].items()}
+        return result
+
+    @staticmethod
+    def _failure(message: str) -> Dict[str, Any]:
+        return {"output": "", "error": message, "updated_vars": {}, "debug": None, "code_tools": {}, "unpicklable": []}
+
+    def shutdown(self):
+        with self._lock:
+            self._started = False
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+
+
+class SandboxCodeRunner:
+    """
+    与 ASTCodeRunner / StepCodeRunner 接口相同的代码执行器，代码在 SandboxPool 中执行。
+
+    执行前把主进程 code_tools 中可以序列化的变量传给 worker（exclude 中的变量由 worker 自己的
+    initializer 创建），执行后把 worker 中新增或修改的变量写回主进程的 code_tools。
+    """
+
+    def __init__(self, pool: SandboxPool, exclude: Iterable[str] = ('stock_data_provider', 'llm_client')):
+        self.pool = pool
+        self.exclude = set(exclude)
+
+    def _inputs(self) -> Dict[str, Any]:
+        from core.utils.code_tools import code_tools
+        inputs = {}
+        for name in list(code_tools):
+            if name in self.exclude:
+                continue
+            value = code_tools.get_var(name)
+            try:
+                pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                continue
+            inputs[name] = value
+        return inputs
+
+    def run(self, code: str, global_vars: Dict[str, Any] = {}, progress_callback=None, **kwargs) -> Dict[str, Any]:
+        from core.utils.code_tools import code_tools
+        inputs = self._inputs()
+        inputs.update({k: v for k, v in global_vars.items() if k not in self.exclude})
+        result = self.pool.run(code, inputs)
+        for name, value in result["code_tools"].items():
+            code_tools.set_var(name, value)
+        if progress_callback and not result["error"]:
+            progress_callback(1.0)
+        return result
+
+
+def stock_tools_initializer(llm_api: str = "") -> Dict[str, Any]:
+    """StockQuery 生成的代码使用的 stock_data_provider 和 llm_client，在 worker 中各自创建"""
+    from core.llms.llm_factory import LLMFactory
+    from dealer.stock_data_provider import StockDataProvider
+    llm_client = LLMFactory().get_instance(llm_api)
+    return {'llm_client': llm_client, 'stock_data_provider': StockDataProvider(llm_client)}
+
+
+# 使用示例
+if __name__ == "__main__":
+    with SandboxPool(size=2, preload=(), timeout=3) as pool:
+        print(pool.run("from core.utils.code_tools import code_tools\nprint('hello')\n"
+                       "code_tools.add('output_result', sum(range(10)))")["code_tools"])
+        print(pool.run("while True:\n    pass")["error"])
+        print(pool.run("from core.utils.code_tools import code_tools\nprint(code_tools['x'] * 2)", {'x': 21})["output"])
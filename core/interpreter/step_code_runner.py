@@ -14,6 +14,123 @@ from typing import Any, Dict, Optional, Callable
 import traceback
 from tqdm import tqdm
 import time
+import queue
+import threading
+
+# 循环体中调用了这些对象的方法时，为循环的每次迭代报告进度
+PROGRESS_TARGETS = ('stock_data_provider', 'llm_client')
+# 插桩代码调用的钩子在执行环境中的名字
+STEP_HOOK = '__step_done__'
+ITER_HOOK = '__progress_iter__'
+TICK_HOOK = '__progress_tick__'
+_HOOK_NAMES = (STEP_HOOK, ITER_HOOK, TICK_HOOK)
+
+
+def _calls_target(nodes, targets) -> bool:
+    for node in nodes:
+        for child in ast.walk(node):
+            if (isinstance(child, ast.Call) and isinstance(child.func, ast.Attribute)
+                    and isinstance(child.func.value, ast.Name) and child.func.value.id in targets):
+                return True
+    return False
+
+
+def _hook_call(name: str, *args) -> ast.Call:
+    return ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=list(args), keywords=[])
+
+
+class _LoopInstrumenter(ast.NodeTransformer):
+    """给调用了数据接口 / LLM 的循环加上迭代进度钩子，其他循环保持不变"""
+
+    def __init__(self, targets):
+        self.targets = set(targets)
+        self.step = 0
+
+    def visit_For(self, node):
+        self.generic_visit(node)
+        if _calls_target(node.body, self.targets):
+            node.iter = ast.copy_location(_hook_call(ITER_HOOK, node.iter, ast.Constant(self.step)), node.iter)
+        return node
+
+    visit_AsyncFor = visit_For
+
+    def visit_While(self, node):
+        self.generic_visit(node)
+        if _calls_target(node.body, self.targets):
+            tick = ast.copy_location(ast.Expr(_hook_call(TICK_HOOK, ast.Constant(self.step))), node.body[0])
+            node.body.insert(0, tick)
+        return node
+
+
+def instrument_progress(tree: ast.Module, targets=PROGRESS_TARGETS) -> ast.Module:
+    """
+    用 AST 插桩代替 sys.settrace 报告进度：每个顶层语句之后调用一次 __step_done__(i)，
+    调用了 targets 的 for / while 循环每次迭代调用一次钩子。其余代码按原样以全速执行，
+    原有节点的行号不变，出错时的 traceback 仍然指向生成代码的行。
+    """
+    instrumenter = _LoopInstrumenter(targets)
+    body = []
+    for i, stmt in enumerate(tree.body):
+        instrumenter.step = i
+        stmt = instrumenter.visit(stmt)
+        body.append(stmt)
+        if isinstance(stmt, ast.ImportFrom) and stmt.module == '__future__':
+            continue
+        body.append(ast.copy_location(ast.Expr(_hook_call(STEP_HOOK, ast.Constant(i + 1))), stmt))
+    tree.body = body
+    return ast.fix_missing_locations(tree)
+
+
+class ExecutionCancelled(Exception):
+    pass
+
+
+class ProgressReporter:
+    """
+    插桩代码调用的进度钩子。进度 = (已完成的顶层语句 + 当前循环的完成比例) / 顶层语句数，
+    按 update_interval 限制回调频率。
+    on_step 在每个顶层语句完成后调用；cancel_event 被设置后，下一次钩子调用时抛出 ExecutionCancelled。
+    """
+
+    def __init__(self, total: int, callback: Optional[Callable[[float], None]] = None, update_interval: float = 0.1,
+                 on_step: Optional[Callable[[int], None]] = None, cancel_event: Optional[threading.Event] = None):
+        self.total = max(total, 1)
+        self.callback = callback
+        self.update_interval = update_interval
+        self.on_step = on_step
+        self.cancel_event = cancel_event
+        self.progress = 0.0
+        self._last_report = 0.0
+
+    def hooks(self) -> Dict[str, Callable]:
+        return {STEP_HOOK: self.step_done, ITER_HOOK: self.iterate, TICK_HOOK: self.tick}
+
+    def _report(self, progress: float, force: bool = False):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise ExecutionCancelled("执行已取消")
+        self.progress = min(progress / self.total, 1.0)
+        now = time.monotonic()
+        if force or now - self._last_report >= self.update_interval:
+            self._last_report = now
+            if self.callback:
+                self.callback(self.progress)
+
+    def step_done(self, step: int):
+        self._report(step, force=step == self.total)
+        if self.on_step:
+            self.on_step(step)
+
+    def iterate(self, iterable, step: int):
+        try:
+            length = len(iterable)
+        except TypeError:
+            length = 0
+        for n, item in enumerate(iterable):
+            self._report(step + (n / length if length else 0))
+            yield item
+
+    def tick(self, step: int):
+        self._report(step)
 
 
 class StepCodeRunner:
@@ -23,12 +140,17 @@ class StepCodeRunner:
         self.update_interval = 0.1  # 更新间隔，秒
 
     def run_sse(self, code: str, global_vars: Dict[str, Any] = {}) -> Generator[Dict[str, Any], None, None]:
-        old_stdout = sys.stdout
-        old_stderr = sys.stderr
-        redirected_output = io.StringIO()
-        redirected_error = io.StringIO()
-        sys.stdout = redirected_output
-        sys.stderr = redirected_error
+        """
+        流式执行代码：按顺序执行顶层语句（嵌套在循环、函数、if 中的语句只随其父语句执行一次），
+        执行过程中产生事件：
+            progress    进度（每个顶层语句、调用数据接口 / LLM 的循环的每次迭代，按 update_interval 限频）
+            code_tools  顶层语句执行后 code_tools 中新增或修改的变量 {"name", "value", "summary"}
+            output      print 的输出（执行结束时）
+            error       异常信息
+            result      与 run 相同结构的最终结果
+        代码在后台线程中执行，调用方停止迭代时，代码在下一个顶层语句或循环迭代处停止。
+        """
+        from core.utils.code_tools import code_tools
 
         result = {
             "output": "",
@@ -37,54 +159,78 @@ class StepCodeRunner:
             "debug": None
         }
 
-        exec_globals = global_vars.copy()
-
         try:
             tree = ast.parse(code)
         except SyntaxError as e:
             yield {"type": "error", "content": f"Syntax error in code: {str(e)}"}
             return
 
-        total_lines = len(tree.body)
-        executed_lines = 0
-
-        def progress_update():
-            nonlocal executed_lines
-            executed_lines += 1
-            progress = min(executed_lines / total_lines, 1.0)
-            return {"type": "progress", "content": progress}
+        if self.debug:
+            yield {"type": "debug", "content": f"调试信息: 准备执行下面的代码:\n{code}"}
 
         try:
-            if self.debug:
-                yield {"type": "debug", "content": f"调试信息: 准备执行下面的代码:\n{code}"}
-
             self.check_security(tree)
+        except SecurityException as e:
+            # 代码没有执行，但客户端仍然需要最后的 result 事件
+            result["error"] = f"{type(e).__name__}: {str(e)}"
+            yield {"type": "error", "content": f"Uncaught exception: {result['error']}"}
+            yield {"type": "result", "content": result}
+            return
 
-            for node in ast.walk(tree):
-                if isinstance(node, ast.stmt):
-                    exec(compile(ast.Module([node], type_ignores=[]), filename="<ast>", mode="exec"), exec_globals)
-                    current_time = time.time()
-                    if current_time - self.last_update_time >= self.update_interval:
-                        yield progress_update()
-                        self.last_update_time = current_time
-
-        except Exception as e:
-            error_msg = f"Uncaught exception: {type(e).__name__}: {str(e)}\n{traceback.format_exc()}"
-            yield {"type": "error", "content": error_msg}
+        events: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        cancel_event = threading.Event()
+        done = object()
+        redirected_output = io.StringIO()
+        known = {name: id(value) for name, value in code_tools.data.items()}
+
+        def publish_code_tools(step: int):
+            # 只在顶层语句之间比较一次 code_tools，循环内不做额外的工作
+            for name, value in list(code_tools.data.items()):
+                if name.endswith('_summary') or known.get(name) == id(value):
+                    continue
+                known[name] = id(value)
+                events.put({"type": "code_tools",
+                            "content": {"name": name, "value": value, "summary": code_tools.data.get(f"{name}_summary")}})
+
+        reporter = ProgressReporter(len(tree.body), lambda progress: events.put({"type": "progress", "content": progress}),
+                                    self.update_interval, on_step=publish_code_tools, cancel_event=cancel_event)
+        exec_globals = global_vars.copy()
+        exec_globals.update(reporter.hooks())
+        # 不替换全局的 sys.stdout：代码在后台线程中执行，只把代码中的 print 重定向
+        exec_globals['print'] = lambda *args, **kwargs: print(*args, **{'file': redirected_output, **kwargs})
+
+        def execute():
+            try:
+                exec(compile(instrument_progress(tree), '<string>', 'exec'), exec_globals)
+            except ExecutionCancelled:
+                pass
+            except Exception as e:
+                result["error"] = f"{type(e).__name__}: {str(e)}"
+                events.put({"type": "error",
+                            "content": f"Uncaught exception: {type(e).__name__}: {str(e)}\n{traceback.format_exc()}"})
+            finally:
+                events.put(done)
+
+        worker = threading.Thread(target=execute, name="step-code-runner", daemon=True)
+        worker.start()
+        try:
+            while True:
+                event = events.get()
+                if event is done:
+                    break
+                yield event
         finally:
-            sys.stdout = old_stdout
-            sys.stderr = old_stderr
-
-            result["output"] = redirected_output.getvalue()
-            if result["output"]:
-                yield {"type": "output", "content": result["output"]}
+            # 调用方提前停止迭代（GeneratorExit）时让后台线程尽快停下
+            cancel_event.set()
 
-            error_output = redirected_error.getvalue()
-            if error_output:
-                yield {"type": "error", "content": f"Captured stderr:\n{error_output}"}
+        worker.join()
+        result["output"] = redirected_output.getvalue()
+        if result["output"]:
+            yield {"type": "output", "content": result["output"]}
 
-            result["updated_vars"] = {k: v for k, v in exec_globals.items() if k not in global_vars or global_vars[k] is not v}
-            yield {"type": "result", "content": result}
+        result["updated_vars"] = {k: v for k, v in exec_globals.items()
+                                  if k not in _HOOK_NAMES and k != 'print' and (k not in global_vars or global_vars[k] is not v)}
+        yield {"type": "result", "content": result}
 
     def run(self, code: str, global_vars: Dict[str, Any] = {}, progress_callback: Optional[Callable[[float], None]] = None) -> Dict[str, Any]:
         old_stdout = sys.stdout
@@ -101,35 +247,29 @@ class StepCodeRunner:
             "debug": None
         }
 
-        tree = ast.parse(code)
-        total_lines = len(tree.body)
-        
-        self.progress_bar = tqdm(total=total_lines, desc="Executing", unit="lines", file=sys.__stderr__)
-
-        def trace_calls(frame, event, arg):
-            if event == 'line':
-                current_time = time.time()
-                if current_time - self.last_update_time >= self.update_interval:
-                    self.progress_bar.update(1)
-                    if progress_callback:
-                        progress_callback(self.progress_bar.n / total_lines)
-                    self.last_update_time = current_time
-            return trace_calls
-
+        self.progress_bar = None
         try:
             if self.debug:
                 result["debug"] = f"调试信息: 准备执行下面的代码:\n{code}"
 
+            tree = ast.parse(code)
             self.check_security(tree)
+            total_lines = len(tree.body)
+            self.progress_bar = tqdm(total=total_lines, desc="Executing", unit="lines", file=sys.__stderr__)
+
+            def on_progress(progress: float):
+                self.progress_bar.update(int(progress * total_lines) - self.progress_bar.n)
+                if progress_callback:
+                    progress_callback(progress)
 
+            reporter = ProgressReporter(total_lines, on_progress, self.update_interval)
             exec_globals = global_vars.copy()
-            
-            sys.settrace(trace_calls)
-            exec(code, exec_globals)
-            sys.settrace(None)
+            exec_globals.update(reporter.hooks())
+            exec(compile(instrument_progress(tree), '<string>', 'exec'), exec_globals)
 
             result["output"] = redirected_output.getvalue()
-            result["updated_vars"] = {k: v for k, v in exec_globals.items() if k not in global_vars or global_vars[k] is not v}
+            result["updated_vars"] = {k: v for k, v in exec_globals.items()
+                                      if k not in _HOOK_NAMES and (k not in global_vars or global_vars[k] is not v)}
 
         except Exception as e:
             result["error"] = f"{type(e).__name__}: {str(e)}"
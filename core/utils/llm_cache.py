@@ -0,0 +1,93 @@
+import hashlib
+import json
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+
+from .log import logger
+from .sqlite_store import SQLiteStore
+
+
+class LLMResponseCache(SQLiteStore):
+    """
+    以 SQLite 保存的 LLM 响应缓存，key 为 (命名空间, 消息) 的哈希。
+    多个回测进程可以同时读写同一个缓存文件。
+    """
+
+    def __init__(self, path: str = "./output/llm_cache.db", timeout: float = 30.0):
+        super().__init__(path, ["CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, namespace TEXT NOT NULL, "
+                                "response TEXT NOT NULL, created REAL NOT NULL)"], timeout)
+
+    @staticmethod
+    def make_key(namespace: str, message: Any) -> str:
+        payload = json.dumps([namespace, message], ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._connection().execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, namespace: str, response: str):
+        self._connection().execute("INSERT OR REPLACE INTO responses (key, namespace, response, created) VALUES (?, ?, ?, ?)",
+                                   (key, namespace, response, time.time()))
+
+    def clear(self, namespace: Optional[str] = None):
+        if namespace is None:
+            self._connection().execute("DELETE FROM responses")
+        else:
+            self._connection().execute("DELETE FROM responses WHERE namespace = ?", (namespace,))
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+class CachedLLMClient:
+    """
+    在 LLM 客户端外包一层响应缓存，用于回测和参数扫描：相同的 prompt 不再重复请求 API。
+
+    只缓存非流式的 one_chat；其他方法和属性直接转发给被包装的客户端。
+    namespace 默认为客户端类名加上模型参数，换模型或温度后不会命中旧的响应。
+    """
+
+    def __init__(self, client, cache: LLMResponseCache, namespace: Optional[str] = None):
+        self.client = client
+        self.cache = cache
+        self.namespace = namespace or self._default_namespace(client)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _default_namespace(client) -> str:
+        parameters = getattr(client, 'parameters', None)
+        if isinstance(parameters, dict) and parameters:
+            return f"{type(client).__name__}:{json.dumps(parameters, sort_keys=True, default=str)}"
+        return type(client).__name__
+
+    def one_chat(self, message, is_stream: bool = False):
+        if is_stream:
+            return self.client.one_chat(message, is_stream=True)
+        key = self.cache.make_key(self.namespace, message)
+        try:
+            cached = self.cache.get(key)
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache read failed: {e}")
+            cached = None
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        response = self.client.one_chat(message)
+        if isinstance(response, str):
+            try:
+                self.cache.put(key, self.namespace, response)
+            except sqlite3.Error as e:
+                logger.warning(f"LLM cache write failed: {e}")
+        return response
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.client.get_stats()) if hasattr(self.client, 'get_stats') else {}
+        stats.update({'cache_hits': self.hits, 'cache_misses': self.misses})
+        return stats
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
@@ -0,0 +1,138 @@
+import copy
+import inspect
+import pickle
+import threading
+from typing import Any, Dict, Iterable, Optional
+
+from .log import logger
+
+
+class MemoizingProxy:
+    """
+    在数据提供者或 LLM 客户端外包一层按 (方法名, 参数) 记忆的代理，用于一次查询内的代码修复重试：
+    生成的代码出错后重新从头执行时，已经成功的网络请求和 LLM 调用直接返回上一次的结果。
+
+    - 只记忆成功返回的调用，异常不记忆；
+    - 流式调用（is_stream=True）和返回生成器的方法不记忆；
+    - 参数无法序列化为 key 时不记忆，直接调用；
+    - 存入和返回时都做 deepcopy，生成的代码修改返回值不会影响下一次执行。
+    methods 不为 None 时只记忆其中的方法，其余方法和属性直接转发。
+    """
+
+    def __init__(self, target, methods: Optional[Iterable[str]] = None, exclude: Iterable[str] = ()):
+        object.__setattr__(self, '_memo_target', target)
+        object.__setattr__(self, '_memo_methods', set(methods) if methods is not None else None)
+        object.__setattr__(self, '_memo_exclude', set(exclude))
+        object.__setattr__(self, '_memo_cache', {})
+        object.__setattr__(self, '_memo_lock', threading.Lock())
+        object.__setattr__(self, 'memo_hits', 0)
+        object.__setattr__(self, 'memo_misses', 0)
+
+    @property
+    def memo_target(self):
+        return self._memo_target
+
+    def _memoized(self, name: str) -> bool:
+        if name.startswith('_') or name in self._memo_exclude:
+            return False
+        return self._memo_methods is None or name in self._memo_methods
+
+    @staticmethod
+    def _make_key(name: str, args: tuple, kwargs: Dict[str, Any]) -> Optional[bytes]:
+        try:
+            return pickle.dumps((name, args, sorted(kwargs.items())), protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return None
+
+    def _call(self, name: str, method, args: tuple, kwargs: Dict[str, Any]):
+        if kwargs.get('is_stream'):
+            return method(*args, **kwargs)
+        key = self._make_key(name, args, kwargs)
+        if key is None:
+            return method(*args, **kwargs)
+        with self._memo_lock:
+            if key in self._memo_cache:
+                object.__setattr__(self, 'memo_hits', self.memo_hits + 1)
+                cached = self._memo_cache[key]
+                logger.debug(f"MemoizingProxy hit: {name}")
+                return copy.deepcopy(cached)
+        result = method(*args, **kwargs)
+        if inspect.isgenerator(result) or inspect.isasyncgen(result):
+            return result
+        try:
+            stored = copy.deepcopy(result)
+        except Exception:
+            return result
+        with self._memo_lock:
+            self._memo_cache[key] = stored
+            object.__setattr__(self, 'memo_misses', self.memo_misses + 1)
+        return result
+
+    def __getattr__(self, name):
+        attr = getattr(self._memo_target, name)
+        if not callable(attr) or not self._memoized(name):
+            return attr
+
+        def memoized(*args, **kwargs):
+            return self._call(name, attr, args, kwargs)
+        memoized.__name__ = name
+        memoized.__doc__ = getattr(attr, '__doc__', None)
+        return memoized
+
+    def __setattr__(self, name, value):
+        setattr(self._memo_target, name, value)
+
+    def memo_clear(self):
+        with self._memo_lock:
+            self._memo_cache.clear()
+
+    def memo_stats(self) -> Dict[str, int]:
+        return {'hits': self.memo_hits, 'misses': self.memo_misses, 'entries': len(self._memo_cache)}
+
+
+class QueryMemo:
+    """
+    一次查询期间把 code_tools 中的 stock_data_provider 和 llm_client 换成 MemoizingProxy，
+    退出时恢复原对象。同一次查询的所有代码修复重试共享记忆的结果，不同查询之间不共享。
+    llm_client 只记忆非流式的 one_chat。
+
+        with QueryMemo(stock_data_provider, llm_client):
+            ...  # 生成、执行、修复代码
+    """
+
+    def __init__(self, stock_data_provider, llm_client):
+        self.originals = {'stock_data_provider': stock_data_provider, 'llm_client': llm_client}
+        self.proxies = {
+            'stock_data_provider': MemoizingProxy(stock_data_provider),
+            'llm_client': MemoizingProxy(llm_client, methods=('one_chat',)),
+        }
+
+    def __enter__(self) -> "QueryMemo":
+        from .code_tools import code_tools
+        for name, proxy in self.proxies.items():
+            code_tools.set_var(name, proxy)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        from .code_tools import code_tools
+        for name, original in self.originals.items():
+            code_tools.set_var(name, original)
+        stats = {name: proxy.memo_stats() for name, proxy in self.proxies.items()}
+        logger.info(f"QueryMemo stats: {stats}")
+
+
+# 使用示例
+if __name__ == "__main__":
+    class _Provider:
+        def __init__(self):
+            self.calls = 0
+
+        def get_stock_info(self, symbol: str) -> dict:
+            self.calls += 1
+            return {'symbol': symbol, 'price': 10.0}
+
+    provider = _Provider()
+    proxy = MemoizingProxy(provider)
+    info = proxy.get_stock_info("600000")
+    info['price'] = 0
+    print(proxy.get_stock_info("600000"), provider.calls, proxy.memo_stats())
@@ -0,0 +1,31 @@
+import os
+import sqlite3
+import threading
+from typing import Iterable
+
+
+class SQLiteStore:
+    """
+    多进程、多线程共用的 SQLite 文件的基类。
+
+    使用 WAL 模式，多个进程可以同时读写同一个文件；每个线程各自打开连接（autocommit），
+    子类在构造时传入建表语句，通过 _connection() 取得当前线程的连接。
+    """
+
+    def __init__(self, path: str, schema: Iterable[str] = (), timeout: float = 30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        for statement in schema:
+            conn.execute(statement)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
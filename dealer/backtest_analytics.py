@@ -0,0 +1,267 @@
+import json
+import os
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+ACTIONS = ('buy', 'sell', 'short', 'cover')
+BUY, SELL, SHORT, COVER = range(4)
+
+NS_PER_MINUTE = 60 * 1_000_000_000
+NS_PER_DAY = 1440 * NS_PER_MINUTE
+# 夜盘（21:00 起）归属下一个交易日：时间平移 3 小时后再取日期
+TRADING_DAY_SHIFT_NS = 3 * 60 * NS_PER_MINUTE
+
+# 交易时段，按本地时间的分钟数划分: (名称, 开始分钟, 结束分钟)
+SESSIONS = (
+    ('night', 21 * 60, 24 * 60),
+    ('night', 0, 3 * 60),
+    ('morning', 9 * 60, 11 * 60 + 30),
+    ('afternoon', 13 * 60, 15 * 60 + 1),
+)
+SESSION_NAMES = ('night', 'morning', 'afternoon')
+
+
+def _to_ns(timestamp) -> int:
+    """统一转换为北京时间（不带时区）的 epoch 纳秒，便于直接按分钟/日期做整数运算"""
+    ts = pd.Timestamp(timestamp)
+    if ts.tz is not None:
+        ts = ts.tz_convert('Asia/Shanghai').tz_localize(None)
+    return ts.value
+
+
+class _GrowableColumns:
+    """按列存储的数组，容量不足时成倍扩容，追加为均摊 O(1)"""
+
+    def __init__(self, dtypes: Dict[str, np.dtype], capacity: int = 1024):
+        self._size = 0
+        self._columns = {name: np.empty(capacity, dtype=dtype) for name, dtype in dtypes.items()}
+
+    def append(self, **values):
+        if self._size == len(next(iter(self._columns.values()))):
+            for name, column in self._columns.items():
+                grown = np.empty(len(column) * 2, dtype=column.dtype)
+                grown[:self._size] = column[:self._size]
+                self._columns[name] = grown
+        for name, value in values.items():
+            self._columns[name][self._size] = value
+        self._size += 1
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self._columns[name][:self._size]
+
+
+class FillLedger:
+    """
+    回测成交记录。成交与盯市价格分别存放在 numpy 数组中，
+    所有统计都在 compute_performance 中对整列做向量化计算。
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.fills = _GrowableColumns({'time': np.int64, 'action': np.int8, 'quantity': np.float64,
+                                       'price': np.float64}, capacity)
+        self.marks = _GrowableColumns({'time': np.int64, 'price': np.float64}, capacity)
+
+    def add_fill(self, action: str, quantity: float, price: float, timestamp):
+        if quantity <= 0:
+            return
+        self.fills.append(time=_to_ns(timestamp), action=ACTIONS.index(action), quantity=quantity, price=price)
+
+    def add_mark(self, price: float, timestamp):
+        """记录盯市价格（通常每根 bar 一次），用于计算权益曲线"""
+        self.marks.append(time=_to_ns(timestamp), price=price)
+
+    def __len__(self):
+        return len(self.fills)
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            'Action': np.array(ACTIONS)[self.fills['action']],
+            'Quantity': self.fills['quantity'],
+            'Price': self.fills['price'],
+            'Timestamp': pd.to_datetime(self.fills['time']),
+        })
+
+
+def match_lots(ledger: FillLedger) -> Dict[str, np.ndarray]:
+    """
+    FIFO 配对开平仓，多头和空头分别配对。
+
+    每笔开仓/平仓在累计数量轴上占据一个区间，FIFO 配对等价于两组区间求交，
+    用 searchsorted 一次性算出每个交集片段对应的开仓和平仓序号。
+    """
+    fills = ledger.fills
+    parts = []
+    for open_action, close_action, direction in ((BUY, SELL, 1.0), (SHORT, COVER, -1.0)):
+        opens = np.flatnonzero(fills['action'] == open_action)
+        closes = np.flatnonzero(fills['action'] == close_action)
+        if len(opens) == 0 or len(closes) == 0:
+            continue
+        open_cum = np.cumsum(fills['quantity'][opens])
+        close_cum = np.cumsum(fills['quantity'][closes])
+        matched_total = min(open_cum[-1], close_cum[-1])
+
+        bounds = np.unique(np.concatenate(([0.0], open_cum, close_cum)))
+        bounds = bounds[bounds <= matched_total]
+        if len(bounds) < 2:
+            continue
+        seg_start = bounds[:-1]
+        seg_qty = np.diff(bounds)
+        open_idx = opens[np.searchsorted(open_cum, seg_start, side='right')]
+        close_idx = closes[np.searchsorted(close_cum, seg_start, side='right')]
+        parts.append((open_idx, close_idx, seg_qty, np.full(len(seg_qty), direction)))
+
+    if not parts:
+        empty_int = np.empty(0, dtype=np.int64)
+        empty_float = np.empty(0, dtype=np.float64)
+        return {'open_idx': empty_int, 'close_idx': empty_int, 'quantity': empty_float,
+                'direction': empty_float, 'pnl': empty_float, 'holding_ns': empty_int}
+
+    open_idx, close_idx, quantity, direction = (np.concatenate(p) for p in zip(*parts))
+    pnl = (fills['price'][close_idx] - fills['price'][open_idx]) * quantity * direction
+    holding_ns = fills['time'][close_idx] - fills['time'][open_idx]
+    return {'open_idx': open_idx, 'close_idx': close_idx, 'quantity': quantity,
+            'direction': direction, 'pnl': pnl, 'holding_ns': holding_ns}
+
+
+def equity_curve(ledger: FillLedger, multiplier: float = 1.0):
+    """
+    按时间顺序合并成交和盯市价格，权益 = 现金 + 持仓 * 当前价格。
+
+    :return: (时间 ns 数组, 权益数组)
+    """
+    fills, marks = ledger.fills, ledger.marks
+    action = fills['action']
+    signed_qty = np.where((action == BUY) | (action == COVER), fills['quantity'], -fills['quantity'])
+
+    times = np.concatenate((fills['time'], marks['time']))
+    prices = np.concatenate((fills['price'], marks['price']))
+    position_delta = np.concatenate((signed_qty, np.zeros(len(marks))))
+    cash_delta = np.concatenate((-signed_qty * fills['price'], np.zeros(len(marks))))
+
+    order = np.argsort(times, kind='stable')
+    position = np.cumsum(position_delta[order])
+    cash = np.cumsum(cash_delta[order])
+    return times[order], (cash + position * prices[order]) * multiplier
+
+
+def _trading_days(times_ns: np.ndarray) -> np.ndarray:
+    days = ((times_ns + TRADING_DAY_SHIFT_NS) // NS_PER_DAY).astype('datetime64[D]')
+    return np.busday_offset(days, 0, roll='forward')
+
+
+def _session_codes(times_ns: np.ndarray) -> np.ndarray:
+    minutes = (times_ns // NS_PER_MINUTE) % 1440
+    codes = np.full(len(times_ns), -1, dtype=np.int8)
+    for name, start, end in SESSIONS:
+        codes[(minutes >= start) & (minutes < end)] = SESSION_NAMES.index(name)
+    return codes
+
+
+def _ratio(numerator: float, denominator: float) -> Optional[float]:
+    return float(numerator / denominator) if denominator else None
+
+
+def compute_performance(ledger: FillLedger, multiplier: float = 1.0,
+                        initial_capital: Optional[float] = None,
+                        periods_per_year: int = 252) -> Dict:
+    """
+    计算回测绩效，返回可直接 json.dump 的字典。
+
+    :param multiplier: 合约乘数，默认 1 即按点数计算盈亏
+    :param initial_capital: 初始资金，提供时额外给出回撤比例和换手率
+    """
+    fills = ledger.fills
+    lots = match_lots(ledger)
+    lot_pnl = lots['pnl'] * multiplier
+
+    # 每笔平仓的盈亏（一笔平仓可能对应多笔开仓）
+    close_pnl = np.bincount(np.searchsorted(np.unique(lots['close_idx']), lots['close_idx']),
+                            weights=lot_pnl) if len(lot_pnl) else np.empty(0)
+    wins = close_pnl[close_pnl > 0]
+    losses = close_pnl[close_pnl < 0]
+
+    times, equity = equity_curve(ledger, multiplier)
+    if len(equity):
+        drawdown = equity - np.maximum.accumulate(np.maximum(equity, 0.0))
+        max_drawdown = float(drawdown.min())
+    else:
+        max_drawdown = 0.0
+
+    # 日度盈亏：取每个交易日最后一个权益值做差分
+    daily_pnl = np.empty(0)
+    if len(equity):
+        days = _trading_days(times)
+        last_of_day = np.flatnonzero(np.append(days[1:] != days[:-1], True))
+        daily_equity = equity[last_of_day]
+        daily_pnl = np.diff(np.concatenate(([0.0], daily_equity)))
+    sharpe = sortino = None
+    if len(daily_pnl) > 1:
+        std = daily_pnl.std(ddof=1)
+        downside = np.sqrt(np.mean(np.minimum(daily_pnl, 0.0) ** 2))
+        sharpe = _ratio(daily_pnl.mean() * np.sqrt(periods_per_year), std)
+        sortino = _ratio(daily_pnl.mean() * np.sqrt(periods_per_year), downside)
+
+    notional = float(np.sum(fills['quantity'] * fills['price']) * multiplier)
+
+    holding_minutes = lots['holding_ns'] / NS_PER_MINUTE
+    holding = {'count': int(len(holding_minutes))}
+    if len(holding_minutes):
+        percentiles = np.percentile(holding_minutes, [10, 25, 50, 75, 90])
+        holding.update({
+            'mean_minutes': float(holding_minutes.mean()),
+            'max_minutes': float(holding_minutes.max()),
+            **{f'p{q}_minutes': float(v) for q, v in zip((10, 25, 50, 75, 90), percentiles)},
+        })
+
+    sessions = {}
+    if len(lot_pnl):
+        lot_sessions = _session_codes(fills['time'][lots['open_idx']])
+        for code, name in enumerate(SESSION_NAMES):
+            mask = lot_sessions == code
+            session_pnl = lot_pnl[mask]
+            sessions[name] = {
+                'lots': int(mask.sum()),
+                'quantity': float(lots['quantity'][mask].sum()),
+                'pnl': float(session_pnl.sum()),
+                'win_rate': _ratio((session_pnl > 0).sum(), len(session_pnl)),
+            }
+
+    report = {
+        'fills': int(len(fills)),
+        'open_fills': int(np.isin(fills['action'], (BUY, SHORT)).sum()),
+        'close_fills': int(np.isin(fills['action'], (SELL, COVER)).sum()),
+        'closed_trades': int(len(close_pnl)),
+        'total_pnl': float(equity[-1]) if len(equity) else 0.0,
+        'realized_pnl': float(lot_pnl.sum()),
+        'win_rate': _ratio(len(wins), len(close_pnl)),
+        'avg_trade_pnl': _ratio(close_pnl.sum(), len(close_pnl)),
+        'avg_win': _ratio(wins.sum(), len(wins)),
+        'avg_loss': _ratio(losses.sum(), len(losses)),
+        'profit_factor': _ratio(wins.sum(), -losses.sum()),
+        'max_drawdown': max_drawdown,
+        'trading_days': int(len(daily_pnl)),
+        'sharpe': sharpe,
+        'sortino': sortino,
+        'turnover_notional': notional,
+        'avg_daily_turnover': _ratio(notional, len(daily_pnl)),
+        'holding_time': holding,
+        'sessions': sessions,
+    }
+    if initial_capital:
+        report['initial_capital'] = initial_capital
+        report['return'] = report['total_pnl'] / initial_capital
+        report['max_drawdown_pct'] = max_drawdown / initial_capital
+        report['turnover_ratio'] = notional / initial_capital
+    return report
+
+
+def save_report(report: Dict, path: str):
+    """以 JSON 保存绩效报告，便于不同回测之间比较"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
@@ -1,17 +1,18 @@
 import logging
 import time
 import pandas as pd
-from typing import List, Tuple, Union
+from typing import Dict, List, Optional, Tuple, Union
 from datetime import datetime, timedelta
 
 from tqdm import tqdm
 from dealer.futures_provider import MainContractProvider
 from dealer.llm_dealer import LLMDealer
+from dealer.backtest_analytics import FillLedger, compute_performance, save_report
 
 class Backtester:
     def __init__(self, symbol: str, start_date: str, end_date: str, llm_client, data_provider: MainContractProvider,
                  compact_mode=False,
-                  max_position: int = 5):
+                  max_position: int = 5, multiplier: float = 1.0, initial_capital: Optional[float] = None):
         self.symbol = symbol
         self.start_date = datetime.strptime(start_date, '%Y-%m-%d')
         self.end_date = datetime.strptime(end_date, '%Y-%m-%d')
@@ -26,6 +27,11 @@ class Backtester:
         self.profit_loss = 0
         self.position = 0
         self.max_position = max_position 
+        # 成交记录及绩效统计，multiplier 为合约乘数（默认按点数计算）
+        self.ledger = FillLedger()
+        self.multiplier = multiplier
+        self.initial_capital = initial_capital
+        self.performance: Dict = {}
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
 
@@ -54,8 +60,11 @@ class Backtester:
                     print(f"No data available for trading date {current_date.strftime('%Y-%m-%d')}")
                 else:
                     for i, (_, bar) in enumerate(filtered_data.iterrows(), 1):
-                        trade_instruction, quantity, _ = dealer.process_bar(bar)
-                        self._record_trade(trade_instruction, quantity, bar['close'], bar['datetime'])
+                        close, bar_time = bar['close'], bar['datetime']
+                        # process_bar 正常返回 5 个值，非交易时间只返回 3 个值
+                        result = dealer.process_bar(bar)
+                        self.ledger.add_mark(close, bar_time)
+                        self._record_trade(result[0], result[1], close, bar_time)
                         
                         if i % 50 == 0:
                             print(f"Processed {i}/{len(filtered_data)} bars for trading date {current_date.strftime('%Y-%m-%d')}")
@@ -71,31 +80,54 @@ class Backtester:
     def _record_trade(self, instruction: str, quantity: Union[int, str], price: float, timestamp: datetime):
         if instruction in ['buy', 'short']:
             actual_quantity = self.max_position - abs(self.position) if quantity == 'all' else min(int(quantity), self.max_position - abs(self.position))
+            if actual_quantity <= 0:
+                return
             self.trades.append((instruction, actual_quantity, price, timestamp))
+            self.ledger.add_fill(instruction, actual_quantity, price, timestamp)
             self.open_trades += 1
             self.position += actual_quantity if instruction == 'buy' else -actual_quantity
         elif instruction in ['sell', 'cover']:
-            actual_quantity = abs(self.position) if quantity == 'all' else min(int(quantity), abs(self.position))
-            if self.position != 0:
-                pl = (price - self.trades[-1][2]) * actual_quantity * (1 if self.position > 0 else -1)
-                self.profit_loss += pl
-                self.trades.append((instruction, actual_quantity, price, timestamp))
-                self.close_trades += 1
-                self.position += actual_quantity if instruction == 'cover' else -actual_quantity
+            # sell 只能平多头，cover 只能平空头
+            held = self.position if instruction == 'sell' else -self.position
+            if held <= 0:
+                return
+            actual_quantity = held if quantity == 'all' else min(int(quantity), held)
+            if actual_quantity <= 0:
+                return
+            self.trades.append((instruction, actual_quantity, price, timestamp))
+            self.ledger.add_fill(instruction, actual_quantity, price, timestamp)
+            self.close_trades += 1
+            self.position += actual_quantity if instruction == 'cover' else -actual_quantity
 
     def _calculate_performance(self):
+        # 盈亏按 FIFO 逐手配对开平仓计算，权益曲线按每根 bar 的收盘价盯市
+        self.performance = compute_performance(self.ledger, self.multiplier, self.initial_capital)
+        self.profit_loss = self.performance['total_pnl']
+        report = self.performance
+
+        def fmt(value, spec='.2f'):
+            return 'N/A' if value is None else format(value, spec)
+
         print(f"回测结果 ({self.start_date.strftime('%Y-%m-%d')} 到 {self.end_date.strftime('%Y-%m-%d')}):")
         print(f"开仓次数: {self.open_trades}")
         print(f"平仓次数: {self.close_trades}")
-        print(f"最终盈亏点数: {self.profit_loss:.2f}")
-        
-        if self.open_trades > 0:
-            win_rate = (self.close_trades / self.open_trades) * 100
-            print(f"胜率: {win_rate:.2f}%")
-        
-        if self.close_trades > 0:
-            avg_profit = self.profit_loss / self.close_trades
-            print(f"平均每笔交易盈亏: {avg_profit:.2f}")
+        print(f"最终盈亏: {report['total_pnl']:.2f} (已实现 {report['realized_pnl']:.2f})")
+        print(f"胜率: {fmt(report['win_rate'] * 100 if report['win_rate'] is not None else None)}%")
+        print(f"平均每笔交易盈亏: {fmt(report['avg_trade_pnl'])}")
+        print(f"盈亏比: {fmt(report['profit_factor'])}")
+        print(f"最大回撤: {report['max_drawdown']:.2f}")
+        print(f"Sharpe: {fmt(report['sharpe'])}, Sortino: {fmt(report['sortino'])}")
+        print(f"成交额: {report['turnover_notional']:.2f}")
+        if report['holding_time']['count']:
+            print(f"持仓时间中位数: {report['holding_time']['p50_minutes']:.1f} 分钟")
+        for name, stats in report['sessions'].items():
+            print(f"{name}: 手数 {stats['quantity']:.0f}, 盈亏 {stats['pnl']:.2f}, 胜率 {fmt(stats['win_rate'], '.2%')}")
+
+    def get_performance(self) -> Dict:
+        return self.performance
+
+    def save_performance(self, path: str):
+        save_report(self.performance, path)
 
     def get_trade_history(self) -> pd.DataFrame:
         return pd.DataFrame(self.trades, columns=['Action', 'Quantity', 'Price', 'Timestamp'])
@@ -0,0 +1,184 @@
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Mapping, Optional, Union
+
+import pandas as pd
+
+from dealer.time_normalizer import local_datetime
+from dealer.trade_time import trading_date_of
+
+# 输出列，与 LLMDealer._initialize_history 的列一致
+COLUMNS = ('datetime', 'open', 'high', 'low', 'close', 'volume', 'open_interest')
+DAILY = 'D'
+DEFAULT_TIMEFRAMES = (1, 5, 15, 30, 60, DAILY)
+
+Timeframe = Union[int, str]
+
+
+class _Series:
+    """单个周期的状态：已完成的 bar 和正在形成的 bar"""
+
+    def __init__(self, max_bars: int):
+        self.done: deque = deque(maxlen=max_bars)
+        self.key = None
+        self.current: Optional[list] = None
+        self.streaming = False
+        self.version = 0
+        self._frame = None
+        self._frame_version = (-1, None)
+
+
+class BarAggregator:
+    """
+    由 1 分钟 bar 流增量合成 N 分钟线和日线。
+
+    N 分钟 bar 按北京时间整点对齐，与 1 分钟 bar 一样以区间终点为时间戳：
+    09:01-10:00 的 1 分钟 bar 合成 10:00 的小时线，15:00 的收盘 bar 归入 14:01-15:00 的区间；
+    日线按交易日归属，夜盘 bar 计入下一个交易日（规则同 trade_time.infer_trading_dates）。
+    每根 1 分钟 bar 对每个周期只是一次区间比较和几次标量更新，
+    DataFrame 只在调用 frame() 时构造，并缓存到下一次更新。
+
+    输入的每根 bar 应是一个完整的、不重复的 1 分钟 bar，成交量为该分钟的成交量。
+    """
+
+    def __init__(self, timeframes: Iterable[Timeframe] = DEFAULT_TIMEFRAMES,
+                 max_bars: Union[int, Mapping[Timeframe, int]] = 240,
+                 timezone: str = 'Asia/Shanghai', logger: Optional[logging.Logger] = None):
+        """
+        :param timeframes: 分钟数（需要能整除 60）或 'D'
+        :param max_bars: 每个周期保留的 bar 数，可以按周期分别指定
+        """
+        self.timezone = timezone
+        self.logger = logger or logging.getLogger(__name__)
+        self.series: Dict[Timeframe, _Series] = {}
+        for timeframe in timeframes:
+            if timeframe != DAILY and (not isinstance(timeframe, int) or timeframe <= 0 or 60 % timeframe):
+                raise ValueError(f"Unsupported timeframe: {timeframe}")
+            limit = max_bars.get(timeframe, 240) if isinstance(max_bars, Mapping) else max_bars
+            self.series[timeframe] = _Series(limit)
+
+    @property
+    def timeframes(self) -> List[Timeframe]:
+        return list(self.series)
+
+    def _local_time(self, value) -> datetime:
+        """转为不带时区的北京时间"""
+        ts = pd.Timestamp(value)
+        if ts.tzinfo is not None:
+            ts = ts.tz_convert(self.timezone).tz_localize(None)
+        return ts.to_pydatetime()
+
+    @staticmethod
+    def _bucket(dt: datetime, timeframe: Timeframe, trading_date):
+        """bar 所在区间的 key：日线为交易日，N 分钟线为区间终点"""
+        if timeframe == DAILY:
+            return trading_date
+        # 1 分钟 bar 的时间戳是该分钟的结束时间，先退一分钟得到它实际覆盖的分钟
+        start = dt - timedelta(minutes=1)
+        start = start.replace(minute=start.minute - start.minute % timeframe, second=0, microsecond=0)
+        return start + timedelta(minutes=timeframe)
+
+    def seed(self, timeframe: Timeframe, df: pd.DataFrame):
+        """
+        用已有的历史 bar（例如数据源返回的小时线，时间戳同样为区间终点）初始化某个周期。
+        之后第一根流入的 bar 所在区间及更晚的种子 bar 会被丢弃，以流式合成的结果为准。
+        """
+        series = self.series[timeframe]
+        series.done.clear()
+        series.key = None
+        series.current = None
+        series.streaming = False
+        series.version += 1
+        if df is None or df.empty:
+            return
+        datetimes = pd.to_datetime(df['datetime'])
+        if datetimes.dt.tz is not None:
+            datetimes = datetimes.dt.tz_convert(self.timezone).dt.tz_localize(None)
+        hold = df['open_interest'] if 'open_interest' in df.columns else df.get('hold', pd.Series(0, index=df.index))
+        for row in zip(datetimes, df['open'], df['high'], df['low'], df['close'], df['volume'], hold):
+            series.done.append(list(row))
+
+    def update(self, bar: Mapping) -> List[Timeframe]:
+        """
+        合并一根 1 分钟 bar，返回因此而完成（进入下一个区间）的周期列表。
+        早于当前区间的乱序 bar 被忽略。
+        """
+        ts = bar.get('ts')
+        dt = local_datetime(ts) if ts is not None else self._local_time(bar['datetime'])
+        trading_date = trading_date_of(dt) if DAILY in self.series else None
+        open_, high, low, close = float(bar['open']), float(bar['high']), float(bar['low']), float(bar['close'])
+        volume = float(bar.get('volume', 0) or 0)
+        hold = bar.get('hold', bar.get('open_interest', 0))
+
+        completed = []
+        for timeframe, series in self.series.items():
+            key = self._bucket(dt, timeframe, trading_date)
+            current = series.current
+            if current is not None and key == series.key:
+                if high > current[2]:
+                    current[2] = high
+                if low < current[3]:
+                    current[3] = low
+                current[4] = close
+                current[5] += volume
+                current[6] = hold
+            elif series.key is not None and key < series.key:
+                self.logger.debug(f"Ignored out-of-order bar at {dt} for timeframe {timeframe}")
+                continue
+            else:
+                label = pd.Timestamp(key)
+                if current is not None:
+                    series.done.append(current)
+                    completed.append(timeframe)
+                elif not series.streaming:
+                    # 第一根流入的 bar：丢弃与之重叠的种子数据
+                    while series.done and series.done[-1][0] >= label:
+                        series.done.pop()
+                series.streaming = True
+                series.key = key
+                series.current = [label, open_, high, low, close, volume, hold]
+            series.version += 1
+        return completed
+
+    def frame(self, timeframe: Timeframe, include_partial: bool = True) -> pd.DataFrame:
+        """返回某个周期的 bar，include_partial 为 True 时包含正在形成的最后一根"""
+        series = self.series[timeframe]
+        cache_key = (series.version, include_partial)
+        if series._frame_version != cache_key:
+            rows = list(series.done)
+            if include_partial and series.current is not None:
+                rows.append(series.current)
+            df = pd.DataFrame(rows, columns=COLUMNS)
+            if series.done.maxlen is not None and len(df) > series.done.maxlen:
+                df = df.iloc[-series.done.maxlen:].reset_index(drop=True)
+            series._frame = df
+            series._frame_version = cache_key
+        return series._frame
+
+    def latest(self, timeframe: Timeframe) -> Optional[pd.Series]:
+        """正在形成的 bar（没有时返回最后一根完成的 bar）"""
+        series = self.series[timeframe]
+        row = series.current if series.current is not None else (series.done[-1] if series.done else None)
+        return None if row is None else pd.Series(row, index=COLUMNS)
+
+    def reset(self):
+        for series in self.series.values():
+            series.done.clear()
+            series.key = None
+            series.current = None
+            series.streaming = False
+            series.version += 1
+
+
+# 使用示例
+if __name__ == "__main__":
+    aggregator = BarAggregator(max_bars=10)
+    start = pd.Timestamp("2024-06-06 21:01", tz='Asia/Shanghai')
+    for i in range(150):
+        price = 3500 + i % 7
+        aggregator.update({'datetime': start + pd.Timedelta(minutes=i), 'open': price, 'high': price + 2,
+                           'low': price - 2, 'close': price + 1, 'volume': 10, 'hold': 1000 + i})
+    print(aggregator.frame(15))
+    print(aggregator.frame(60))
+    print(aggregator.frame('D'))
@@ -0,0 +1,159 @@
+from typing import Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+
+from dealer.time_normalizer import NS_PER_MS, NS_PER_SECOND, NS_PER_US, datetimes_from_ns
+
+# 价格、成交量等按列保存的字段
+FIELDS = ('open', 'high', 'low', 'close', 'volume', 'amount', 'hold')
+# 时间戳单位 -> 纳秒倍数
+UNIT_NS = {'s': NS_PER_SECOND, 'ms': NS_PER_MS, 'us': NS_PER_US, 'ns': 1}
+
+
+class _Columns:
+    """一组按股票 id 索引的列数组"""
+
+    def __init__(self, capacity: int):
+        self.time = np.zeros(capacity, dtype=np.int64)
+        self.touched = np.zeros(capacity, dtype=bool)
+        self.values = {field: np.zeros(capacity, dtype=np.float64) for field in FIELDS}
+
+    def grow(self, capacity: int):
+        def grown(array):
+            new = np.zeros(capacity, dtype=array.dtype)
+            new[:len(array)] = array
+            return new
+        self.time = grown(self.time)
+        self.touched = grown(self.touched)
+        self.values = {field: grown(array) for field, array in self.values.items()}
+
+
+class BarSnapshot:
+    """
+    一个处理周期内聚合好的 bar，直接引用 BarBuffer 的非活动缓冲区（不复制）。
+    在下一次 BarBuffer.swap 之前有效。
+    """
+
+    def __init__(self, symbols: List[str], columns: _Columns, time_unit: str, timezone: str):
+        self.ids = np.flatnonzero(columns.touched)
+        self._symbols = symbols
+        self.columns = columns
+        self.time_unit = time_unit
+        self.timezone = timezone
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def symbols(self) -> List[str]:
+        return [self._symbols[i] for i in self.ids]
+
+    def field(self, name: str) -> np.ndarray:
+        """本周期有更新的股票的某个字段，顺序与 symbols 相同"""
+        return self.columns.values[name][self.ids]
+
+    def timestamps(self) -> np.ndarray:
+        """本周期 bar 的 epoch 纳秒时间戳"""
+        return self.columns.time[self.ids] * UNIT_NS[self.time_unit]
+
+    def datetimes(self) -> pd.DatetimeIndex:
+        return datetimes_from_ns(self.timestamps()).tz_convert(self.timezone)
+
+    def to_frame(self) -> pd.DataFrame:
+        df = pd.DataFrame({field: self.field(field) for field in FIELDS}, index=self.symbols)
+        ts = self.timestamps()
+        df.insert(0, 'datetime', datetimes_from_ns(ts).tz_convert(self.timezone))
+        df.insert(0, 'ts', ts)
+        return df
+
+    def to_series_dict(self) -> Dict[str, pd.Series]:
+        """转换为 dealer.process_bar 使用的 {symbol: bar}，每个周期只做一次"""
+        return {symbol: row for symbol, row in self.to_frame().iterrows()}
+
+
+class BarBuffer:
+    """
+    按股票 id 索引、预分配的列式 bar 聚合缓冲区。
+
+    行情回调中每次更新只是对几个 numpy 数组的标量赋值；处理周期到达时 swap 交换两个缓冲区，
+    把刚写满的一个作为 BarSnapshot 交给处理逻辑，新的更新写入另一个缓冲区。
+    只支持单个写线程（行情回调线程）。
+    """
+
+    def __init__(self, symbols: Iterable[str] = (), capacity: int = 256,
+                 time_unit: str = 'ms', timezone: str = 'Asia/Shanghai'):
+        """
+        :param time_unit: 更新时传入的时间戳单位，xtquant 行情为毫秒
+        """
+        self.capacity = max(1, capacity)
+        self.time_unit = time_unit
+        self.timezone = timezone
+        self.symbols: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self._active = _Columns(self.capacity)
+        self._standby = _Columns(self.capacity)
+        for symbol in symbols:
+            self.symbol_id(symbol)
+
+    def symbol_id(self, symbol: str) -> int:
+        """返回股票的 id，新股票分配新的 id，容量不足时两个缓冲区同时扩容"""
+        sid = self._ids.get(symbol)
+        if sid is not None:
+            return sid
+        sid = len(self.symbols)
+        if sid == self.capacity:
+            self.capacity *= 2
+            self._active.grow(self.capacity)
+            self._standby.grow(self.capacity)
+        self._ids[symbol] = sid
+        self.symbols.append(symbol)
+        return sid
+
+    def update(self, symbol: str, timestamp: int, open_: float, high: float, low: float, close: float,
+               volume: float, amount: float, hold: float):
+        """合并一次行情更新：周期内第一次更新记录开盘价和时间，之后更新高低收和累计量"""
+        sid = self._ids.get(symbol)
+        if sid is None:
+            sid = self.symbol_id(symbol)
+        columns = self._active
+        values = columns.values
+        if columns.touched[sid]:
+            if high > values['high'][sid]:
+                values['high'][sid] = high
+            if low < values['low'][sid]:
+                values['low'][sid] = low
+            values['close'][sid] = close
+            values['volume'][sid] += volume
+            values['amount'][sid] += amount
+            values['hold'][sid] = hold
+        else:
+            columns.touched[sid] = True
+            columns.time[sid] = timestamp
+            values['open'][sid] = open_
+            values['high'][sid] = high
+            values['low'][sid] = low
+            values['close'][sid] = close
+            values['volume'][sid] = volume
+            values['amount'][sid] = amount
+            values['hold'][sid] = hold
+
+    def pending(self) -> int:
+        """当前周期内有更新的股票数"""
+        return int(self._active.touched.sum())
+
+    def swap(self) -> BarSnapshot:
+        """结束当前周期，返回其快照；之前返回的快照从此失效"""
+        self._standby.touched[:] = False
+        self._active, self._standby = self._standby, self._active
+        return BarSnapshot(self.symbols, self._standby, self.time_unit, self.timezone)
+
+
+# 使用示例
+if __name__ == "__main__":
+    buffer = BarBuffer(["600000.SH", "000001.SZ"])
+    buffer.update("600000.SH", 1718000000000, 10.0, 10.2, 9.9, 10.1, 1000, 10100, 0)
+    buffer.update("600000.SH", 1718000003000, 10.1, 10.3, 10.0, 10.25, 500, 5100, 0)
+    buffer.update("000001.SZ", 1718000001000, 8.0, 8.0, 7.9, 7.95, 2000, 15900, 0)
+    snapshot = buffer.swap()
+    print(snapshot.to_frame())
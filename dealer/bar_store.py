@@ -0,0 +1,291 @@
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from dealer.trade_time import infer_trading_dates
+from dealer.session_calendar import product_code
+
+MINUTE_FREQUENCIES = ('1m', '5m', '15m', '30m', '60m')
+FREQUENCIES = MINUTE_FREQUENCIES + ('1d',)
+PRICE_COLUMNS = ('open', 'high', 'low', 'close', 'volume', 'hold')
+COLUMNS = ('datetime', 'trading_date') + PRICE_COLUMNS
+
+# 常见数据商 CSV 的列名
+CSV_ALIASES = {
+    'date': 'datetime', 'time': 'datetime', 'timestamp': 'datetime', '时间': 'datetime', '日期': 'datetime',
+    'trade_date': 'trading_date', 'tradingday': 'trading_date', '交易日': 'trading_date',
+    '开盘': 'open', '开盘价': 'open', '最高': 'high', '最高价': 'high', '最低': 'low', '最低价': 'low',
+    '收盘': 'close', '收盘价': 'close', 'vol': 'volume', '成交量': 'volume',
+    'open_interest': 'hold', 'oi': 'hold', 'position': 'hold', '持仓量': 'hold',
+}
+
+# fetcher(product, frequency, start, end) -> (DataFrame, complete)
+# 返回了数据时整个请求区间（当天除外）记为已覆盖；没有数据时只有 complete 为 True 才记为已覆盖，否则下次重新获取
+Fetcher = Callable[[str, str, str, str], Tuple[Optional[pd.DataFrame], bool]]
+
+
+class BarStore:
+    """
+    本地 bar 数据仓库，按 品种/周期/分区 存放列式 .npy 文件：
+
+        {root}/{product}/{frequency}/{partition}/{column}.npy
+
+    分钟数据按交易日分区（YYYYMMDD），日线按年份分区（YYYY）。读取时用内存映射打开，
+    只复制查询区间内的数据。manifest.json 记录已经从数据源获取过的交易日区间，
+    区间外的数据在查询时自动通过 fetcher 补齐，之后的查询完全在本地完成。
+    """
+
+    def __init__(self, root: str = './data/bars', fetcher: Optional[Fetcher] = None,
+                 max_open_partitions: int = 256):
+        self.root = root
+        self.fetcher = fetcher
+        self.max_open_partitions = max_open_partitions
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.RLock()
+        self._partitions: "OrderedDict[str, Dict[str, np.ndarray]]" = OrderedDict()
+        self._partition_names: Dict[str, List[str]] = {}
+
+    def get_bars(self, product: str, frequency: str, start_date: str, end_date: str,
+                 fetch: bool = True) -> pd.DataFrame:
+        """
+        查询 [start_date, end_date] 交易日区间内的 bar，缺失的部分先从数据源补齐。
+
+        :return: DataFrame，列为 datetime, trading_date, open, high, low, close, volume, hold
+        """
+        self._check_frequency(frequency)
+        product = product_code(product)
+        start, end = np.datetime64(start_date, 'D'), np.datetime64(end_date, 'D')
+        if fetch and self.fetcher is not None:
+            for gap_start, gap_end in self.missing_ranges(product, frequency, start, end):
+                self._fill(product, frequency, gap_start, gap_end)
+        return self._read(product, frequency, start, end)
+
+    def missing_ranges(self, product: str, frequency: str, start, end) -> List[Tuple[np.datetime64, np.datetime64]]:
+        """返回 [start, end] 中尚未从数据源获取过的交易日区间"""
+        start, end = np.datetime64(start, 'D'), np.datetime64(end, 'D')
+        gaps = []
+        cursor = start
+        for covered_start, covered_end in self._load_manifest(product_code(product), frequency):
+            if covered_end < cursor:
+                continue
+            if covered_start > end:
+                break
+            if covered_start > cursor:
+                gaps.append((cursor, covered_start - 1))
+            cursor = max(cursor, covered_end + 1)
+            if cursor > end:
+                break
+        if cursor <= end:
+            gaps.append((cursor, end))
+        return gaps
+
+    def write(self, product: str, frequency: str, df: pd.DataFrame, mark_covered: bool = True) -> int:
+        """
+        写入 bar 数据，与已有分区合并（相同时间的 bar 以新数据为准）。
+
+        :param mark_covered: 是否把数据的交易日范围记为已覆盖
+        :return: 写入的行数
+        """
+        self._check_frequency(frequency)
+        return self._write_columns(product_code(product), frequency, _normalize_frame(df, frequency), mark_covered)
+
+    def _write_columns(self, product: str, frequency: str, columns: Dict[str, np.ndarray], mark_covered: bool) -> int:
+        if len(columns['datetime']) == 0:
+            return 0
+
+        keys = _partition_keys(columns['trading_date'], frequency)
+        with self._lock:
+            for key in np.unique(keys):
+                mask = keys == key
+                self._merge_partition(product, frequency, key, {name: values[mask] for name, values in columns.items()})
+            self._partition_names.pop(self._base_dir(product, frequency), None)
+            if mark_covered:
+                self._mark_covered(product, frequency, columns['trading_date'].min(), columns['trading_date'].max())
+        return len(columns['datetime'])
+
+    def import_csv(self, path: str, product: str, frequency: str,
+                   column_map: Optional[Dict[str, str]] = None, encoding: str = 'utf-8', **read_csv_kwargs) -> int:
+        """
+        导入数据商提供的 CSV 文件，列名按 CSV_ALIASES 及 column_map 映射。
+
+        :return: 导入的行数
+        """
+        df = pd.read_csv(path, encoding=encoding, **read_csv_kwargs)
+        mapping = {column: CSV_ALIASES[column.strip().lower()] for column in df.columns
+                   if column.strip().lower() in CSV_ALIASES}
+        mapping.update(column_map or {})
+        rows = self.write(product, frequency, df.rename(columns=mapping))
+        self.logger.info(f"Imported {rows} {frequency} bars for {product_code(product)} from {path}")
+        return rows
+
+    def _fill(self, product: str, frequency: str, start: np.datetime64, end: np.datetime64):
+        start_str, end_str = str(start), str(end)
+        self.logger.info(f"Fetching {product} {frequency} bars from {start_str} to {end_str}")
+        try:
+            df, complete = self.fetcher(product, frequency, start_str, end_str)
+        except Exception as e:
+            self.logger.error(f"Error fetching {product} {frequency} bars: {str(e)}", exc_info=True)
+            return
+
+        written = 0
+        fetched = df is not None and not df.empty
+        if fetched:
+            columns = _normalize_frame(df, frequency)
+            in_range = (columns['trading_date'] >= start) & (columns['trading_date'] <= end)
+            if in_range.any():
+                written = self._write_columns(product, frequency,
+                                              {name: values[in_range] for name, values in columns.items()}, False)
+
+        # 取数成功后整个请求区间都记为已覆盖：数据源没有返回的日子（非交易日、上市之前、
+        # AKShare 只提供最近一段数据）再次请求也不会有数据。当天的数据还在变化，不记为已覆盖
+        if complete or fetched:
+            yesterday = np.datetime64('today', 'D') - 1
+            if start <= min(end, yesterday):
+                self._mark_covered(product, frequency, start, min(end, yesterday))
+        self.logger.info(f"Stored {written} {product} {frequency} bars")
+
+    def _read(self, product: str, frequency: str, start: np.datetime64, end: np.datetime64) -> pd.DataFrame:
+        start_key, end_key = (_partition_keys(np.array([day]), frequency)[0] for day in (start, end))
+        parts = []
+        with self._lock:
+            for name in self._list_partitions(product, frequency):
+                if start_key <= name <= end_key:
+                    parts.append(self._open_partition(os.path.join(self._base_dir(product, frequency), name)))
+
+        if not parts:
+            return pd.DataFrame({column: pd.Series(dtype='datetime64[ns]' if column in ('datetime', 'trading_date') else 'float64')
+                                 for column in COLUMNS})
+
+        trading_date = np.concatenate([part['trading_date'] for part in parts])
+        mask = (trading_date >= start) & (trading_date <= end)
+        data = {column: np.concatenate([part[column] for part in parts])[mask] for column in COLUMNS}
+        data['trading_date'] = data['trading_date'].astype('datetime64[ns]')
+        return pd.DataFrame(data)
+
+    def _base_dir(self, product: str, frequency: str) -> str:
+        return os.path.join(self.root, product, frequency)
+
+    def _list_partitions(self, product: str, frequency: str) -> List[str]:
+        base_dir = self._base_dir(product, frequency)
+        if base_dir not in self._partition_names:
+            names = []
+            if os.path.isdir(base_dir):
+                names = sorted(name for name in os.listdir(base_dir) if name.isdigit())
+            self._partition_names[base_dir] = names
+        return self._partition_names[base_dir]
+
+    def _open_partition(self, path: str) -> Dict[str, np.ndarray]:
+        if path in self._partitions:
+            self._partitions.move_to_end(path)
+            return self._partitions[path]
+        partition = {column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode='r') for column in COLUMNS}
+        self._partitions[path] = partition
+        while len(self._partitions) > self.max_open_partitions:
+            self._partitions.popitem(last=False)
+        return partition
+
+    def _merge_partition(self, product: str, frequency: str, key: str, columns: Dict[str, np.ndarray]):
+        path = os.path.join(self._base_dir(product, frequency), key)
+        if os.path.exists(os.path.join(path, 'datetime.npy')):
+            existing = {column: np.array(values) for column, values in self._open_partition(path).items()}
+            columns = {column: np.concatenate([existing[column], columns[column]]) for column in COLUMNS}
+            # 关闭旧的内存映射，Windows 下被映射的文件无法替换
+            self._partitions.pop(path, None)
+
+        # 按时间去重，后写入的数据优先
+        reversed_times = columns['datetime'][::-1]
+        _, first_in_reversed = np.unique(reversed_times, return_index=True)
+        keep = len(reversed_times) - 1 - first_in_reversed
+
+        os.makedirs(path, exist_ok=True)
+        for column in COLUMNS:
+            tmp_path = os.path.join(path, f"{column}.npy.tmp")
+            with open(tmp_path, 'wb') as f:
+                np.save(f, columns[column][keep])
+            os.replace(tmp_path, os.path.join(path, f"{column}.npy"))
+
+    def _manifest_path(self, product: str, frequency: str) -> str:
+        return os.path.join(self._base_dir(product, frequency), 'manifest.json')
+
+    def _load_manifest(self, product: str, frequency: str) -> List[Tuple[np.datetime64, np.datetime64]]:
+        path = self._manifest_path(product, frequency)
+        if not os.path.exists(path):
+            return []
+        with open(path, 'r', encoding='utf-8') as f:
+            covered = json.load(f).get('covered', [])
+        return [(np.datetime64(start, 'D'), np.datetime64(end, 'D')) for start, end in covered]
+
+    def _mark_covered(self, product: str, frequency: str, start, end):
+        start, end = np.datetime64(start, 'D'), np.datetime64(end, 'D')
+        with self._lock:
+            intervals = sorted(self._load_manifest(product, frequency) + [(start, end)])
+            merged = []
+            for interval_start, interval_end in intervals:
+                if merged and interval_start <= merged[-1][1] + 1:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], interval_end))
+                else:
+                    merged.append((interval_start, interval_end))
+
+            path = self._manifest_path(product, frequency)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'covered': [[str(s), str(e)] for s, e in merged]}, f, indent=2)
+            os.replace(tmp_path, path)
+
+    @staticmethod
+    def _check_frequency(frequency: str):
+        if frequency not in FREQUENCIES:
+            raise ValueError(f"Unsupported frequency: {frequency}, expected one of {FREQUENCIES}")
+
+
+def _normalize_frame(df: pd.DataFrame, frequency: str) -> Dict[str, np.ndarray]:
+    """把数据源返回的 DataFrame 转为按时间排序的列数组"""
+    if 'datetime' not in df.columns and 'date' not in df.columns:
+        df = df.reset_index()
+    df = df.rename(columns={'open_interest': 'hold'})
+    if 'datetime' not in df.columns and 'date' in df.columns:
+        df = df.rename(columns={'date': 'datetime'})
+
+    datetimes = pd.to_datetime(df['datetime'])
+    if datetimes.dt.tz is not None:
+        datetimes = datetimes.dt.tz_convert('Asia/Shanghai').dt.tz_localize(None)
+    datetime_values = datetimes.values.astype('datetime64[ns]')
+
+    if 'trading_date' in df.columns:
+        trading_date = pd.to_datetime(df['trading_date']).values.astype('datetime64[D]')
+    elif frequency in MINUTE_FREQUENCIES:
+        trading_date = infer_trading_dates(datetime_values)
+    else:
+        trading_date = datetime_values.astype('datetime64[D]')
+
+    order = np.argsort(datetime_values, kind='stable')
+    columns = {'datetime': datetime_values[order], 'trading_date': trading_date[order]}
+    for column in PRICE_COLUMNS:
+        values = pd.to_numeric(df[column], errors='coerce').values if column in df.columns else np.full(len(df), np.nan)
+        columns[column] = np.asarray(values, dtype=np.float64)[order]
+    return columns
+
+
+def _partition_keys(trading_dates: np.ndarray, frequency: str) -> np.ndarray:
+    unit = 'Y' if frequency == '1d' else 'D'
+    keys = np.datetime_as_string(trading_dates.astype(f'datetime64[{unit}]'), unit=unit)
+    return np.char.replace(keys, '-', '')
+
+
+# 使用示例：python -m dealer.bar_store <csv文件> <品种> <周期>
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if len(sys.argv) != 4:
+        print("用法: python -m dealer.bar_store <csv文件> <品种> <周期(1m/5m/15m/30m/60m/1d)>")
+        sys.exit(1)
+    csv_path, product, frequency = sys.argv[1:]
+    BarStore().import_csv(csv_path, product, frequency)
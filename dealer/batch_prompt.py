@@ -0,0 +1,128 @@
+import json
+import logging
+import re
+from typing import Callable, Dict, List, Optional, Sequence
+
+
+class BatchDecisionRunner:
+    """
+    多标的批量决策：把若干标的的状态放进同一个 prompt，共享一份规则和输出说明，
+    要求 LLM 返回一个 JSON 数组，每个元素对应一个标的的决策。
+
+    - build_prompt(symbols) 由调用方提供，负责拼出包含这些标的的完整 prompt
+    - 超过 max_prompt_chars 或 LLM 报上下文超长时，自动把批次对半拆分后重试
+    - 解析按标的逐个进行，某个标的的结果缺失或损坏不影响其他标的
+    """
+
+    def __init__(self, llm_client, build_prompt: Callable[[List[str]], str],
+                 batch_size: int = 4, max_prompt_chars: Optional[int] = None,
+                 logger: Optional[logging.Logger] = None):
+        self.llm_client = llm_client
+        self.build_prompt = build_prompt
+        self.batch_size = max(1, batch_size)
+        self.max_prompt_chars = max_prompt_chars
+        self.logger = logger or logging.getLogger(__name__)
+
+    def run(self, symbols: Sequence[str]) -> Dict[str, dict]:
+        """返回 {symbol: decision_dict}，没有拿到有效决策的标的不会出现在结果中"""
+        symbols = list(symbols)
+        decisions = {}
+        for i in range(0, len(symbols), self.batch_size):
+            decisions.update(self._run_chunk(symbols[i:i + self.batch_size]))
+        return decisions
+
+    def _run_chunk(self, symbols: List[str]) -> Dict[str, dict]:
+        if not symbols:
+            return {}
+
+        prompt = self.build_prompt(symbols)
+        if self.max_prompt_chars and len(prompt) > self.max_prompt_chars and len(symbols) > 1:
+            self.logger.info(f"Batch prompt for {len(symbols)} symbols is {len(prompt)} chars, splitting")
+            return self._split(symbols)
+
+        try:
+            response = self.llm_client.one_chat(prompt)
+        except Exception as e:
+            if is_context_overflow(e) and len(symbols) > 1:
+                self.logger.warning(f"Context overflow for batch {symbols}, splitting: {str(e)}")
+                return self._split(symbols)
+            raise
+
+        decisions = parse_batch_decisions(response, symbols)
+        missing = [s for s in symbols if s not in decisions]
+        if missing:
+            self.logger.warning(f"Batch response missing decisions for {missing}")
+        return decisions
+
+    def _split(self, symbols: List[str]) -> Dict[str, dict]:
+        middle = len(symbols) // 2
+        decisions = self._run_chunk(symbols[:middle])
+        decisions.update(self._run_chunk(symbols[middle:]))
+        return decisions
+
+
+def is_context_overflow(error: Exception) -> bool:
+    """与 handle_max_tokens 相同的判断：异常信息中提到上下文长度超限"""
+    message = str(error)
+    return ("maximum context length" in message or "maximum" in message
+            or "reduce the length" in message or "最大" in message)
+
+
+def parse_batch_decisions(response: str, symbols: Sequence[str]) -> Dict[str, dict]:
+    """
+    从 LLM 的回复中解析每个标的的决策。
+
+    优先整体解析 JSON（数组、以 symbol 为键的对象或 {"decisions": [...]}），
+    整体解析失败时逐个提取带 symbol 字段的 JSON 对象。
+    """
+    wanted = {_normalize_symbol(s): s for s in symbols}
+    decisions = {}
+
+    def collect(item):
+        if not isinstance(item, dict):
+            return
+        symbol = wanted.get(_normalize_symbol(item.get('symbol', '')))
+        if symbol and symbol not in decisions:
+            decisions[symbol] = item
+
+    data = _load_json(response)
+    if isinstance(data, dict):
+        if isinstance(data.get('decisions'), list):
+            data = data['decisions']
+        elif 'symbol' in data:
+            data = [data]
+        else:
+            data = [dict(value, symbol=key) for key, value in data.items() if isinstance(value, dict)]
+    if isinstance(data, list):
+        for item in data:
+            collect(item)
+
+    if len(decisions) < len(wanted):
+        # 整体格式损坏时（例如数组被截断），逐个对象尝试解析
+        for match in re.finditer(r'\{[^{}]*\}', response):
+            try:
+                collect(json.loads(match.group(0)))
+            except json.JSONDecodeError:
+                continue
+
+    return decisions
+
+
+def _load_json(response: str):
+    json_match = re.search(r'```json\s*([\s\S]*?)\s*```', response)
+    candidates = [json_match.group(1)] if json_match else []
+    start = response.find('[')
+    end = response.rfind(']')
+    if start != -1 and end > start:
+        candidates.append(response[start:end + 1])
+    candidates.append(response)
+    for candidate in candidates:
+        try:
+            return json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+def _normalize_symbol(symbol) -> str:
+    return str(symbol).strip().upper()
@@ -0,0 +1,149 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+
+class DecisionLog:
+    """
+    每根 bar 决策记录的异步 JSON Lines 日志。
+
+    bar 线程只调用 log(record) 把字典放入队列，后台线程批量序列化并写入
+    {directory}/{prefix}_YYYYMMDD.jsonl，日期变化时自动切换到新文件。
+    队列满时丢弃记录并计数，不会阻塞交易流程。
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, directory: str = './output/decisions', prefix: str = 'decisions',
+                 batch_size: int = 256, flush_interval: float = 1.0, max_queue: int = 100000,
+                 logger: Optional[logging.Logger] = None):
+        """
+        :param batch_size: 单次写入的最大记录数
+        :param flush_interval: 队列中有记录时最长等待多少秒写入一次
+        :param max_queue: 队列容量，超过后新记录被丢弃
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.logger = logger or logging.getLogger(__name__)
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._file = None
+        self._file_date = None
+        self.written = 0
+        self.dropped = 0
+
+    @classmethod
+    def default(cls) -> "DecisionLog":
+        """进程内共享的默认日志，第一次使用时启动，进程退出前写完队列中的记录"""
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+                cls._default.start()
+                atexit.register(cls._default.stop)
+            return cls._default
+
+    def log(self, record: Dict[str, Any]):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        if self._thread is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="decision-log", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """写完队列中已有的记录后停止"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+        if self.dropped:
+            self.logger.warning(f"DecisionLog dropped {self.dropped} records because the queue was full")
+
+    def _run(self):
+        try:
+            while True:
+                batch, stopping = self._next_batch()
+                if batch:
+                    self._write(batch)
+                if stopping:
+                    return
+        finally:
+            self._close_file()
+
+    def _next_batch(self):
+        """阻塞等待第一条记录，之后在 flush_interval 内尽量凑满一批"""
+        batch: List[Dict[str, Any]] = []
+        record = self._queue.get()
+        if record is None:
+            return batch, True
+        batch.append(record)
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                record = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if record is None:
+                return batch, True
+            batch.append(record)
+        return batch, False
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        try:
+            self._rotate_if_needed()
+            lines = []
+            for record in batch:
+                lines.append(json.dumps(record, ensure_ascii=False, default=str, separators=(',', ':')))
+            self._file.write("\n".join(lines) + "\n")
+            self._file.flush()
+            self.written += len(batch)
+        except Exception as e:
+            self.logger.error(f"Failed to write {len(batch)} decision records: {str(e)}")
+
+    def _rotate_if_needed(self):
+        today = datetime.now().strftime('%Y%m%d')
+        if self._file is not None and self._file_date == today:
+            return
+        self._close_file()
+        path = os.path.join(self.directory, f"{self.prefix}_{today}.jsonl")
+        self._file = open(path, 'a', encoding='utf-8')
+        self._file_date = today
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_decisions(path: str) -> List[Dict[str, Any]]:
+    """读取一个决策日志文件，便于事后分析"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# 使用示例
+if __name__ == "__main__":
+    decision_log = DecisionLog(directory='./output/decisions_demo')
+    decision_log.start()
+    for i in range(1000):
+        decision_log.log({'symbol': 'SC', 'bar_index': i, 'instruction': 'hold', 'time': datetime.now()})
+    decision_log.stop()
+    print(f"written={decision_log.written}, dropped={decision_log.dropped}")
@@ -0,0 +1,137 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from dealer.latency_tracker import percentile
+
+
+class DecisionWorker:
+    """
+    行情回调与 LLM 决策解耦的工作线程池。
+
+    回调线程只调用 submit() 把 bar 放进对应 key（通常是合约代码）的槽位，立即返回；
+    每个槽位只保留最新的一根 bar，尚未处理的旧 bar 会被直接替换（latest-wins）并计入丢弃数。
+    工作线程取出最新的 bar 调用 handler，得到决策后调用 on_result 执行交易。
+    同一个 key 同一时刻只会有一个工作线程在处理，保证 dealer 内部状态按顺序更新。
+    """
+
+    def __init__(self, handler: Callable[[Hashable, Any], Any],
+                 on_result: Optional[Callable[[Hashable, Any, Any], None]] = None,
+                 num_workers: int = 1, name: str = "decision",
+                 logger: Optional[logging.Logger] = None, age_window: int = 500):
+        self.handler = handler
+        self.on_result = on_result
+        self.num_workers = max(1, num_workers)
+        self.name = name
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._cond = threading.Condition()
+        self._pending: Dict[Hashable, Tuple[Any, float]] = {}
+        self._in_flight = set()
+        self._threads = []
+        self._running = False
+
+        self._submitted = 0
+        self._processed = 0
+        self._errors = 0
+        self._dropped: Dict[Hashable, int] = {}
+        self._queue_ages = deque(maxlen=age_window)
+        self._handle_times = deque(maxlen=age_window)
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"{self.name}-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self.logger.info(f"DecisionWorker '{self.name}' started with {self.num_workers} worker(s)")
+
+    def stop(self, timeout: Optional[float] = None):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self.logger.info(f"DecisionWorker '{self.name}' stopped. {self.format_metrics()}")
+
+    def submit(self, key: Hashable, item: Any):
+        """把最新的 bar 放入 key 对应的槽位，如果槽位中已有未处理的 bar 则替换它。"""
+        with self._cond:
+            self._submitted += 1
+            if key in self._pending:
+                self._dropped[key] = self._dropped.get(key, 0) + 1
+                self.logger.debug(f"DecisionWorker '{self.name}': superseded pending bar for {key}")
+            self._pending[key] = (item, time.monotonic())
+            self._cond.notify()
+
+    def _next_job(self) -> Optional[Tuple[Hashable, Any, float]]:
+        with self._cond:
+            while self._running:
+                for key in self._pending:
+                    if key not in self._in_flight:
+                        item, enqueued_at = self._pending.pop(key)
+                        self._in_flight.add(key)
+                        return key, item, enqueued_at
+                self._cond.wait()
+            return None
+
+    def _worker_loop(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            key, item, enqueued_at = job
+            started_at = time.monotonic()
+            try:
+                result = self.handler(key, item)
+                if self.on_result is not None:
+                    self.on_result(key, item, result)
+            except Exception as e:
+                with self._cond:
+                    self._errors += 1
+                self.logger.error(f"DecisionWorker '{self.name}' failed on {key}: {str(e)}", exc_info=True)
+            finally:
+                finished_at = time.monotonic()
+                with self._cond:
+                    self._in_flight.discard(key)
+                    self._processed += 1
+                    self._queue_ages.append(started_at - enqueued_at)
+                    self._handle_times.append(finished_at - started_at)
+                    # 处理期间可能有同一 key 的新 bar 到达，唤醒其他线程
+                    self._cond.notify_all()
+
+    def pending_count(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._cond:
+            ages = sorted(self._queue_ages)
+            handle_times = list(self._handle_times)
+            return {
+                "submitted": self._submitted,
+                "processed": self._processed,
+                "errors": self._errors,
+                "pending": len(self._pending),
+                "in_flight": len(self._in_flight),
+                "dropped": sum(self._dropped.values()),
+                "dropped_by_key": dict(self._dropped),
+                "queue_age_last": self._queue_ages[-1] if self._queue_ages else 0.0,
+                "queue_age_p50": percentile(ages, 0.5),
+                "queue_age_p95": percentile(ages, 0.95),
+                "queue_age_max": ages[-1] if ages else 0.0,
+                "handle_time_avg": sum(handle_times) / len(handle_times) if handle_times else 0.0,
+            }
+
+    def format_metrics(self) -> str:
+        m = self.get_metrics()
+        return (f"submitted={m['submitted']} processed={m['processed']} dropped={m['dropped']} "
+                f"errors={m['errors']} pending={m['pending']} "
+                f"queue_age p50={m['queue_age_p50']:.3f}s p95={m['queue_age_p95']:.3f}s max={m['queue_age_max']:.3f}s "
+                f"handle_avg={m['handle_time_avg']:.3f}s")
@@ -10,6 +10,7 @@ import pandas as pd
 import requests
 from core.utils.single_ton import Singleton
 from dealer.lazy import lazy
+from dealer.bar_store import BarStore
 import logging
 rq = None
 from core.config import get_key
@@ -35,8 +36,10 @@ class MainContractGetter(StringMatcher, metaclass=Singleton):
 
 
 class MainContractProvider:
-    def __init__(self) -> None:
+    def __init__(self, bar_store: Optional[BarStore] = None) -> None:
         self.code_getter = MainContractGetter()
+        # bar 数据优先从本地仓库读取，缺失的部分再从 rqdatac / AKShare 获取并写入仓库
+        self.bar_store = bar_store or BarStore(get_key('bar_store_dir', default='./data/bars'), fetcher=self._fetch_bars)
     
     def get_bar_data(self, name: str, period: Literal['1', '5', '15', '30', '60', 'D'] = '1', date: Optional[str] = None):
         """
@@ -56,6 +59,18 @@ class MainContractProvider:
         else:
             start_date = end_date - timedelta(days=5)  # 获取5天的分钟数据
         
+        return self.get_bar_range(name, period, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+
+    def get_bar_range(self, name: str, period: Literal['1', '5', '15', '30', '60', 'D'], start_date: str, end_date: str):
+        """
+        获取期货合约在指定日期区间内的bar数据，列名与 get_bar_data 一致
+        
+        :param name: 合约名称
+        :param period: 时间周期
+        :param start_date: 开始日期，格式为'YYYY-MM-DD'
+        :param end_date: 结束日期，格式为'YYYY-MM-DD'
+        :return: DataFrame包含bar数据
+        """
         frequency_map = {'1': '1m', '5': '5m', '15': '15m', '30': '30m', '60': '60m', 'D': '1d'}
         frequency = frequency_map[period]
         
@@ -63,19 +78,27 @@ class MainContractProvider:
         if code.endswith('0'):
             code = code[:-1]
         
-        df = self.get_rqbar(code, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'), frequency)
+        df = self.bar_store.get_bars(code, frequency, start_date, end_date)
         
-        if period != 'D':
-            df = df.reset_index()
-            df = df.rename(columns={'datetime': 'datetime', 'open': 'open', 'high': 'high', 'low': 'low', 'close': 'close', 'volume': 'volume', 'open_interest': 'hold'})
-        else:
-            df = df.reset_index()
-            #df['date'] = df['datetime'].dt.date
-            df = df.rename(columns={'date': 'date', 'open': 'open', 'high': 'high', 'low': 'low', 'close': 'close', 'volume': 'volume', 'open_interest': 'hold'})
-            #df = df.drop(columns=['datetime'])
+        if period == 'D':
+            df['date'] = df['datetime']
         
         return df
 
+    def _fetch_bars(self, code: str, frequency: str, start_date: str, end_date: str):
+        """BarStore 的数据源：有 rqdatac 权限时使用 rqdatac，否则退回 AKShare（只有最近一段数据）"""
+        if rq is not None:
+            df = self.get_rqbar(code, start_date, end_date, frequency)
+            # 没有取到数据时不能把整个区间记为已覆盖，否则之后不会再补取
+            if df is None or df.empty:
+                return None, False
+            return df.reset_index(), True
+
+        df = self.get_akbar(code, 'D' if frequency == '1d' else frequency)
+        if df is None:
+            return None, False
+        return df.reset_index(), False
+
     def get_main_contract(self):
         df = ak.futures_display_main_sina()
         df["content"] = df['symbol'] +'.'+df['exchange']+','+ df['name']
@@ -0,0 +1,133 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Dict, Hashable, Optional
+
+
+class LatencyTracker:
+    """
+    每根 bar 的耗时分解。
+
+    用 bar(symbol) 包住一次完整的 bar 处理，内部用 stage(name) 标记各个阶段。
+    阶段可以嵌套，记录的是扣除子阶段之后的自身耗时，所以各阶段之和约等于整根 bar 的耗时。
+    状态保存在线程局部变量中，多个合约在不同线程中并行处理时互不干扰。
+    """
+
+    TOTAL = "total"
+
+    def __init__(self, name: str = "dealer", logger: Optional[logging.Logger] = None,
+                 slow_bar_threshold: Optional[float] = None, window: int = 1000):
+        """
+        :param slow_bar_threshold: 单根 bar 总耗时超过该秒数时输出一条阶段分解日志，None 表示不输出
+        :param window: 每个合约每个阶段保留的最近样本数
+        """
+        self.name = name
+        self.logger = logger or logging.getLogger(__name__)
+        self.slow_bar_threshold = slow_bar_threshold
+        self.window = window
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._samples: Dict[Hashable, Dict[str, deque]] = {}
+        self._slow_bars = 0
+
+    @contextmanager
+    def bar(self, symbol: Hashable = None):
+        """记录一根 bar 的总耗时；嵌套调用时只有最外层生效"""
+        if getattr(self._local, "symbol", None) is not None:
+            yield
+            return
+
+        self._local.symbol = symbol if symbol is not None else self.name
+        self._local.stages = OrderedDict()
+        self._local.stack = []
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            total = time.perf_counter() - started_at
+            stages = self._local.stages
+            self._record(self._local.symbol, stages, total)
+            if self.slow_bar_threshold is not None and total > self.slow_bar_threshold:
+                with self._lock:
+                    self._slow_bars += 1
+                breakdown = ", ".join(f"{stage}={duration:.3f}s" for stage, duration in stages.items())
+                self.logger.warning(f"[{self.name}] slow bar for {self._local.symbol}: total={total:.3f}s ({breakdown})")
+            self._local.symbol = None
+
+    @contextmanager
+    def stage(self, name: str):
+        """记录一个阶段的耗时，不在 bar() 内调用时不做任何记录"""
+        if getattr(self._local, "symbol", None) is None:
+            yield
+            return
+
+        stack = self._local.stack
+        # 每层记录 [阶段名, 子阶段累计耗时]
+        stack.append([name, 0.0])
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started_at
+            _, child_time = stack.pop()
+            stages = self._local.stages
+            stages[name] = stages.get(name, 0.0) + elapsed - child_time
+            if stack:
+                stack[-1][1] += elapsed
+
+    def _record(self, symbol: Hashable, stages: Dict[str, float], total: float):
+        with self._lock:
+            samples = self._samples.setdefault(symbol, {})
+            for stage, duration in list(stages.items()) + [(self.TOTAL, total)]:
+                samples.setdefault(stage, deque(maxlen=self.window)).append(duration)
+
+    def get_stats(self) -> Dict[Hashable, Dict[str, Dict[str, float]]]:
+        """返回 {symbol: {stage: {count, avg, p50, p95, p99, max}}}，单位为秒"""
+        with self._lock:
+            snapshot = {symbol: {stage: sorted(values) for stage, values in stages.items()}
+                        for symbol, stages in self._samples.items()}
+        stats = {}
+        for symbol, stages in snapshot.items():
+            stats[symbol] = {}
+            for stage, values in stages.items():
+                stats[symbol][stage] = {
+                    "count": len(values),
+                    "avg": sum(values) / len(values),
+                    "p50": percentile(values, 0.5),
+                    "p95": percentile(values, 0.95),
+                    "p99": percentile(values, 0.99),
+                    "max": values[-1],
+                }
+        return stats
+
+    def report(self) -> str:
+        """每个合约一行总耗时，下面按平均耗时从高到低列出各阶段"""
+        stats = self.get_stats()
+        if not stats:
+            return f"[{self.name}] no bars timed"
+
+        lines = [f"[{self.name}] per-bar latency (seconds), slow bars: {self._slow_bars}"]
+        for symbol, stages in stats.items():
+            total = stages.get(self.TOTAL)
+            if total:
+                lines.append(f"{symbol}: bars={total['count']} avg={total['avg']:.3f} p50={total['p50']:.3f} "
+                             f"p95={total['p95']:.3f} p99={total['p99']:.3f} max={total['max']:.3f}")
+            ranked = sorted((item for item in stages.items() if item[0] != self.TOTAL),
+                            key=lambda item: item[1]["avg"], reverse=True)
+            for stage, s in ranked:
+                lines.append(f"  {stage:<14} avg={s['avg']:.3f} p50={s['p50']:.3f} p95={s['p95']:.3f} max={s['max']:.3f}")
+        return "\n".join(lines)
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._slow_bars = 0
+
+
+def percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
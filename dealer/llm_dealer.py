@@ -12,12 +12,16 @@ from ta.trend import MACD
 from ta.volatility import BollingerBands, AverageTrueRange
 from typing import Dict, List, Tuple, Literal, Optional, Union
 import logging
-from logging import FileHandler
 import re
-from datetime import datetime, timedelta, time as dt_time
-from dealer.trade_time import get_trading_end_time
+from datetime import datetime
+from dealer.session_calendar import SessionCalendar
+from dealer.bar_aggregator import BarAggregator, DAILY
+from dealer.time_normalizer import from_epoch_ns, local_date, normalize_bar, normalize_frame, to_epoch_ns
 import pytz
 from dealer.futures_provider import MainContractProvider
+from dealer.latency_tracker import LatencyTracker
+from dealer.news_service import NewsService
+from dealer.decision_log import DecisionLog
 # 设置北京时区
 beijing_tz = pytz.timezone('Asia/Shanghai')
 
@@ -113,16 +117,27 @@ class LLMDealer:
     def __init__(self, llm_client, symbol: str,data_provider: MainContractProvider,trade_rules:str="" ,
                  max_daily_bars: int = 60, max_hourly_bars: int = 30, max_minute_bars: int = 240,
                  backtest_date: Optional[str] = None, compact_mode: bool = False,
-                 max_position: int = 1):
+                 max_position: int = 1, latency_tracker: Optional[LatencyTracker] = None,
+                 news_service: Optional[NewsService] = None, news_poll_interval: float = 60.0,
+                 decision_log: Optional[DecisionLog] = None):
+        """
+        :param news_service: 后台新闻服务；实盘模式下未提供时使用进程内共享的 NewsService.default()
+        :param news_poll_interval: 本合约新闻源的轮询间隔（秒）
+        :param decision_log: 每根 bar 决策记录的异步日志，默认使用进程内共享的 DecisionLog
+        """
         self._setup_logging()
+        # 每根 bar 各阶段耗时，可传入设置了 slow_bar_threshold 的 tracker 记录慢 bar
+        self.latency = latency_tracker or LatencyTracker(f"LLMDealer-{symbol}", logger=self.logger)
         self.trade_rules = trade_rules
         self.symbol = symbol
-        self.night_closing_time = self._get_night_closing_time()
+        # 按品种的日盘/夜盘时段判断交易时间和距收盘时间
+        self.session_calendar = SessionCalendar.for_symbol(symbol)
+        self.decision_log = decision_log or DecisionLog.default()
         self.backtest_date = backtest_date
         self.data_provider = data_provider
         self.llm_client = llm_client
-        self.last_news_time = None
         self.news_summary = ""
+        self.news_version = 0
         self.is_backtest = backtest_date is not None
         self.max_daily_bars = max_daily_bars
         self.max_hourly_bars = max_hourly_bars
@@ -140,19 +155,26 @@ class LLMDealer:
         self.position_manager = TradePositionManager()
         self.total_profit = 0
 
-        self.trading_hours = [
-            (dt_time(9, 0), dt_time(11, 30)),
-            (dt_time(13, 0), dt_time(15, 0)),
-            (dt_time(21, 0), dt_time(23, 59)),
-            (dt_time(0, 0), dt_time(2, 30))
-        ]
         logging.basicConfig(level=logging.DEBUG)
         self.timezone = pytz.timezone('Asia/Shanghai') 
         
 
-        self.daily_history = self._initialize_history('D')
-        self.hourly_history = self._initialize_history('60')  
-        self.minute_history = self._initialize_history('1')
+        # 分钟、小时、日线历史由 1 分钟 bar 流增量合成，初始数据来自数据源
+        self.bars = BarAggregator(timeframes=(1, 60, DAILY),
+                                  max_bars={1: max_minute_bars, 60: max_hourly_bars, DAILY: max_daily_bars},
+                                  logger=self.logger)
+        self.bars.seed(DAILY, self._initialize_history('D'))
+        self.bars.seed(60, self._initialize_history('60'))
+        self.bars.seed(1, self._initialize_history('1'))
+
+        # 新闻在后台线程中抓取和汇总，bar 处理只读取最新摘要；回测模式下不读取新闻
+        self.news_service = news_service
+        if not self.is_backtest:
+            if self.news_service is None:
+                self.news_service = NewsService.default(llm_client, logger=self.logger)
+            if not self.news_service.has_source(symbol):
+                self.news_service.add_source(symbol, self._fetch_news, interval=news_poll_interval)
+            self.news_service.start()
 
     def _setup_logging(self):
         self.logger = logging.getLogger(__name__)
@@ -180,87 +202,26 @@ class LLMDealer:
         # Add the file handler to the logger
         self.logger.addHandler(file_handler)
 
-    def _get_latest_news(self):
-        if self.is_backtest:
-            return pd.DataFrame()  # 回测模式下不读取新闻
-        news_df = self.data_provider.get_futures_news(self.symbol, page_num=0, page_size=20)
-        if news_df is not None and not news_df.empty:
-            return news_df.sort_values('publish_time', ascending=False)
-        return pd.DataFrame()
-
-    def _summarize_news(self, news_df):
-        if news_df.empty:
-            return ""
-
-        news_text = "\n".join(f"- {row['title']}" for _, row in news_df.iterrows())
-        prompt = f"请将以下新闻整理成不超过200字的今日交易提示简报：\n\n{news_text}"
-        
-        summary = self.llm_client.one_chat(prompt)
-        return summary[:200]  # Ensure the summary doesn't exceed 200 characters
-
-    def _get_night_closing_time(self) -> Optional[dt_time]:
-        night_end = get_trading_end_time(self.symbol, 'night')
-        if isinstance(night_end, str) and ':' in night_end:
-            hour, minute = map(int, night_end.split(':'))
-            return dt_time(hour, minute)
-        return None
+    def _fetch_news(self, symbol: str):
+        return self.data_provider.get_futures_news(symbol, page_num=0, page_size=20)
 
     def _update_news(self, current_datetime):
-        if self.is_backtest:
+        """读取新闻服务中的最新摘要，摘要版本变化时返回 True"""
+        if self.news_service is None:
             return False  # 回测模式下不更新新闻
 
-        try:
-            news_df = self._get_latest_news()
-            if news_df.empty:
-                self.logger.info("No new news available")
-                return False
-
-            # 安全地解析新闻时间
-            def safe_parse_time(time_str):
-                try:
-                    # 假设时间戳是毫秒级的
-                    return pd.to_datetime(int(time_str) / 1000, unit='s', utc=True).tz_convert(beijing_tz)
-                except ValueError:
-                    # 如果失败，尝试直接解析字符串
-                    try:
-                        return pd.to_datetime(time_str).tz_localize(beijing_tz)
-                    except:
-                        self.logger.error(f"Failed to parse news time: {time_str}")
-                        return None
-
-            latest_news_time = safe_parse_time(news_df['publish_time'].iloc[0])
-            
-            if latest_news_time is None:
-                self.logger.warning("Failed to parse latest news time, skipping news update")
-                return False
-
-            if self.last_news_time is None or latest_news_time > self.last_news_time:
-                self.last_news_time = latest_news_time
-                new_summary = self._summarize_news(news_df)
-                if new_summary != self.news_summary:
-                    self.news_summary = new_summary
-                    self.logger.info(f"Updated news summary: {self.news_summary[:100]}...")
-                    return True
-
-            return False
-        except Exception as e:
-            self.logger.error(f"Error in _update_news: {str(e)}", exc_info=True)
+        summary, version = self.news_service.get_summary(self.symbol)
+        if version == self.news_version:
             return False
+        self.news_version = version
+        self.news_summary = summary
+        return True
        
     def _is_trading_time(self, dt: datetime) -> bool:
-        t = dt.time()
-        for start, end in self.trading_hours:
-            if start <= t <= end:
-                return True
-        return False
+        return self.session_calendar.is_trading_time(dt)
 
     def _filter_trading_data(self, df: pd.DataFrame) -> pd.DataFrame:
-        def is_trading_time(dt):
-            t = dt.time()
-            return any(start <= t <= end for start, end in self.trading_hours)
-        
-        mask = df['datetime'].apply(is_trading_time)
-        filtered_df = df[mask]
+        filtered_df = self.session_calendar.filter_frame(df)
         
         self.logger.debug(f"Trading hours filter: {len(df)} -> {len(filtered_df)} rows")
         return filtered_df
@@ -422,20 +383,23 @@ class LLMDealer:
         else:
             return df.tail(self.max_minute_bars)
 
+    @property
+    def minute_history(self) -> pd.DataFrame:
+        return self.bars.frame(1)
+
+    @property
+    def hourly_history(self) -> pd.DataFrame:
+        """小时线，最后一根为正在形成的小时 bar"""
+        return self.bars.frame(60)
+
+    @property
+    def daily_history(self) -> pd.DataFrame:
+        """日线，夜盘计入下一个交易日，最后一根为当前交易日"""
+        return self.bars.frame(DAILY)
+
     def _update_histories(self, bar: pd.Series):
-        """更新历史数据"""
-        # 更新分钟数据
-        self.minute_history = pd.concat([self.minute_history, bar.to_frame().T], ignore_index=True).tail(self.max_minute_bars)
-        
-        # 更新小时数据
-        if bar['datetime'].minute == 0:
-            self.hourly_history = pd.concat([self.hourly_history, bar.to_frame().T], ignore_index=True).tail(self.max_hourly_bars)
-        
-        # 更新日线数据
-        if bar['datetime'].hour == 15 and bar['datetime'].minute == 0:
-            daily_bar = bar.copy()
-            daily_bar['datetime'] = daily_bar['datetime'].date()
-            self.daily_history = pd.concat([self.daily_history, daily_bar.to_frame().T], ignore_index=True).tail(self.max_daily_bars)
+        """把 1 分钟 bar 合入分钟、小时和日线历史"""
+        self.bars.update(bar)
 
     def _format_history(self) -> dict:
         """格式化历史数据，确保所有数据都被包含，并且格式一致"""
@@ -483,7 +447,8 @@ class LLMDealer:
         if self.today_minute_bars.empty:
             return "Insufficient data for LLM input"
         
-        today_data = self._calculate_indicators(self.today_minute_bars)
+        with self.latency.stage("indicators"):
+            today_data = self._calculate_indicators(self.today_minute_bars)
         latest_indicators = today_data.iloc[-1]
         
         # Compress historical data
@@ -697,205 +662,111 @@ class LLMDealer:
         self.position_manager.close_positions(current_price, float('inf'), False, current_datetime)
 
     def _force_close_if_needed(self, current_datetime: pd.Timestamp, current_price: float):
-        day_closing_time = dt_time(14, 55)
-        night_session_start = dt_time(21, 0)
-
-        current_time = current_datetime.time()
-        is_day_session = current_time < night_session_start and current_time >= dt_time(9, 0)
-        is_night_session = current_time >= night_session_start or current_time < dt_time(9, 0)
+        session = self.session_calendar.session_of(current_datetime)
+        minutes_left = self.session_calendar.minutes_until_close(current_datetime)
 
-        if is_day_session and current_time >= day_closing_time:
+        # 日盘和夜盘都在收盘前 5 分钟内强制平仓
+        if session == 'day' and minutes_left <= 5:
             self._close_all_positions(current_price, current_datetime)
             self.logger.info("日盘强制平仓")
-        elif is_night_session and self.night_closing_time:
-            # Check if it's within 5 minutes of the night closing time
-            closing_window_start = (datetime.combine(datetime.min, self.night_closing_time) - timedelta(minutes=5)).time()
-            if closing_window_start <= current_time <= self.night_closing_time:
-                self._close_all_positions(current_price, current_datetime)
-                self.logger.info("夜盘强制平仓")
-            else:
-                self.logger.info(f"夜盘交易，当前仓位：{self.position_manager.get_current_position()}")
-        elif is_night_session and not self.night_closing_time:
-            self.logger.info(f"夜盘交易（无强制平仓时间），当前仓位：{self.position_manager.get_current_position()}")
-
-    def _get_today_bar_index(self, timestamp: pd.Timestamp) -> int:
-        """
-        Calculate the current bar index based on today's minute bars
-        """
-        if self.today_minute_bars.empty:
-            return 0
-        
-        try:
-            # Convert 'datetime' column to datetime type if it's not already
-            if not pd.api.types.is_datetime64_any_dtype(self.today_minute_bars['datetime']):
-                self.today_minute_bars['datetime'] = pd.to_datetime(self.today_minute_bars['datetime'], utc=True)
-            
-            # Now check if datetimes are timezone-aware
-            if self.today_minute_bars['datetime'].dt.tz is None:
-                # If not timezone-aware, assume they're in local time and make them timezone-aware
-                self.today_minute_bars['datetime'] = self.today_minute_bars['datetime'].dt.tz_localize('Asia/Shanghai')
-            
-            # Convert to UTC
-            self.today_minute_bars['datetime'] = self.today_minute_bars['datetime'].dt.tz_convert('UTC')
-            
-            # Ensure the input timestamp is in UTC
-            utc_timestamp = timestamp.tz_convert('UTC')
-            
-            today_bars = self.today_minute_bars[self.today_minute_bars['datetime'].dt.date == utc_timestamp.date()]
-            return len(today_bars)
-        except Exception as e:
-            self.logger.error(f"Error in _get_today_bar_index: {str(e)}", exc_info=True)
-            return 0
-
-    def _is_trading_time(self, timestamp: pd.Timestamp) -> bool:
-        """
-        判断给定时间是否在交易时间内
-        """
-        # 定义交易时间段（根据实际情况调整）
-        trading_sessions = [
-            ((9, 0), (11, 30)),   # 上午交易时段
-            ((13, 0), (15, 0)),   # 下午交易时段
-            ((21, 0), (23, 59)),  # 夜盘交易时段开始
-            ((0, 0), (2, 30))     # 夜盘交易时段结束（跨天）
-        ]
-        
-        time = timestamp.time()
-        for start, end in trading_sessions:
-            if start <= (time.hour, time.minute) <= end:
-                return True
-        return False
+        elif session == 'night' and minutes_left <= 5:
+            self._close_all_positions(current_price, current_datetime)
+            self.logger.info("夜盘强制平仓")
+        elif session == 'night':
+            self.logger.info(f"夜盘交易，当前仓位：{self.position_manager.get_current_position()}")
 
     def _log_bar_info(self, bar: Union[pd.Series, dict], news: str, trade_instruction: str,trade_reason, trade_plan):
+        """把本根 bar 的决策记录交给后台日志线程，这里只组装字典"""
         try:
-            # Ensure the output directory exists
-            os.makedirs('./output', exist_ok=True)
-
-            # Create or get the file handler for the current date
-            current_date = datetime.now().strftime('%Y%m%d')
-            file_handler = next((h for h in self.logger.handlers if isinstance(h, FileHandler) and h.baseFilename.endswith(f'{current_date}.log')), None)
-            
-            if not file_handler:
-                # If the file handler for the current date doesn't exist, create a new one
-                file_path = f'./output/log{current_date}.log'
-                file_handler = FileHandler(file_path)
-                file_handler.setLevel(logging.DEBUG)
-                file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-                self.logger.addHandler(file_handler)
-
-                # Remove old file handlers
-                for handler in self.logger.handlers[:]:
-                    if isinstance(handler, FileHandler) and not handler.baseFilename.endswith(f'{current_date}.log'):
-                        self.logger.removeHandler(handler)
-                        handler.close()
-
-            # Convert bar to pd.Series if it's a dict
-            if isinstance(bar, dict):
-                bar = pd.Series(bar)
-
-            # Format the log message
-            log_msg = f"""
-            时间: {pd.to_datetime(bar['datetime'])}, Bar Index: {self._get_today_bar_index(pd.to_datetime(bar['datetime']))}
-            价格: 开 {bar['open']:.2f}, 高 {bar['high']:.2f}, 低 {bar['low']:.2f}, 收 {bar['close']:.2f}
-            成交量: {bar['volume']}, 持仓量: {bar.get('open_interest', bar.get('hold', 'N/A'))}
-            新闻: {news[:200] + '...' if news else '无新闻数据'}
-            交易指令: {trade_instruction}
-            交易理由: {trade_reason}
-            交易计划: {trade_plan}
-            当前持仓: {self.position_manager.get_current_position()}
-            盈亏情况:
-            {self.position_manager.calculate_profits(bar['close'])}
-            {self.position_manager.get_position_details()}
-            """
-
-            # Log to file (DEBUG level includes all information)
-            self.logger.debug(log_msg)
+            current_position = self.position_manager.get_current_position()
+            self.decision_log.log({
+                'symbol': self.symbol,
+                'time': bar['datetime'],
+                # today_minute_bars 中已包含当前 bar
+                'bar_index': len(self.today_minute_bars),
+                'open': float(bar['open']),
+                'high': float(bar['high']),
+                'low': float(bar['low']),
+                'close': float(bar['close']),
+                'volume': bar['volume'],
+                'hold': bar.get('open_interest', bar.get('hold')),
+                'news': news[:200] if news else '',
+                'instruction': trade_instruction,
+                'reason': trade_reason,
+                'plan': trade_plan,
+                'position': current_position,
+                'profits': self.position_manager.calculate_profits(bar['close']),
+                'open_positions': [(pos.position_type.name, pos.entry_price, pos.entry_time)
+                                   for pos in self.position_manager.positions if not pos.is_closed()],
+            })
 
             # Log to console only if there's a trade instruction (excluding 'hold')
             if trade_instruction.lower() != 'hold':
-                console_msg = f"时间: {pd.to_datetime(bar['datetime'])}, 价格: {bar['close']:.2f}, 交易指令: {trade_instruction}, 交易理由: {trade_reason[:50]}..., 当前持仓: {self.position_manager.get_current_position()}"
+                console_msg = f"时间: {bar['datetime']}, 价格: {bar['close']:.2f}, 交易指令: {trade_instruction}, 交易理由: {trade_reason[:50]}..., 当前持仓: {current_position}"
                 self.logger.info(console_msg)
 
         except Exception as e:
             self.logger.error(f"Error in _log_bar_info: {str(e)}", exc_info=True)
 
     def parse_timestamp(self, timestamp):
-        """解析时间戳"""
-        self.logger.debug(f"Attempting to parse timestamp: {timestamp}")
+        """解析时间戳，返回带北京时区的时间；解析失败时返回当前时间"""
         try:
-            # 尝试多种可能的时间戳格式
-            if isinstance(timestamp, (int, float)):
-                # 如果时间戳是以毫秒为单位
-                if timestamp > 1e12:
-                    # 检查时间戳是否超出合理范围（2262年之后）
-                    if timestamp > 9999999999999:
-                        self.logger.warning(f"Abnormally large timestamp detected: {timestamp}")
-                        # 尝试将其解释为纳秒级时间戳
-                        try:
-                            return pd.Timestamp(timestamp, unit='ns').tz_localize(beijing_tz)
-                        except Exception:
-                            self.logger.error(f"Failed to parse abnormally large timestamp: {timestamp}")
-                            return datetime.now(beijing_tz)
-                    return datetime.fromtimestamp(timestamp / 1000, tz=beijing_tz)
-                # 如果时间戳是以秒为单位
-                else:
-                    return datetime.fromtimestamp(timestamp, tz=beijing_tz)
-            elif isinstance(timestamp, str):
-                # 尝试使用dateutil解析字符串格式的时间戳
-                import dateutil.parser as parser
-                return parser.parse(timestamp).astimezone(beijing_tz)
-            elif isinstance(timestamp, pd.Timestamp):
-                return timestamp.tz_localize(beijing_tz) if timestamp.tz is None else timestamp.tz_convert(beijing_tz)
-            elif isinstance(timestamp, datetime):
-                return timestamp.astimezone(beijing_tz) if timestamp.tzinfo else beijing_tz.localize(timestamp)
-            else:
-                raise ValueError(f"Unexpected timestamp type: {type(timestamp)}")
+            return from_epoch_ns(to_epoch_ns(timestamp))
         except Exception as e:
             self.logger.error(f"Error parsing timestamp {timestamp}: {str(e)}")
-            # 如果所有方法都失败，返回当前时间作为后备选项
             self.logger.warning("Using current time as fallback")
             return datetime.now(beijing_tz)
 
     def process_bar(self, bar: pd.Series, news: str = "") -> Tuple[str, Union[int, str], str]:
+        with self.latency.bar(self.symbol):
+            return self._process_bar(bar, news)
+
+    def get_latency_report(self) -> str:
+        return self.latency.report()
+
+    def shutdown(self):
+        """新闻服务由进程内的 dealer 共享，不在这里停止，进程退出时自动停止"""
+
+    def _process_bar(self, bar: pd.Series, news: str = "") -> Tuple[str, Union[int, str], str]:
         try:
-            # 确保使用正确的时间戳键
-            time_key = 'time' if 'time' in bar else 'datetime'
-            bar['datetime'] = self.parse_timestamp(bar[time_key])
-            bar_date = bar['datetime'].date()
+            # 时间只在这里转换一次：ts 为 int64 epoch 纳秒，datetime 为对应的北京时间
+            normalize_bar(bar)
+            bar_date = local_date(bar['ts'])
 
             if self.current_date != bar_date:
                 self.current_date = bar_date
-                self.today_minute_bars = self._get_today_data(bar_date)
-                # Ensure the datetime column is in datetime format and timezone-aware
-                self.today_minute_bars['datetime'] = pd.to_datetime(self.today_minute_bars['datetime'], utc=True)
-                
-                # If the datetimes are not timezone-aware, assume they're in local time and make them timezone-aware
-                if self.today_minute_bars['datetime'].dt.tz is None:
-                    self.today_minute_bars['datetime'] = self.today_minute_bars['datetime'].dt.tz_localize('Asia/Shanghai')
-                
-                # Convert to UTC
-                self.today_minute_bars['datetime'] = self.today_minute_bars['datetime'].dt.tz_convert('UTC')
+                with self.latency.stage("today_data"):
+                    self.today_minute_bars = normalize_frame(self._get_today_data(bar_date))
                 self.position = 0
                 self.last_trade_date = bar_date
                 
                 if not self.is_backtest:
-                    self.last_news_time = None
+                    # 新的交易日重新把当前摘要提供给第一根 bar
+                    self.news_version = 0
                     self.news_summary = ""
 
             if not self._is_trading_time(bar['datetime']):
                 return "hold", 0, ""
 
             self.today_minute_bars = pd.concat([self.today_minute_bars, bar.to_frame().T], ignore_index=True)
+            self._update_histories(bar)
 
             news_updated = False
             if not self.is_backtest:
-                news_updated = self._update_news(bar['datetime'])
+                with self.latency.stage("news"):
+                    news_updated = self._update_news(bar['datetime'])
 
-            llm_input = self._prepare_llm_input(bar, self.news_summary if (not self.is_backtest and (news_updated or len(self.today_minute_bars) == 1)) else "")
+            with self.latency.stage("prompt"):
+                llm_input = self._prepare_llm_input(bar, self.news_summary if (not self.is_backtest and (news_updated or len(self.today_minute_bars) == 1)) else "")
             
-            llm_response = self.llm_client.one_chat(llm_input)
-            trade_instruction, quantity, next_msg, trade_reason, trade_plan = self._parse_llm_output(llm_response)
-            self._execute_trade(trade_instruction, quantity, bar, trade_reason, trade_plan)
-            self._log_bar_info(bar, self.news_summary if news_updated else "", f"{trade_instruction} {quantity}", trade_reason, trade_plan)
+            with self.latency.stage("llm"):
+                llm_response = self.llm_client.one_chat(llm_input)
+            with self.latency.stage("parse"):
+                trade_instruction, quantity, next_msg, trade_reason, trade_plan = self._parse_llm_output(llm_response)
+            with self.latency.stage("execute"):
+                self._execute_trade(trade_instruction, quantity, bar, trade_reason, trade_plan)
+            with self.latency.stage("log"):
+                self._log_bar_info(bar, self.news_summary if news_updated else "", f"{trade_instruction} {quantity}", trade_reason, trade_plan)
             self.last_msg = next_msg
             return trade_instruction, quantity, next_msg, trade_reason, trade_plan
         except Exception as e:
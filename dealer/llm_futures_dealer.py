@@ -2,15 +2,25 @@ import logging
 import json
 import os
 import re
+import threading
+import time
 import pandas as pd
 import pytz
 from typing import Dict, List, Tuple, Literal, Optional, Union
-from datetime import datetime, timedelta, time as dt_time
+from datetime import datetime
 from enum import Enum
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import ExitStack
 
 import ta
-from dealer.trade_time import get_trading_end_time
+from dealer.session_calendar import SessionCalendar
+from dealer.bar_aggregator import BarAggregator, DAILY
+from dealer.time_normalizer import from_epoch_ns, local_date, normalize_bar, normalize_frame, to_epoch_ns
 from dealer.futures_provider import MainContractProvider
+from dealer.batch_prompt import BatchDecisionRunner
+from dealer.latency_tracker import LatencyTracker
+from dealer.news_service import NewsService
+from dealer.decision_log import DecisionLog
 
 # 设置北京时区
 beijing_tz = pytz.timezone('Asia/Shanghai')
@@ -103,34 +113,66 @@ class TradePositionManager:
         return details
 
 class ContractState:
-    def __init__(self, symbol: str, max_position: int):
+    def __init__(self, symbol: str, max_position: int, max_bars: Optional[Dict] = None):
+        """
+        :param max_bars: 各周期保留的 bar 数，{1: 分钟, 60: 小时, 'D': 日线}
+        """
         self.symbol = symbol
         self.max_position = max_position
         self.position_manager = TradePositionManager()
-        self.daily_history = pd.DataFrame()
-        self.hourly_history = pd.DataFrame()
-        self.minute_history = pd.DataFrame()
+        # 分钟、小时、日线历史由 1 分钟 bar 流增量合成
+        self.bars = BarAggregator(timeframes=(1, 60, DAILY), max_bars=max_bars or 240)
         self.today_minute_bars = pd.DataFrame()
         self.last_msg = ""
         self.last_trade_date = None
         self.current_date = None
         self.total_profit = 0
-        self.night_closing_time = None
-        self.last_news_time = None
+        # 按品种的日盘/夜盘时段判断交易时间和距收盘时间
+        self.session_calendar = SessionCalendar.for_symbol(symbol)
         self.news_summary = ""
+        self.news_version = 0
+        # 同一合约的 bar 必须串行处理，不同合约之间互不影响
+        self.lock = threading.Lock()
+
+    @property
+    def minute_history(self) -> pd.DataFrame:
+        return self.bars.frame(1)
+
+    @property
+    def hourly_history(self) -> pd.DataFrame:
+        return self.bars.frame(60)
+
+    @property
+    def daily_history(self) -> pd.DataFrame:
+        return self.bars.frame(DAILY)
 
 class LLMFuturesDealer:
     def __init__(self, llm_client, symbols: List[str], data_provider: MainContractProvider, trade_rules: str = "",
                  max_daily_bars: int = 60, max_hourly_bars: int = 30, max_minute_bars: int = 240,
                  backtest_date: Optional[str] = None, compact_mode: bool = False,
-                 max_positions: Dict[str, int] = None):
+                 max_positions: Dict[str, int] = None, max_concurrency: int = 1,
+                 bar_deadline: Optional[float] = None, batch_size: int = 1,
+                 max_batch_prompt_chars: Optional[int] = None,
+                 latency_tracker: Optional[LatencyTracker] = None,
+                 news_service: Optional[NewsService] = None, news_poll_interval: float = 60.0,
+                 decision_log: Optional[DecisionLog] = None):
+        """
+        :param max_concurrency: process_bars 同时处理的合约数上限，1 表示逐个合约顺序处理
+        :param bar_deadline: 每批 bar 的处理时限（秒），超时未完成的合约返回 hold，None 表示不限时
+        :param batch_size: 大于 1 时 process_bars 把最多 batch_size 个合约合并到一个 prompt 中决策
+        :param max_batch_prompt_chars: 批量 prompt 超过该长度时自动拆成更小的批次
+        :param latency_tracker: 每根 bar 各阶段耗时统计，可设置 slow_bar_threshold 记录慢 bar
+        :param news_service: 后台新闻服务；实盘模式下未提供时使用进程内共享的 NewsService.default()
+        :param news_poll_interval: 每个合约新闻源的轮询间隔（秒）
+        :param decision_log: 每根 bar 决策记录的异步日志，默认使用进程内共享的 DecisionLog
+        """
         self._setup_logging()
+        self.latency = latency_tracker or LatencyTracker("LLMFuturesDealer", logger=self.logger)
+        self.decision_log = decision_log or DecisionLog.default()
         self.trade_rules = trade_rules
         self.symbols = symbols
         self.data_provider = data_provider
         self.llm_client = llm_client
-        self.last_news_time = None
-        self.news_summary = ""
         self.is_backtest = backtest_date is not None
         self.max_daily_bars = max_daily_bars
         self.max_hourly_bars = max_hourly_bars
@@ -141,15 +183,27 @@ class LLMFuturesDealer:
         self.contract_states = {}
         for symbol in symbols:
             max_position = max_positions.get(symbol, 1) if max_positions else 1
-            self.contract_states[symbol] = ContractState(symbol, max_position)
-            self.contract_states[symbol].night_closing_time = self._get_night_closing_time(symbol)
-
-        self.trading_hours = [
-            (dt_time(9, 0), dt_time(11, 30)),
-            (dt_time(13, 0), dt_time(15, 0)),
-            (dt_time(21, 0), dt_time(23, 59)),
-            (dt_time(0, 0), dt_time(2, 30))
-        ]
+            self.contract_states[symbol] = ContractState(
+                symbol, max_position, {1: max_minute_bars, 60: max_hourly_bars, DAILY: max_daily_bars})
+
+        self.max_concurrency = max(1, max_concurrency)
+        self.bar_deadline = bar_deadline
+        self.batch_size = max(1, batch_size)
+        self.max_batch_prompt_chars = max_batch_prompt_chars
+        self._executor = None
+        if self.max_concurrency > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="futures-dealer")
+
+        # 新闻在后台线程中抓取和汇总，bar 处理只读取最新摘要；回测模式下不读取新闻
+        self.news_service = news_service
+        if not self.is_backtest:
+            if self.news_service is None:
+                self.news_service = NewsService.default(llm_client, content_chars=100, logger=self.logger)
+            self.news_service.add_listener(self._on_news_summary)
+            for symbol in symbols:
+                if not self.news_service.has_source(symbol):
+                    self.news_service.add_source(symbol, self._fetch_news, interval=news_poll_interval)
+            self.news_service.start()
 
     def _setup_logging(self):
         self.logger = logging.getLogger(__name__)
@@ -168,102 +222,31 @@ class LLMFuturesDealer:
         file_handler.setFormatter(formatter)
         self.logger.addHandler(file_handler)
 
-    def _get_night_closing_time(self, symbol: str) -> Optional[dt_time]:
-        night_end = get_trading_end_time(symbol, 'night')
-        if isinstance(night_end, str) and ':' in night_end:
-            hour, minute = map(int, night_end.split(':'))
-            return dt_time(hour, minute)
-        return None
-
-    def _get_latest_news(self, symbol: str):
-        if self.is_backtest:
-            return pd.DataFrame()
-        news_df = self.data_provider.get_futures_news(symbol, page_num=0, page_size=20)
-        if news_df is not None and not news_df.empty:
-            return news_df.sort_values('publish_time', ascending=False)
-        return pd.DataFrame()
+    def _fetch_news(self, symbol: str):
+        return self.data_provider.get_futures_news(symbol, page_num=0, page_size=20)
 
-    def _summarize_news(self, news_df: pd.DataFrame) -> str:
-        """
-        使用LLM客户端summarize新闻。
-        
-        :param news_df: 包含新闻的DataFrame
-        :return: 汇总后的新闻摘要
-        """
-        if news_df.empty:
-            return ""
-
-        try:
-            news_text = "\n".join(f"- {row['title']}: {row['content'][:100]}..." for _, row in news_df.iterrows())
-            prompt = f"请将以下新闻整理成不超过200字的今日交易提示简报：\n\n{news_text}"
-            
-            summary = self.llm_client.one_chat(prompt)
-            return summary[:200]  # 确保摘要不超过200字
-        except Exception as e:
-            self.logger.error(f"Error summarizing news: {str(e)}")
-            return "无法汇总新闻，请查看原始新闻内容。"
+    def _on_news_summary(self, symbol: str, summary: str):
+        if symbol in self.contract_states:
+            self._log_full_news_summary(symbol, summary)
 
     def _update_news(self, symbol: str, current_datetime: datetime) -> bool:
         """
-        更新指定合约的新闻信息。
+        读取新闻服务中指定合约的最新摘要。
         
         :param symbol: 合约代码
         :param current_datetime: 当前日期时间
-        :return: 如果新闻被更新则返回True，否则返回False
+        :return: 摘要版本发生变化时返回True，否则返回False
         """
-        if self.is_backtest:
+        if self.news_service is None:
             return False
 
-        try:
-            contract_state = self.contract_states[symbol]
-            
-            # 获取最新新闻
-            news_df = self._get_latest_news(symbol)
-            if news_df.empty:
-                self.logger.info(f"No new news available for {symbol}")
-                return False
-
-            def safe_parse_time(time_str: str) -> Optional[datetime]:
-                try:
-                    # 假设时间戳是毫秒级的
-                    return pd.to_datetime(int(time_str) / 1000, unit='s', utc=True).tz_convert(self.timezone)
-                except ValueError:
-                    # 如果失败，尝试直接解析字符串
-                    try:
-                        return pd.to_datetime(time_str).tz_localize(self.timezone)
-                    except Exception as e:
-                        self.logger.error(f"Failed to parse news time: {time_str}. Error: {str(e)}")
-                        return None
-
-            latest_news_time = safe_parse_time(news_df['publish_time'].iloc[0])
-            
-            if latest_news_time is None:
-                self.logger.warning(f"Failed to parse latest news time for {symbol}, skipping news update")
-                return False
-
-            if contract_state.last_news_time is None or latest_news_time > contract_state.last_news_time:
-                contract_state.last_news_time = latest_news_time
-                
-                # 汇总新闻
-                new_summary = self._summarize_news(news_df)
-                
-                if new_summary != contract_state.news_summary:
-                    contract_state.news_summary = new_summary
-                    self.logger.info(f"Updated news summary for {symbol}: {contract_state.news_summary[:100]}...")
-                    
-                    # 记录完整的新闻摘要到日志文件
-                    self._log_full_news_summary(symbol, contract_state.news_summary)
-                    
-                    return True
-                else:
-                    self.logger.info(f"No significant changes in news summary for {symbol}")
-            else:
-                self.logger.debug(f"No new news for {symbol} since last update")
-
-            return False
-        except Exception as e:
-            self.logger.error(f"Error in _update_news for {symbol}: {str(e)}", exc_info=True)
+        contract_state = self.contract_states[symbol]
+        summary, version = self.news_service.get_summary(symbol)
+        if version == contract_state.news_version:
             return False
+        contract_state.news_version = version
+        contract_state.news_summary = summary
+        return True
 
     def _log_full_news_summary(self, symbol: str, news_summary: str):
         """
@@ -286,20 +269,11 @@ class LLMFuturesDealer:
         except Exception as e:
             self.logger.error(f"Error logging full news summary for {symbol}: {str(e)}")
 
-    def _is_trading_time(self, dt: datetime) -> bool:
-        t = dt.time()
-        for start, end in self.trading_hours:
-            if start <= t <= end:
-                return True
-        return False
-
-    def _filter_trading_data(self, df: pd.DataFrame) -> pd.DataFrame:
-        def is_trading_time(dt):
-            t = dt.time()
-            return any(start <= t <= end for start, end in self.trading_hours)
-        
-        mask = df['datetime'].apply(is_trading_time)
-        filtered_df = df[mask]
+    def _is_trading_time(self, symbol: str, dt: datetime) -> bool:
+        return self.contract_states[symbol].session_calendar.is_trading_time(dt)
+
+    def _filter_trading_data(self, symbol: str, df: pd.DataFrame) -> pd.DataFrame:
+        filtered_df = self.contract_states[symbol].session_calendar.filter_frame(df)
         
         self.logger.debug(f"Trading hours filter: {len(df)} -> {len(filtered_df)} rows")
         return filtered_df
@@ -334,11 +308,11 @@ class LLMFuturesDealer:
 
         return filtered_data
 
-    def _validate_and_prepare_data(self, df: pd.DataFrame, date: str) -> pd.DataFrame:
+    def _validate_and_prepare_data(self, symbol: str, df: pd.DataFrame, date: str) -> pd.DataFrame:
         original_len = len(df)
         df['datetime'] = pd.to_datetime(df['datetime'])
         df = df[df['datetime'].dt.date == pd.to_datetime(date).date()]
-        df = self._filter_trading_data(df)
+        df = self._filter_trading_data(symbol, df)
         
         self.logger.info(f"Bars for date {date}: Original: {original_len}, After filtering: {len(df)}")
         
@@ -416,8 +390,81 @@ class LLMFuturesDealer:
         contract_state = self.contract_states[symbol]
         if contract_state.today_minute_bars.empty:
             return "Insufficient data for LLM input"
+
+        input_template = f"""
+        {self._prompt_preamble()}
+
+        {self._prepare_contract_section(symbol, bar, news)}
+
+        {self._prompt_rules(bar)}
+
+        请根据以上信息，给出交易指令或选择不交易（hold），并提供下一次需要的消息。
+        请以JSON格式输出，包含以下字段：
+        {self._prompt_output_fields()}
+
+        请确保输出的JSON格式正确，并用```json 和 ``` 包裹。
+        """
+        return input_template
+
+    def _prepare_batch_llm_input(self, symbols: List[str], bars: Dict[str, pd.Series], news: Dict[str, str]) -> str:
+        """多个合约共用一份角色说明、规则和输出格式，只有合约状态部分按合约重复"""
+        sections = "\n\n".join(
+            f"===== {symbol} =====\n{self._prepare_contract_section(symbol, bars[symbol], news.get(symbol, ''))}"
+            for symbol in symbols
+        )
+        first_bar = bars[symbols[0]]
+
+        input_template = f"""
+        {self._prompt_preamble()}
+        本次需要同时为以下 {len(symbols)} 个合约分别做出决策：{', '.join(symbols)}
+
+        {sections}
+
+        {self._prompt_rules(first_bar)}
+
+        请根据以上信息，为每个合约分别给出交易指令或选择不交易（hold），并提供该合约下一次需要的消息。
+        请以JSON数组格式输出，每个合约一个元素，每个元素包含以下字段：
+        - symbol: 合约代码（字符串，必须与上面给出的合约代码一致）
+        {self._prompt_output_fields()}
+
+        请确保输出的JSON格式正确，数组中每个合约恰好出现一次，并用```json 和 ``` 包裹。
+        """
+        return input_template
+
+    def _prompt_preamble(self) -> str:
+        return f"""你是一位经验老道的期货交易员，熟悉期货规律，掌握交易中获利的技巧。不放弃每个机会，也随时警惕风险。你认真思考，审视数据，做出交易决策。
+        今天执行的日内交易策略。所有开仓都需要在当天收盘前平仓，不留过夜仓位。你看到数据的周期是：1分钟
+        注意：历史信息不会保留，如果有留给后续使用的信息，需要记录在 next_message 中。
         
-        today_data = self._calculate_indicators(contract_state.today_minute_bars)
+        {f"交易中注意遵循以下规则:{self.trade_rules}" if self.trade_rules else ""}"""
+
+    def _prompt_rules(self, bar: pd.Series) -> str:
+        return f"""请注意：
+        1. 日内仓位需要在每天15:00之前平仓。
+        2. 当前时间为 {bar['datetime'].strftime('%H:%M')}，请根据时间决定是否需要平仓。
+        3. 开仓指令格式：
+           - 买入：'buy 数量'（例如：'buy 2' 或 'buy all'）
+           - 卖空：'short 数量'（例如：'short 2' 或 'short all'）
+        4. 平仓指令格式：
+           - 卖出平多：'sell 数量'（例如：'sell 2' 或 'sell all'）
+           - 买入平空：'cover 数量'（例如：'cover 2' 或 'cover all'）
+        5. 当前持仓已经达到最大值或最小值时，请勿继续开仓。
+        6. 请提供交易理由和交易计划（包括止损区间和目标价格预测）。
+        7. 即使选择持仓不变（hold），也可以根据最新行情修改交易计划。如果行情变化导致预期发生变化，请更新 trade_plan。"""
+
+    def _prompt_output_fields(self) -> str:
+        return """- trade_instruction: 交易指令（字符串，例如 "buy 2", "sell all", "short 1", "cover all" 或 "hold"）
+        - next_message: 下一次需要的消息（字符串）
+        - trade_reason: 此刻交易的理由（字符串）
+        - trade_plan: 交易计划，包括止损区间和目标价格预测，可以根据最新行情进行修改（字符串）"""
+
+    def _prepare_contract_section(self, symbol: str, bar: pd.Series, news: str) -> str:
+        contract_state = self.contract_states[symbol]
+        if contract_state.today_minute_bars.empty:
+            return f"当前合约: {symbol}\n        数据不足"
+
+        with self.latency.stage("indicators"):
+            today_data = self._calculate_indicators(contract_state.today_minute_bars)
         latest_indicators = today_data.iloc[-1]
         
         daily_summary = self._compress_history(contract_state.daily_history, 'D')
@@ -457,14 +504,7 @@ class LLMFuturesDealer:
             5. 这条消息只会出现以此，如果有值得记录的信息，需要保留在 next_message 中
             """
 
-        input_template = f"""
-        你是一位经验老道的期货交易员，熟悉期货规律，掌握交易中获利的技巧。不放弃每个机会，也随时警惕风险。你认真思考，审视数据，做出交易决策。
-        今天执行的日内交易策略。所有开仓都需要在当天收盘前平仓，不留过夜仓位。你看到数据的周期是：1分钟
-        注意：历史信息不会保留，如果有留给后续使用的信息，需要记录在 next_message 中。
-        
-        {f"交易中注意遵循以下规则:{self.trade_rules}" if self.trade_rules else ""}
-
-        当前合约: {symbol}
+        return f"""当前合约: {symbol}
         上一次的消息: {contract_state.last_msg}
         当前 bar index: {len(contract_state.today_minute_bars) - 1}
 
@@ -497,31 +537,7 @@ class LLMFuturesDealer:
         盈亏情况:
         {profit_info}
 
-        {position_details}
-
-        请注意：
-        1. 日内仓位需要在每天15:00之前平仓。
-        2. 当前时间为 {bar['datetime'].strftime('%H:%M')}，请根据时间决定是否需要平仓。
-        3. 开仓指令格式：
-           - 买入：'buy 数量'（例如：'buy 2' 或 'buy all'）
-           - 卖空：'short 数量'（例如：'short 2' 或 'short all'）
-        4. 平仓指令格式：
-           - 卖出平多：'sell 数量'（例如：'sell 2' 或 'sell all'）
-           - 买入平空：'cover 数量'（例如：'cover 2' 或 'cover all'）
-        5. 当前持仓已经达到最大值或最小值时，请勿继续开仓。
-        6. 请提供交易理由和交易计划（包括止损区间和目标价格预测）。
-        7. 即使选择持仓不变（hold），也可以根据最新行情修改交易计划。如果行情变化导致预期发生变化，请更新 trade_plan。
-
-        请根据以上信息，给出交易指令或选择不交易（hold），并提供下一次需要的消息。
-        请以JSON格式输出，包含以下字段：
-        - trade_instruction: 交易指令（字符串，例如 "buy 2", "sell all", "short 1", "cover all" 或 "hold"）
-        - next_message: 下一次需要的消息（字符串）
-        - trade_reason: 此刻交易的理由（字符串）
-        - trade_plan: 交易计划，包括止损区间和目标价格预测，可以根据最新行情进行修改（字符串）
-
-        请确保输出的JSON格式正确，并用```json 和 ``` 包裹。
-        """
-        return input_template
+        {position_details}"""
 
     def _compress_history(self, df: pd.DataFrame, period: str) -> str:
         if df.empty:
@@ -548,8 +564,18 @@ class LLMFuturesDealer:
             
             json_str = json_match.group(1)
             data = json.loads(json_str)
-            
-            trade_instruction = data.get('trade_instruction', 'hold').lower()
+            return self._parse_decision(data)
+        except json.JSONDecodeError as e:
+            self.logger.error(f"JSON parsing error: {e}")
+            return "hold", 1, "", "JSON 解析错误", ""
+        except Exception as e:
+            self.logger.error(f"Error parsing LLM output: {e}")
+            return "hold", 1, "", "解析错误", ""
+
+    def _parse_decision(self, data: dict) -> Tuple[str, Union[int, str], str, str, str]:
+        """把单个合约的决策字典转换为 (指令, 数量, next_msg, 理由, 计划)"""
+        try:
+            trade_instruction = str(data.get('trade_instruction', 'hold')).lower()
             next_msg = data.get('next_message', '')
             trade_reason = data.get('trade_reason', '')
             trade_plan = data.get('trade_plan', '')
@@ -571,9 +597,6 @@ class LLMFuturesDealer:
                     quantity = 1
             
             return action, quantity, next_msg, trade_reason, trade_plan
-        except json.JSONDecodeError as e:
-            self.logger.error(f"JSON parsing error: {e}")
-            return "hold", 1, "", "JSON 解析错误", ""
         except Exception as e:
             self.logger.error(f"Error parsing LLM output: {e}")
             return "hold", 1, "", "解析错误", ""
@@ -639,186 +662,266 @@ class LLMFuturesDealer:
 
     def _force_close_if_needed(self, symbol: str, current_datetime: pd.Timestamp, current_price: float):
         contract_state = self.contract_states[symbol]
-        day_closing_time = dt_time(14, 55)
-        night_session_start = dt_time(21, 0)
-        night_session_end = dt_time(2, 30)
-        morning_session_start = dt_time(9, 0)
-
-        current_time = current_datetime.time()
-        is_day_session = morning_session_start <= current_time < day_closing_time
-        is_night_session = night_session_start <= current_time or current_time < night_session_end
+        calendar = contract_state.session_calendar
+        session = calendar.session_of(current_datetime)
+        minutes_left = calendar.minutes_until_close(current_datetime)
 
-        if is_day_session and current_time >= day_closing_time:
+        # 日盘和夜盘都在收盘前 5 分钟内强制平仓
+        if session == 'day' and minutes_left <= 5:
             self._close_all_positions(symbol, current_price, current_datetime)
             self.logger.info(f"{symbol}: 日盘强制平仓")
-        elif is_night_session:
-            if contract_state.night_closing_time:
-                closing_window_start = (datetime.combine(datetime.min, contract_state.night_closing_time) - timedelta(minutes=5)).time()
-                if closing_window_start <= current_time <= contract_state.night_closing_time:
-                    self._close_all_positions(symbol, current_price, current_datetime)
-                    self.logger.info(f"{symbol}: 夜盘强制平仓")
-                else:
-                    self.logger.info(f"{symbol}: 夜盘交易，当前仓位：{contract_state.position_manager.get_current_position()}")
-            else:
-                self.logger.info(f"{symbol}: 夜盘交易（无强制平仓时间），当前仓位：{contract_state.position_manager.get_current_position()}")
-        elif night_session_end <= current_time < morning_session_start:
+        elif session == 'night' and minutes_left <= 5:
+            self._close_all_positions(symbol, current_price, current_datetime)
+            self.logger.info(f"{symbol}: 夜盘强制平仓")
+        elif session == 'night':
+            self.logger.info(f"{symbol}: 夜盘交易，当前仓位：{contract_state.position_manager.get_current_position()}")
+        elif session is None:
             self.logger.info(f"{symbol}: 非交易时间，当前仓位：{contract_state.position_manager.get_current_position()}")
 
-    def _get_today_bar_index(self, symbol: str, timestamp: pd.Timestamp) -> int:
-        contract_state = self.contract_states[symbol]
-        if contract_state.today_minute_bars.empty:
-            return 0
-        
-        try:
-            if not pd.api.types.is_datetime64_any_dtype(contract_state.today_minute_bars['datetime']):
-                contract_state.today_minute_bars['datetime'] = pd.to_datetime(contract_state.today_minute_bars['datetime'], utc=True)
-            
-            if contract_state.today_minute_bars['datetime'].dt.tz is None:
-                contract_state.today_minute_bars['datetime'] = contract_state.today_minute_bars['datetime'].dt.tz_localize('Asia/Shanghai')
-            
-            contract_state.today_minute_bars['datetime'] = contract_state.today_minute_bars['datetime'].dt.tz_convert('UTC')
-            
-            utc_timestamp = timestamp.tz_convert('UTC')
-            
-            today_bars = contract_state.today_minute_bars[contract_state.today_minute_bars['datetime'].dt.date == utc_timestamp.date()]
-            return len(today_bars)
-        except Exception as e:
-            self.logger.error(f"Error in _get_today_bar_index for {symbol}: {str(e)}", exc_info=True)
-            return 0
-
     def _log_bar_info(self, symbol: str, bar: Union[pd.Series, dict], news: str, trade_instruction: str, trade_reason: str, trade_plan: str):
+        """把本根 bar 的决策记录交给后台日志线程，这里只组装字典"""
         try:
-            os.makedirs('./output', exist_ok=True)
-
-            current_date = datetime.now().strftime('%Y%m%d')
-            file_path = f'./output/log_{current_date}.log'
-            
-            file_handler = next((h for h in self.logger.handlers if isinstance(h, logging.FileHandler) and h.baseFilename == file_path), None)
-            
-            if not file_handler:
-                file_handler = logging.FileHandler(file_path)
-                file_handler.setLevel(logging.DEBUG)
-                file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-                self.logger.addHandler(file_handler)
-
-                # Remove old file handlers
-                for handler in self.logger.handlers[:]:
-                    if isinstance(handler, logging.FileHandler) and handler.baseFilename != file_path:
-                        self.logger.removeHandler(handler)
-                        handler.close()
-
-            if isinstance(bar, dict):
-                bar = pd.Series(bar)
-
             contract_state = self.contract_states[symbol]
-            log_msg = f"""
-            合约: {symbol}
-            时间: {pd.to_datetime(bar['datetime'])}, Bar Index: {self._get_today_bar_index(symbol, pd.to_datetime(bar['datetime']))}
-            价格: 开 {bar['open']:.2f}, 高 {bar['high']:.2f}, 低 {bar['low']:.2f}, 收 {bar['close']:.2f}
-            成交量: {bar['volume']}, 持仓量: {bar.get('open_interest', bar.get('hold', 'N/A'))}
-            新闻: {news[:200] + '...' if news else '无新闻数据'}
-            交易指令: {trade_instruction}
-            交易理由: {trade_reason}
-            交易计划: {trade_plan}
-            当前持仓: {contract_state.position_manager.get_current_position()}
-            盈亏情况:
-            {contract_state.position_manager.calculate_profits(bar['close'])}
-            {contract_state.position_manager.get_position_details()}
-            """
-
-            self.logger.debug(log_msg)
+            position_manager = contract_state.position_manager
+            current_position = position_manager.get_current_position()
+            self.decision_log.log({
+                'symbol': symbol,
+                'time': bar['datetime'],
+                # today_minute_bars 中已包含当前 bar
+                'bar_index': len(contract_state.today_minute_bars),
+                'open': float(bar['open']),
+                'high': float(bar['high']),
+                'low': float(bar['low']),
+                'close': float(bar['close']),
+                'volume': bar['volume'],
+                'hold': bar.get('open_interest', bar.get('hold')),
+                'news': news[:200] if news else '',
+                'instruction': trade_instruction,
+                'reason': trade_reason,
+                'plan': trade_plan,
+                'position': current_position,
+                'profits': position_manager.calculate_profits(bar['close']),
+                'open_positions': [(pos.position_type.name, pos.entry_price, pos.entry_time)
+                                   for pos in position_manager.positions if not pos.is_closed()],
+            })
 
             if trade_instruction.lower() != 'hold':
-                console_msg = f"{symbol}: 时间: {pd.to_datetime(bar['datetime'])}, 价格: {bar['close']:.2f}, 交易指令: {trade_instruction}, 交易理由: {trade_reason[:50]}..., 当前持仓: {contract_state.position_manager.get_current_position()}"
+                console_msg = f"{symbol}: 时间: {bar['datetime']}, 价格: {bar['close']:.2f}, 交易指令: {trade_instruction}, 交易理由: {trade_reason[:50]}..., 当前持仓: {current_position}"
                 self.logger.info(console_msg)
 
         except Exception as e:
             self.logger.error(f"Error in _log_bar_info for {symbol}: {str(e)}", exc_info=True)
 
     def parse_timestamp(self, timestamp):
-        self.logger.debug(f"Attempting to parse timestamp: {timestamp}")
+        """解析时间戳，返回带北京时区的时间；解析失败时返回当前时间"""
         try:
-            if isinstance(timestamp, (int, float)):
-                if timestamp > 1e12:
-                    if timestamp > 9999999999999:
-                        self.logger.warning(f"Abnormally large timestamp detected: {timestamp}")
-                        try:
-                            return pd.Timestamp(timestamp, unit='ns').tz_localize(beijing_tz)
-                        except Exception:
-                            self.logger.error(f"Failed to parse abnormally large timestamp: {timestamp}")
-                            return datetime.now(beijing_tz)
-                    return datetime.fromtimestamp(timestamp / 1000, tz=beijing_tz)
-                else:
-                    return datetime.fromtimestamp(timestamp, tz=beijing_tz)
-            elif isinstance(timestamp, str):
-                import dateutil.parser as parser
-                return parser.parse(timestamp).astimezone(beijing_tz)
-            elif isinstance(timestamp, pd.Timestamp):
-                return timestamp.tz_localize(beijing_tz) if timestamp.tz is None else timestamp.tz_convert(beijing_tz)
-            elif isinstance(timestamp, datetime):
-                return timestamp.astimezone(beijing_tz) if timestamp.tzinfo else beijing_tz.localize(timestamp)
-            else:
-                raise ValueError(f"Unexpected timestamp type: {type(timestamp)}")
+            return from_epoch_ns(to_epoch_ns(timestamp))
         except Exception as e:
             self.logger.error(f"Error parsing timestamp {timestamp}: {str(e)}")
             self.logger.warning("Using current time as fallback")
             return datetime.now(beijing_tz)
 
-    def process_bar(self, symbol: str, bar: pd.Series, news: str = "") -> Tuple[str, Union[int, str], str, str, str]:
+    def process_bar(self, symbol: str, bar: pd.Series, news: str = "", deadline: Optional[float] = None) -> Tuple[str, Union[int, str], str, str, str]:
+        """
+        处理单个合约的 bar。
+
+        :param deadline: time.monotonic() 时间点，LLM 返回时已超过该时间则放弃本次交易并返回 hold
+        """
+        contract_state = self.contract_states[symbol]
+        with contract_state.lock, self.latency.bar(symbol):
+            return self._process_bar_locked(symbol, contract_state, bar, news, deadline)
+
+    def get_latency_report(self) -> str:
+        return self.latency.report()
+
+    def _process_bar_locked(self, symbol: str, contract_state: ContractState, bar: pd.Series, news: str,
+                            deadline: Optional[float]) -> Tuple[str, Union[int, str], str, str, str]:
         try:
-            contract_state = self.contract_states[symbol]
-            time_key = 'time' if 'time' in bar else 'datetime'
-            bar['datetime'] = self.parse_timestamp(bar[time_key])
-            bar_date = bar['datetime'].date()
-
-            if contract_state.current_date != bar_date:
-                contract_state.current_date = bar_date
-                contract_state.today_minute_bars = self._get_today_data(symbol, bar_date)
-                contract_state.today_minute_bars['datetime'] = pd.to_datetime(contract_state.today_minute_bars['datetime'], utc=True)
-                
-                if contract_state.today_minute_bars['datetime'].dt.tz is None:
-                    contract_state.today_minute_bars['datetime'] = contract_state.today_minute_bars['datetime'].dt.tz_localize('Asia/Shanghai')
-                
-                contract_state.today_minute_bars['datetime'] = contract_state.today_minute_bars['datetime'].dt.tz_convert('UTC')
-                contract_state.position_manager = TradePositionManager()
-                contract_state.last_trade_date = bar_date
-                
-                if not self.is_backtest:
-                    contract_state.last_news_time = None
-                    contract_state.news_summary = ""
-
-            if not self._is_trading_time(bar['datetime']):
-                return "hold", 0, "非交易时间", "当前时间不在交易时段", "等待下一个交易时段"
-
-            contract_state.today_minute_bars = pd.concat([contract_state.today_minute_bars, bar.to_frame().T], ignore_index=True)
-
-            news_updated = False
-            if not self.is_backtest:
-                news_updated = self._update_news(symbol, bar['datetime'])
+            skip_result, news_updated = self._ingest_bar(symbol, contract_state, bar)
+            if skip_result is not None:
+                return skip_result
 
-            llm_input = self._prepare_llm_input(symbol, bar, self.news_summary if (not self.is_backtest and (news_updated or len(contract_state.today_minute_bars) == 1)) else "")
+            with self.latency.stage("prompt"):
+                llm_input = self._prepare_llm_input(symbol, bar, self._prompt_news(contract_state, news_updated))
             
-            llm_response = self.llm_client.one_chat(llm_input)
-            trade_instruction, quantity, next_msg, trade_reason, trade_plan = self._parse_llm_output(llm_response)
-            self._execute_trade(symbol, trade_instruction, quantity, bar, trade_reason, trade_plan)
-            self._log_bar_info(symbol, bar, self.news_summary if news_updated else "", f"{trade_instruction} {quantity}", trade_reason, trade_plan)
-            contract_state.last_msg = next_msg
-            return trade_instruction, quantity, next_msg, trade_reason, trade_plan
+            with self.latency.stage("llm"):
+                llm_response = self.llm_client.one_chat(llm_input)
+            if deadline is not None and time.monotonic() > deadline:
+                # 决策返回得太晚，行情已经走到下一根 bar，不再按这根 bar 的价格下单
+                self.logger.warning(f"{symbol}: LLM 决策超过时限，放弃本次交易")
+                return self._timeout_result()
+            with self.latency.stage("parse"):
+                decision = self._parse_llm_output(llm_response)
+            return self._apply_decision(symbol, contract_state, bar, decision, news_updated)
         except Exception as e:
             self.logger.error(f"Error processing bar for {symbol}: {str(e)}", exc_info=True)
             self.logger.error(f"Problematic bar data: {bar}")
             return "hold", 0, "", "处理错误", "无交易计划"
 
-    def process_bars(self, bars: Dict[str, pd.Series], news: Dict[str, str] = {}) -> Dict[str, Tuple[str, Union[int, str], str, str, str]]:
+
+    def _ingest_bar(self, symbol: str, contract_state: ContractState, bar: pd.Series):
+        """
+        把 bar 并入合约状态并更新新闻。
+
+        :return: (skip_result, news_updated)，非交易时间时 skip_result 为应直接返回的 hold 结果
+        """
+        # 时间只在这里转换一次：ts 为 int64 epoch 纳秒，datetime 为对应的北京时间
+        normalize_bar(bar)
+        bar_date = local_date(bar['ts'])
+
+        if contract_state.current_date != bar_date:
+            contract_state.current_date = bar_date
+            with self.latency.stage("today_data"):
+                contract_state.today_minute_bars = normalize_frame(self._get_today_data(symbol, bar_date))
+            contract_state.position_manager = TradePositionManager()
+            contract_state.last_trade_date = bar_date
+            
+            if not self.is_backtest:
+                # 新的交易日重新把当前摘要提供给第一根 bar
+                contract_state.news_version = 0
+                contract_state.news_summary = ""
+
+        if not self._is_trading_time(symbol, bar['datetime']):
+            return ("hold", 0, "非交易时间", "当前时间不在交易时段", "等待下一个交易时段"), False
+
+        contract_state.today_minute_bars = pd.concat([contract_state.today_minute_bars, bar.to_frame().T], ignore_index=True)
+        contract_state.bars.update(bar)
+
+        news_updated = False
+        if not self.is_backtest:
+            with self.latency.stage("news"):
+                news_updated = self._update_news(symbol, bar['datetime'])
+        return None, news_updated
+
+    def _prompt_news(self, contract_state: ContractState, news_updated: bool) -> str:
+        if not self.is_backtest and (news_updated or len(contract_state.today_minute_bars) == 1):
+            return contract_state.news_summary
+        return ""
+
+    def _apply_decision(self, symbol: str, contract_state: ContractState, bar: pd.Series,
+                        decision: Tuple[str, Union[int, str], str, str, str], news_updated: bool) -> Tuple[str, Union[int, str], str, str, str]:
+        trade_instruction, quantity, next_msg, trade_reason, trade_plan = decision
+        with self.latency.stage("execute"):
+            self._execute_trade(symbol, trade_instruction, quantity, bar, trade_reason, trade_plan)
+        with self.latency.stage("log"):
+            self._log_bar_info(symbol, bar, contract_state.news_summary if news_updated else "", f"{trade_instruction} {quantity}", trade_reason, trade_plan)
+        contract_state.last_msg = next_msg
+        return trade_instruction, quantity, next_msg, trade_reason, trade_plan
+
+    def _process_bars_batched(self, symbols: List[str], bars: Dict[str, pd.Series], deadline: Optional[float]) -> Dict[str, Tuple[str, Union[int, str], str, str, str]]:
+        """批量模式：多个合约合并成一次 LLM 调用"""
         results = {}
-        for symbol, bar in bars.items():
+        ready = []
+        news_flags = {}
+        prompt_news = {}
+        with ExitStack() as stack:
+            # 固定顺序加锁，避免与其他批次互相等待
+            for symbol in sorted(symbols):
+                stack.enter_context(self.contract_states[symbol].lock)
+
+            for symbol in symbols:
+                contract_state = self.contract_states[symbol]
+                try:
+                    skip_result, news_updated = self._ingest_bar(symbol, contract_state, bars[symbol])
+                except Exception as e:
+                    self.logger.error(f"Error processing bar for {symbol}: {str(e)}", exc_info=True)
+                    results[symbol] = ("hold", 0, "", "处理错误", "无交易计划")
+                    continue
+                if skip_result is not None:
+                    results[symbol] = skip_result
+                    continue
+                ready.append(symbol)
+                news_flags[symbol] = news_updated
+                prompt_news[symbol] = self._prompt_news(contract_state, news_updated)
+
+            runner = BatchDecisionRunner(
+                self.llm_client,
+                lambda chunk: self._prepare_batch_llm_input(chunk, bars, prompt_news),
+                batch_size=self.batch_size,
+                max_prompt_chars=self.max_batch_prompt_chars,
+                logger=self.logger,
+            )
+            try:
+                with self.latency.stage("llm"):
+                    decisions = runner.run(ready)
+            except Exception as e:
+                self.logger.error(f"Error in batched LLM call for {ready}: {str(e)}", exc_info=True)
+                decisions = {}
+
+            timed_out = deadline is not None and time.monotonic() > deadline
+            for symbol in ready:
+                if timed_out:
+                    self.logger.warning(f"{symbol}: LLM 决策超过时限，放弃本次交易")
+                    results[symbol] = self._timeout_result()
+                    continue
+                if symbol not in decisions:
+                    results[symbol] = ("hold", 0, self.contract_states[symbol].last_msg, "批量结果中缺少该合约的决策", "")
+                    continue
+                try:
+                    decision = self._parse_decision(decisions[symbol])
+                    results[symbol] = self._apply_decision(symbol, self.contract_states[symbol], bars[symbol], decision, news_flags[symbol])
+                except Exception as e:
+                    self.logger.error(f"Error applying decision for {symbol}: {str(e)}", exc_info=True)
+                    results[symbol] = ("hold", 0, "", "处理错误", "无交易计划")
+        return results
+
+    def _timeout_result(self) -> Tuple[str, Union[int, str], str, str, str]:
+        return "hold", 0, "", "处理超时", "无交易计划"
+
+    def process_bars(self, bars: Dict[str, pd.Series], news: Dict[str, str] = {}) -> Dict[str, Tuple[str, Union[int, str], str, str, str]]:
+        """
+        处理一批不同合约的 bar。
+
+        batch_size > 1 时多个合约合并为一次 LLM 调用（见 _process_bars_batched）；
+        否则 max_concurrency > 1 时各合约并行处理。设置了 bar_deadline 时，
+        到期仍未完成的合约直接返回 hold，其后台任务即使稍后完成也不会再下单。
+        """
+        deadline = time.monotonic() + self.bar_deadline if self.bar_deadline is not None else None
+        symbols = []
+        for symbol in bars:
             if symbol in self.contract_states:
-                news_for_symbol = news.get(symbol, "")
-                result = self.process_bar(symbol, bar, news_for_symbol)
-                results[symbol] = result
+                symbols.append(symbol)
             else:
                 self.logger.warning(f"Received data for unsubscribed symbol: {symbol}")
-        return results
+
+        if self.batch_size > 1 and len(symbols) > 1:
+            # 批量模式下整批 bar 作为一个统计单位
+            with self.latency.bar("batch"):
+                results = self._process_bars_batched(symbols, bars, deadline)
+            return {symbol: results[symbol] for symbol in symbols}
+
+        results = {}
+        if self._executor is None or len(symbols) <= 1:
+            for symbol in symbols:
+                if deadline is not None and time.monotonic() > deadline:
+                    self.logger.warning(f"{symbol}: 本批 bar 已超过处理时限，跳过")
+                    results[symbol] = self._timeout_result()
+                    continue
+                results[symbol] = self.process_bar(symbol, bars[symbol], news.get(symbol, ""), deadline)
+            return results
+
+        futures = {
+            self._executor.submit(self.process_bar, symbol, bars[symbol], news.get(symbol, ""), deadline): symbol
+            for symbol in symbols
+        }
+        timeout = max(0.0, deadline - time.monotonic()) if deadline is not None else None
+        done, not_done = wait(futures, timeout=timeout)
+        for future in done:
+            results[futures[future]] = future.result()
+        for future in not_done:
+            symbol = futures[future]
+            future.cancel()
+            self.logger.warning(f"{symbol}: 超过处理时限 {self.bar_deadline}s 仍未完成，按 hold 处理")
+            results[symbol] = self._timeout_result()
+        return {symbol: results[symbol] for symbol in symbols}
+
+    def shutdown(self):
+        """释放并行处理使用的线程池；新闻服务由进程内的 dealer 共享，只取消本实例的回调"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self.news_service is not None:
+            self.news_service.remove_listener(self._on_news_summary)
 
     def get_position(self, symbol: str) -> int:
         if symbol in self.contract_states:
@@ -4,6 +4,7 @@ from datetime import datetime, timedelta
 import pytz
 from dealer.futures_provider import MainContractProvider
 from dealer.llm_dealer import LLMDealer
+from dealer.news_service import NewsService
 
 class LLMMultiContractDealer:
     def __init__(self, llm_client, symbols: List[str], data_provider: MainContractProvider, trade_rules: str = "",
@@ -21,9 +22,12 @@ class LLMMultiContractDealer:
         self.compact_mode = compact_mode
         self.max_position = max_position
 
+        # 所有合约（以及同一进程中的其他 dealer）共用进程内的后台新闻服务
+        self.news_service = None if backtest_date else NewsService.default(llm_client)
         self.dealers = {symbol: LLMDealer(llm_client, symbol, data_provider, trade_rules,
                                           max_daily_bars, max_hourly_bars, max_minute_bars,
-                                          backtest_date, compact_mode, max_position) 
+                                          backtest_date, compact_mode, max_position,
+                                          news_service=self.news_service) 
                         for symbol in symbols}
 
         self.beijing_tz = pytz.timezone('Asia/Shanghai')
@@ -31,6 +35,10 @@ class LLMMultiContractDealer:
         for symbol, dealer in self.dealers.items():
             dealer._update_news(datetime.now(self.beijing_tz))
 
+    def shutdown(self):
+        for dealer in self.dealers.values():
+            dealer.shutdown()
+
     def get_total_profit(self) -> float:
         return sum(dealer.total_profit for dealer in self.dealers.values())
 
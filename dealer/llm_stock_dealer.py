@@ -6,6 +6,14 @@
 
 import re
 from .stock_data_provider import StockDataProvider
+from .batch_prompt import BatchDecisionRunner
+from .latency_tracker import LatencyTracker
+from . import stock_journal
+from .stock_journal import StockStateJournal, migrate_json_file
+from .quote_service import QuoteService
+from .risk_engine import RiskEngine
+from .time_normalizer import minute_of_day, normalize_bar
+from .bar_aggregator import BarAggregator, DAILY
 
 import json
 import os
@@ -128,12 +136,34 @@ class Portfolio:
 
 class LLMStockDealer:
     def __init__(self, llm_client, data_provider, trade_rules: str = "", 
-                 max_position_percentage: float = 0.2, data_file: str = "./output/stock_dealer_data.json"):
+                 max_position_percentage: float = 0.2, data_file: str = "./output/stock_dealer_data.json",
+                 batch_size: int = 1, max_batch_prompt_chars: Optional[int] = None,
+                 latency_tracker: Optional[LatencyTracker] = None,
+                 journal_file: str = "./output/stock_dealer_state.db",
+                 quote_service: Optional[QuoteService] = None, risk_engine: Optional[RiskEngine] = None,
+                 max_hourly_bars: int = 8):
+        """
+        :param data_file: 旧版 JSON 数据文件，状态日志为空时从这里导入一次
+        :param journal_file: 保存投资组合、持仓和资金的 SQLite 追加式日志
+        :param quote_service: 批量行情和波动率服务，默认基于 data_provider 创建
+        :param risk_engine: 组合协方差风险引擎，默认使用 quote_service 的日线数据
+        :param max_hourly_bars: prompt 中每只股票展示的最近小时线数量
+        """
         self.llm_client = llm_client
         self.data_provider = data_provider
+        # 风险引擎使用 60 个交易日的窗口，日线需要回看约 120 个自然日
+        self.quotes = quote_service or QuoteService(data_provider, lookback_days=120)
+        self.risk = risk_engine or RiskEngine(self.quotes)
         self.trade_rules = trade_rules
         self.max_position_percentage = max_position_percentage
         self.data_file = data_file
+        self.journal_file = journal_file
+        # batch_size > 1 时 process_bar 把多只股票合并到一个 prompt 中决策
+        self.batch_size = max(1, batch_size)
+        self.max_batch_prompt_chars = max_batch_prompt_chars
+        self.max_hourly_bars = max_hourly_bars
+        # 每只股票一个 BarAggregator，由流入的 1 分钟 bar 增量合成小时线和日线
+        self.bars: Dict[str, BarAggregator] = {}
 
         self.portfolio = Portfolio()
         self.positions = []
@@ -143,6 +173,8 @@ class LLMStockDealer:
         self.last_msg=""
         
         self.logger = self._setup_logging()
+        # 每根 bar 各阶段耗时，可传入设置了 slow_bar_threshold 的 tracker 记录慢 bar
+        self.latency = latency_tracker or LatencyTracker("LLMStockDealer", logger=self.logger)
         self._load_data()
 
     def _setup_logging(self):
@@ -164,48 +196,56 @@ class LLMStockDealer:
         return logger
 
     def _save_data(self):
-        data = {
-            "portfolio": self.portfolio.to_dict(),
-            "positions": [position.to_dict() for position in self.positions],
+        """把完整状态写入日志并压缩成快照"""
+        self.journal.append(stock_journal.PORTFOLIO, self.portfolio.to_dict())
+        self._journal_positions()
+        self.journal.append(stock_journal.META, {
             "last_trade_date": self.last_trade_date.isoformat() if self.last_trade_date else None,
             "last_msg": self.last_msg
-        }
-        with open(self.data_file, 'w') as f:
-            json.dump(data, f)
+        })
+        self.journal.compact()
+
+    def _journal_positions(self):
+        self.journal.append(stock_journal.POSITIONS, [position.to_dict() for position in self.positions])
 
     def _load_data(self):
-        if os.path.exists(self.data_file):
-            with open(self.data_file, 'r') as f:
-                data = json.load(f)
-            self.portfolio = Portfolio.from_dict(data['portfolio'])
-            self.positions = [StockPosition.from_dict(pos) for pos in data['positions']]
-            self.last_trade_date = datetime.fromisoformat(data['last_trade_date']) if data['last_trade_date'] else None
-            self.last_msg = data['last_msg']
+        self.journal = StockStateJournal(self.journal_file, logger=self.logger)
+        migrate_json_file(self.journal, self.data_file)
+        if self.journal.is_empty:
+            return
+
+        data = self.journal.load()
+        self.portfolio = Portfolio.from_dict(data['portfolio'])
+        self.positions = [StockPosition.from_dict(pos) for pos in data['positions']]
+        if data['cash'] is not None:
+            self.available_cash = data['cash']
+        self.last_trade_date = datetime.fromisoformat(data['last_trade_date']) if data['last_trade_date'] else None
+        self.last_msg = data['last_msg']
 
     def update_portfolio(self, new_stocks: List[str]):
         """
         更新整个投资组合
         """
         self.portfolio.update_portfolio(new_stocks)
-        self._save_data()
+        self.journal.append(stock_journal.PORTFOLIO, self.portfolio.to_dict())
 
     def update_positions(self, new_positions: List[Dict]):
         """
         更新持仓信息
         """
         self.positions = [StockPosition.from_dict(pos) for pos in new_positions]
-        self._save_data()
+        self._journal_positions()
 
     def update_cash(self, available_cash: float):
         """
         更新可用资金
         """
         self.available_cash = available_cash
-        self._save_data()
+        self.journal.append(stock_journal.CASH, available_cash)
 
     def remove_from_portfolio(self, symbol: str):
         self.portfolio.remove_stock(symbol)
-        self._save_data()
+        self.journal.append(stock_journal.PORTFOLIO_REMOVE, symbol)
 
     def get_position(self, symbol: str) -> int:
         return sum(pos.quantity for pos in self.positions if pos.symbol == symbol and not pos.is_closed())
@@ -218,17 +258,85 @@ class LLMStockDealer:
         return positions
 
     def process_bar(self, bars: Dict[str, pd.Series], news: Dict[str, str] = {}) -> Dict[str, Tuple[str, Union[int, str], str, str, str]]:
+        # 统一时间表示：ts 为 int64 epoch 纳秒，datetime 为北京时间；已经带 ts 的 bar 不再转换
+        for bar in bars.values():
+            normalize_bar(bar)
+        self._update_bars(bars)
+
+        if self.batch_size > 1 and len(bars) > 1:
+            # 批量模式下整批 bar 作为一个统计单位
+            with self.latency.bar("batch"):
+                return self._process_bar_batched(bars, news)
+
         results = {}
         for symbol, bar in bars.items():
-            try:
-                llm_input, max_buyable_quantity = self._prepare_llm_input(symbol, bar, news.get(symbol, ""))
-                llm_response = self.llm_client.one_chat(llm_input)
-                self.logger.debug(f"LLM response for {symbol}: {llm_response}")  # 添加这行来记录原始响应
-                trade_instruction, quantity, next_msg, trade_reason, trade_plan = self._parse_llm_output(llm_response, max_buyable_quantity)
-                results[symbol] = (trade_instruction, quantity, next_msg, trade_reason, trade_plan)
-            except Exception as e:
-                self.logger.error(f"Error processing bar for {symbol}: {e}", exc_info=True)
-                results[symbol] = ('hold', 0, '', f"Error: {str(e)}", '')
+            with self.latency.bar(symbol):
+                try:
+                    with self.latency.stage("prompt"):
+                        llm_input, max_buyable_quantity = self._prepare_llm_input(symbol, bar, news.get(symbol, ""))
+                    with self.latency.stage("llm"):
+                        llm_response = self.llm_client.one_chat(llm_input)
+                    self.logger.debug(f"LLM response for {symbol}: {llm_response}")  # 添加这行来记录原始响应
+                    with self.latency.stage("parse"):
+                        trade_instruction, quantity, next_msg, trade_reason, trade_plan = self._parse_llm_output(llm_response, max_buyable_quantity)
+                    results[symbol] = (trade_instruction, quantity, next_msg, trade_reason, trade_plan)
+                except Exception as e:
+                    self.logger.error(f"Error processing bar for {symbol}: {e}", exc_info=True)
+                    results[symbol] = ('hold', 0, '', f"Error: {str(e)}", '')
+        return results
+
+    def get_latency_report(self) -> str:
+        return self.latency.report()
+
+    def _update_bars(self, bars: Dict[str, pd.Series]):
+        for symbol, bar in bars.items():
+            aggregator = self.bars.get(symbol)
+            if aggregator is None:
+                aggregator = BarAggregator(timeframes=(60, DAILY), max_bars={60: self.max_hourly_bars, DAILY: 5},
+                                           logger=self.logger)
+                self.bars[symbol] = aggregator
+            aggregator.update(bar)
+
+    def _format_hourly(self, symbol: str) -> str:
+        aggregator = self.bars.get(symbol)
+        if aggregator is None:
+            return "无小时线数据"
+        hourly = aggregator.frame(60)
+        if hourly.empty:
+            return "无小时线数据"
+        return hourly.drop(columns=['open_interest']).to_string(index=False)
+
+    def _process_bar_batched(self, bars: Dict[str, pd.Series], news: Dict[str, str]) -> Dict[str, Tuple[str, Union[int, str], str, str, str]]:
+        """批量模式：多只股票共用一份组合信息、规则和输出说明，合并为一次 LLM 调用"""
+        results = {}
+        try:
+            with self.latency.stage("assets"):
+                total_assets = self.calculate_total_assets()
+        except Exception as e:
+            self.logger.error(f"Error calculating total assets: {e}", exc_info=True)
+            return {symbol: ('hold', 0, '', f"Error: {str(e)}", '') for symbol in bars}
+
+        max_buyable = {symbol: self._max_buyable_quantity(symbol, bar, total_assets) for symbol, bar in bars.items()}
+        runner = BatchDecisionRunner(
+            self.llm_client,
+            lambda chunk: self._prepare_batch_llm_input(chunk, bars, news, max_buyable),
+            batch_size=self.batch_size,
+            max_prompt_chars=self.max_batch_prompt_chars,
+            logger=self.logger,
+        )
+        try:
+            with self.latency.stage("llm"):
+                decisions = runner.run(list(bars))
+        except Exception as e:
+            self.logger.error(f"Error in batched LLM call: {e}", exc_info=True)
+            decisions = {}
+
+        for symbol in bars:
+            if symbol not in decisions:
+                results[symbol] = ('hold', 0, '', "批量结果中缺少该股票的决策", '')
+                continue
+            self.logger.debug(f"LLM decision for {symbol}: {decisions[symbol]}")
+            results[symbol] = self._parse_decision(decisions[symbol], max_buyable[symbol], symbol)
         return results
 
     def calculate_total_assets(self) -> float:
@@ -240,41 +348,91 @@ class LLMStockDealer:
         """
         total_assets = self.available_cash
 
-        for position in self.positions:
-            if not position.is_closed():
-                try:
-                    current_price = self.data_provider.get_latest_price(position.symbol)
-                    position_value = position.quantity * current_price
-                    total_assets += position_value
-                except Exception as e:
-                    self.logger.error(f"Error calculating value for position {position.symbol}: {str(e)}")
-                    # 使用上次已知的价格或入场价格作为备选
-                    fallback_price = position.entry_price
-                    self.logger.warning(f"Using fallback price {fallback_price} for {position.symbol}")
-                    total_assets += position.quantity * fallback_price
+        open_positions = [position for position in self.positions if not position.is_closed()]
+        prices = self.quotes.get_prices(position.symbol for position in open_positions)
+        for position in open_positions:
+            current_price = prices.get(position.symbol)
+            if current_price is None:
+                # 使用入场价格作为备选
+                current_price = position.entry_price
+                self.logger.warning(f"Using fallback price {current_price} for {position.symbol}")
+            total_assets += position.quantity * current_price
 
         self.logger.info(f"Total assets calculated: {total_assets:.2f}")
         return total_assets
 
     def _prepare_llm_input(self, symbol: str, bar: pd.Series, news: str) -> str:
-        portfolio_info = "\n".join([f"{s}: {info}" for s, info in self.portfolio.get_all_stocks().items()])
-        positions_info = "\n".join([f"{pos.symbol}: {pos.quantity}" for pos in self.positions if not pos.is_closed()])
+        with self.latency.stage("assets"):
+            total_assets = self.calculate_total_assets()
+        max_buyable_quantity = self._max_buyable_quantity(symbol, bar, total_assets)
+
+        input_template = f"""
+        你是一位经验丰富的股票交易员，熟悉股票市场规律，擅长把握交易机会并控制风险。请根据以下信息为股票 {symbol} 做出交易决策：
+
+        {self._prompt_portfolio_context()}
+
+        {self._prepare_symbol_section(symbol, bar, news, max_buyable_quantity)}
+
+        上一次的消息: {self.last_msg}
+
+        {self._prompt_rules(f"买入数量不能超过 {max_buyable_quantity}，且必须是100的倍数。")}
+
+        请根据以上信息，给出交易指令或选择不交易（hold），并提供下一次需要的消息。
+        请以JSON格式输出，包含以下字段：
+        {self._prompt_output_fields()}
+
+        请确保输出的JSON格式正确。
+        """
+        return input_template, max_buyable_quantity
+
+    def _prepare_batch_llm_input(self, symbols: List[str], bars: Dict[str, pd.Series], news: Dict[str, str],
+                                 max_buyable: Dict[str, int]) -> str:
+        sections = "\n\n".join(
+            f"===== {symbol} =====\n{self._prepare_symbol_section(symbol, bars[symbol], news.get(symbol, ''), max_buyable[symbol])}"
+            for symbol in symbols
+        )
+
+        input_template = f"""
+        你是一位经验丰富的股票交易员，熟悉股票市场规律，擅长把握交易机会并控制风险。请根据以下信息分别为股票 {', '.join(symbols)} 做出交易决策：
+
+        {self._prompt_portfolio_context()}
 
+        {sections}
+
+        上一次的消息: {self.last_msg}
+
+        {self._prompt_rules("每只股票的买入数量不能超过该股票当前可买入的最大数量，且必须是100的倍数。")}
+
+        请根据以上信息，为每只股票分别给出交易指令或选择不交易（hold），并提供下一次需要的消息。
+        请以JSON数组格式输出，每只股票一个元素，每个元素包含以下字段：
+        - symbol: 股票代码（字符串，必须与上面给出的股票代码一致）
+        {self._prompt_output_fields()}
+
+        请确保输出的JSON格式正确，数组中每只股票恰好出现一次。
+        """
+        return input_template
+
+    def _max_buyable_quantity(self, symbol: str, bar: pd.Series, total_assets: float) -> int:
         # 计算当前持有的该股票的市值
         current_holding_value = sum(pos.quantity * bar['close'] for pos in self.positions if pos.symbol == symbol and not pos.is_closed())
         
         # 计算可用于购买该股票的最大金额
-        total_assets = self.calculate_total_assets()
         max_position_value = total_assets * self.max_position_percentage
         available_for_symbol = min(max_position_value - current_holding_value, self.available_cash)
         
         # 计算可购买的最大数量，并调整为100的倍数
-        max_buyable_quantity = int(available_for_symbol / bar['close'] / 100) * 100
+        return int(available_for_symbol / bar['close'] / 100) * 100
 
-        input_template = f"""
-        你是一位经验丰富的股票交易员，熟悉股票市场规律，擅长把握交易机会并控制风险。请根据以下信息为股票 {symbol} 做出交易决策：
+    def _prompt_portfolio_context(self) -> str:
+        portfolio_info = "\n".join([f"{s}: {info}" for s, info in self.portfolio.get_all_stocks().items()])
+        positions_info = "\n".join([f"{pos.symbol}: {pos.quantity}" for pos in self.positions if not pos.is_closed()])
+
+        # 协方差和持仓价格都在后台刷新，这里只使用已缓存的数据，不访问网络
+        holdings = self.get_all_positions()
+        self.risk.refresh_async(self._risk_universe(), price_symbols=holdings)
+        risk_info = self.risk.describe(self._position_values(holdings, self.risk.cached_prices())) if holdings else ""
 
-        交易规则：{self.trade_rules}
+        return f"""交易规则：{self.trade_rules}
 
         当前投资组合：
         {portfolio_info}
@@ -283,8 +441,10 @@ class LLMStockDealer:
         {positions_info}
 
         可用资金：{self.available_cash:.2f}
-        
-        {symbol} 当前可买入的最大数量（已调整为100的倍数）：{max_buyable_quantity}
+        {risk_info}"""
+
+    def _prepare_symbol_section(self, symbol: str, bar: pd.Series, news: str, max_buyable_quantity: int) -> str:
+        return f"""{symbol} 当前可买入的最大数量（已调整为100的倍数）：{max_buyable_quantity}
 
         {symbol} 最新行情数据：
         时间: {bar['datetime']}
@@ -294,32 +454,29 @@ class LLMStockDealer:
         收盘: {bar['close']:.2f}
         成交量: {bar['volume']}
 
-        {symbol} 最新新闻：
-        {news}
+        {symbol} 最近小时线（含正在形成的一根）：
+        {self._format_hourly(symbol)}
 
-        上一次的消息: {self.last_msg}
+        {symbol} 最新新闻：
+        {news}"""
 
-        请注意：
+    def _prompt_rules(self, quantity_rule: str) -> str:
+        return f"""请注意：
         1. 今天买入的股票不能在当天卖出（T+1交易规则）。
         2. 交易指令格式：
         - 买入：'buy 数量 股票代码'（例如：'buy 100 AAPL'）
         - 卖出：'sell 数量 股票代码'（例如：'sell 100 AAPL'）
         - 不交易：'hold'
-        3. 买入数量不能超过 {max_buyable_quantity}，且必须是100的倍数。
+        3. {quantity_rule}
         4. 卖出数量不能超过当前持有的数量。
         5. 请提供交易理由和交易计划（包括止损价格和目标价格）。
-        6. 即使选择持仓不变（hold），也可以根据最新行情修改交易计划。
+        6. 即使选择持仓不变（hold），也可以根据最新行情修改交易计划。"""
 
-        请根据以上信息，给出交易指令或选择不交易（hold），并提供下一次需要的消息。
-        请以JSON格式输出，包含以下字段：
-        - trade_instruction: 交易指令（字符串，例如 "buy 100 AAPL", "sell 100 AAPL" 或 "hold"）
+    def _prompt_output_fields(self) -> str:
+        return """- trade_instruction: 交易指令（字符串，例如 "buy 100 AAPL", "sell 100 AAPL" 或 "hold"）
         - next_message: 下一次需要的消息（字符串）
         - trade_reason: 此刻交易的理由（字符串）
-        - trade_plan: 交易计划，包括止损价格和目标价格，可以根据最新行情进行修改（字符串）
-
-        请确保输出的JSON格式正确。
-        """
-        return input_template, max_buyable_quantity
+        - trade_plan: 交易计划，包括止损价格和目标价格，可以根据最新行情进行修改（字符串）"""
 
     def _parse_llm_output(self, llm_response: str, max_buyable_quantity: int) -> Tuple[str, Union[int, str], str, str, str]:
         # 首先尝试提取 JSON 部分
@@ -335,14 +492,17 @@ class LLMStockDealer:
             self.logger.warning(f"Failed to parse JSON. Attempting to extract information from text response.")
             data = self._extract_info_from_text(llm_response)
 
-        trade_instruction = data.get('trade_instruction', 'hold').lower()
+        return self._parse_decision(data, max_buyable_quantity)
+
+    def _parse_decision(self, data: Dict, max_buyable_quantity: int, default_symbol: str = '') -> Tuple[str, Union[int, str], str, str, str]:
+        trade_instruction = str(data.get('trade_instruction', 'hold')).lower()
         next_msg = data.get('next_message', '')
         trade_reason = data.get('trade_reason', '')
         trade_plan = data.get('trade_plan', '')
 
-        instruction_parts = trade_instruction.split()
+        instruction_parts = trade_instruction.split() or ['hold']
         action = instruction_parts[0]
-        symbol = instruction_parts[-1] if len(instruction_parts) > 2 else ''
+        symbol = instruction_parts[-1] if len(instruction_parts) > 2 else default_symbol
 
         if action not in ['buy', 'sell', 'hold']:
             self.logger.warning(f"Invalid trade instruction: {action}. Defaulting to 'hold'.")
@@ -465,7 +625,7 @@ class LLMStockDealer:
     def _log_trade(self, symbol: str, bar: pd.Series, news: str, trade_instruction: str, quantity: Union[int, str], trade_reason: str, trade_plan: str):
         log_msg = f"""
         股票: {symbol}
-        时间: {bar['datetime']}, Bar Index: {self._get_today_bar_index(bar['datetime'])}
+        时间: {bar['datetime']}, Bar Index: {self._get_today_bar_index(bar['ts'])}
         价格: 开 {bar['open']:.2f}, 高 {bar['high']:.2f}, 低 {bar['low']:.2f}, 收 {bar['close']:.2f}
         成交量: {bar['volume']}, 持仓量: {bar.get('open_interest', bar.get('hold', 'N/A'))}
         新闻: {news[:200] + '...' if news else '无新闻数据'}
@@ -484,19 +644,14 @@ class LLMStockDealer:
             console_msg = f"股票: {symbol}, 时间: {bar['datetime']}, 价格: {bar['close']:.2f}, 交易指令: {trade_instruction} {quantity}, 交易理由: {trade_reason[:50]}..., 当前持仓: {self.get_all_positions()}, 可用资金: {self.available_cash:.2f}"
             self.logger.info(console_msg)
 
-    def _get_today_bar_index(self, timestamp: pd.Timestamp, bar_interval: int = 1) -> int:
-        from time import time
-        beijing_time = timestamp.tz_convert('Asia/Shanghai').time()
-        morning_start = time(9, 30)
-        morning_end = time(11, 30)
-        afternoon_start = time(13, 0)
-        afternoon_end = time(15, 0)
-
-        if morning_start <= beijing_time <= morning_end:
-            minutes = (beijing_time.hour - 9) * 60 + beijing_time.minute - 30
-        elif afternoon_start <= beijing_time <= afternoon_end:
-            minutes = (beijing_time.hour - 13) * 60 + beijing_time.minute + 120
-        elif beijing_time > afternoon_end:
+    def _get_today_bar_index(self, ts: int, bar_interval: int = 1) -> int:
+        """A 股当天的 bar 序号：上午从 9:30 起算，下午接在上午的 120 分钟之后；ts 为 epoch 纳秒"""
+        minute = minute_of_day(ts)
+        if 570 <= minute <= 690:  # 09:30-11:30
+            minutes = minute - 570
+        elif 780 <= minute <= 900:  # 13:00-15:00
+            minutes = minute - 780 + 120
+        elif minute > 900:
             return 240 // bar_interval  # 交易日结束后返回最后一个bar的索引
         else:
             return 0  # 交易日开始前返回0
@@ -585,33 +740,46 @@ class LLMStockDealer:
         if symbol in self.portfolio.get_all_stocks():
             self.portfolio.add_stock(symbol, self.portfolio.get_stock(symbol)['type'], new_target_price, new_stop_loss)
             self.logger.info(f"Updated trade plan for {symbol}: Target Price: {new_target_price}, Stop Loss: {new_stop_loss}")
-            self._save_data()
+            self.journal.append(stock_journal.PORTFOLIO_STOCK, {"symbol": symbol, "info": self.portfolio.get_stock(symbol)})
         else:
             self.logger.warning(f"Cannot update trade plan: {symbol} not in portfolio")
 
+    def _risk_universe(self) -> List[str]:
+        """风险引擎覆盖的股票：投资组合中关注的股票和当前持仓"""
+        return list(dict.fromkeys(list(self.portfolio.get_all_stocks()) + list(self.get_all_positions())))
+
+    def _position_values(self, holdings: Dict[str, int], prices: Optional[Dict[str, float]] = None) -> Dict[str, float]:
+        prices = prices if prices is not None else self.quotes.get_prices(holdings)
+        return {symbol: quantity * prices[symbol] for symbol, quantity in holdings.items() if symbol in prices}
+
     def get_portfolio_risk(self) -> float:
-        """Calculate the overall portfolio risk based on current positions and stock volatility"""
-        # This is a simplified risk calculation. In a real-world scenario, you would use more sophisticated methods.
-        total_value = sum(pos.quantity * self.data_provider.get_latest_price(pos.symbol) for pos in self.positions if not pos.is_closed())
-        weighted_volatility = sum(pos.quantity * self.data_provider.get_stock_volatility(pos.symbol) / total_value for pos in self.positions if not pos.is_closed())
-        return weighted_volatility * 100  # Return as percentage
+        """Calculate the overall portfolio risk as the annualized volatility of the current holdings"""
+        self.risk.update(self._risk_universe())
+        volatility = self.risk.portfolio_volatility(self._position_values(self.get_all_positions()))
+        return (volatility or 0.0) * 100  # Return as percentage
 
     def rebalance_portfolio(self):
         """Rebalance the portfolio based on current market conditions and risk tolerance"""
-        current_risk = self.get_portfolio_risk()
         target_risk = 15  # Example target risk percentage
 
+        # 价格和协方差在本次调仓中只获取一次，每次减仓后在本地重新计算组合风险
+        self.risk.update(self._risk_universe())
+        holdings = self.get_all_positions()
+        prices = self.quotes.get_prices(holdings)
+        current_risk = (self.risk.portfolio_volatility(self._position_values(holdings, prices)) or 0.0) * 100
+
         if current_risk > target_risk:
-            # Reduce positions in high-volatility stocks
-            high_vol_positions = sorted(self.positions, key=lambda p: self.data_provider.get_stock_volatility(p.symbol), reverse=True)
-            for pos in high_vol_positions:
+            # Reduce positions with the largest contribution to portfolio risk first
+            contributions = self.risk.risk_contributions(self._position_values(holdings, prices))
+            for symbol in contributions.index:
                 if current_risk <= target_risk:
                     break
-                if not pos.is_closed():
+                for pos in [p for p in self.positions if p.symbol == symbol and not p.is_closed()]:
                     reduce_quantity = int(pos.quantity * 0.2)  # Reduce position by 20%
                     if reduce_quantity > 0:
-                        self._close_position(pos.symbol, self.data_provider.get_latest_price(pos.symbol), reduce_quantity, datetime.now())
-                        current_risk = self.get_portfolio_risk()
+                        self._close_position(pos.symbol, prices[pos.symbol], reduce_quantity, datetime.now())
+                holdings = self.get_all_positions()
+                current_risk = (self.risk.portfolio_volatility(self._position_values(holdings, prices)) or 0.0) * 100
             self.logger.info(f"Rebalanced portfolio. New risk: {current_risk:.2f}%")
         else:
             self.logger.info(f"Portfolio risk ({current_risk:.2f}%) is within acceptable range. No rebalancing needed.")
@@ -0,0 +1,497 @@
+import hashlib
+import logging
+import select
+import socket
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from dealer.time_normalizer import from_epoch_ns, to_epoch_ns, to_epoch_ns_array
+
+# 每条记录的内存布局，bar 和 tick 共用；tick 的 close 为最新价
+RECORD_DTYPE = np.dtype([
+    ('ts', '<i8'), ('kind', '<i8'),
+    ('open', '<f8'), ('high', '<f8'), ('low', '<f8'), ('close', '<f8'),
+    ('volume', '<f8'), ('amount', '<f8'), ('hold', '<f8'),
+])
+KIND_BAR, KIND_TICK = 0, 1
+
+# 环形缓冲区头部：magic、容量、已写入的记录数（序号）、保留
+_HEADER_SLOTS = 4
+_HEADER_BYTES = _HEADER_SLOTS * 8
+_MAGIC = 0x4C4C4D42  # 'LLMB'
+_SEQ = 2
+
+DEFAULT_BUS = 'llm_dealer'
+DEFAULT_PORT = 58620
+DEFAULT_CAPACITY = 4096
+
+_SUBSCRIBE = b'SUB'
+_UNSUBSCRIBE = b'UNSUB'
+
+# 本进程创建（由发布端持有）的共享内存名字
+_owned_segments = set()
+
+
+DEFAULT_PERIOD = '1m'
+TICK_PERIOD = 'tick'
+
+
+def ring_name(bus: str, symbol: str, period: str = DEFAULT_PERIOD) -> str:
+    """
+    共享内存的名字：每个 (合约, 周期) 一个缓冲区，1m 和 5m 的 bar 不会混在一起。
+    合约代码中的 '.' 等字符不一定能用在名字里，取哈希。
+    """
+    return f"{bus}_{hashlib.md5(f'{symbol}|{period}'.encode('utf-8')).hexdigest()[:12]}"
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """
+    只读方式打开已有的共享内存。
+    POSIX 下 Python 会把打开的共享内存登记到 resource_tracker，进程退出时删除，
+    读端不能这样做，否则一个策略退出会删掉发布端的缓冲区。
+    发布端和读端在同一进程时，登记属于发布端，不能注销。
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        if name in _owned_segments:
+            return shm
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+        return shm
+
+
+class SharedRing:
+    """
+    一个合约的共享内存环形缓冲区。
+
+    只有发布端写入：先写记录，再递增头部的序号；读端按自己的序号读取新记录，
+    读完后再检查一次序号，丢弃读取期间被覆盖的部分。落后超过容量的记录直接跳过。
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray((_HEADER_SLOTS,), dtype='<i8', buffer=shm.buf)
+        if owner:
+            capacity = (shm.size - _HEADER_BYTES) // RECORD_DTYPE.itemsize
+            self.header[:] = (_MAGIC, capacity, 0, 0)
+        elif self.header[0] != _MAGIC:
+            raise ValueError(f"Shared memory {shm.name} is not a market bus ring")
+        self.capacity = int(self.header[1])
+        # 直接映射到共享内存的记录数组，读取不经过任何解码
+        self.records = np.ndarray((self.capacity,), dtype=RECORD_DTYPE, buffer=shm.buf, offset=_HEADER_BYTES)
+
+    @classmethod
+    def create(cls, name: str, capacity: int = DEFAULT_CAPACITY) -> "SharedRing":
+        size = _HEADER_BYTES + capacity * RECORD_DTYPE.itemsize
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # 上一次发布端异常退出时留下的缓冲区，重新创建
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        _owned_segments.add(name)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def open(cls, name: str) -> "SharedRing":
+        return cls(_attach(name), owner=False)
+
+    @property
+    def seq(self) -> int:
+        return int(self.header[_SEQ])
+
+    def write(self, ts: int, kind: int, open_: float, high: float, low: float, close: float,
+              volume: float, amount: float, hold: float) -> int:
+        seq = int(self.header[_SEQ])
+        self.records[seq % self.capacity] = (ts, kind, open_, high, low, close, volume, amount, hold)
+        self.header[_SEQ] = seq + 1
+        return seq + 1
+
+    def read(self, since: int) -> Tuple[np.ndarray, int, int]:
+        """
+        读取序号 since 之后的新记录。
+
+        :return: (记录数组的副本, 新的序号, 因落后太多而丢失的记录数)
+        """
+        current = self.seq
+        if current <= since:
+            return self.records[:0].copy(), current, 0
+        start = max(since, current - self.capacity)
+        records = self.records[np.arange(start, current) % self.capacity]
+        # 复制期间发布端可能已经绕回来覆盖了最早的几条；write 先写记录再递增序号，
+        # 序号 seq - capacity 所在的槽位可能正在被写入，也要丢弃
+        valid_from = max(start, self.seq + 1 - self.capacity)
+        if valid_from > start:
+            records = records[valid_from - start:]
+            start = valid_from
+        return records, current, start - since
+
+    def tail(self, n: int) -> np.ndarray:
+        """最近 n 条记录（副本）"""
+        records, _, _ = self.read(max(0, self.seq - n))
+        return records
+
+    def close(self):
+        self.records = None
+        self.header = None
+        self.shm.close()
+        if self.owner:
+            _owned_segments.discard(self.shm.name.lstrip('/'))
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def record_to_bar(record) -> pd.Series:
+    """把一条记录转换为 dealer 使用的 bar（带 ts 和北京时间 datetime）"""
+    ts = int(record['ts'])
+    return pd.Series({
+        'ts': ts,
+        'datetime': from_epoch_ns(ts),
+        'open': float(record['open']),
+        'high': float(record['high']),
+        'low': float(record['low']),
+        'close': float(record['close']),
+        'volume': float(record['volume']),
+        'amount': float(record['amount']),
+        'hold': float(record['hold']),
+    })
+
+
+class MarketBusPublisher:
+    """
+    行情总线的发布端，通常运行在 xt_server 进程中。
+
+    每个 (合约, 周期) 一个共享内存环形缓冲区，tick 的周期为 'tick'，写入的是已经统一为
+    epoch 纳秒时间戳的 bar/tick 记录；写入后通过本机 UDP 向订阅的进程发送一条 "合约\\t周期\\t序号" 的通知。
+    xtquant 的 1 分钟线在一分钟内会多次推送正在形成的 bar，这些更新原样发布，
+    读端看到的同一 ts 的最后一条记录即为该分钟的完整 bar。
+    订阅者定期发送心跳，超过 subscriber_ttl 秒没有心跳的订阅者不再通知。
+    """
+
+    def __init__(self, bus: str = DEFAULT_BUS, capacity: int = DEFAULT_CAPACITY, port: int = DEFAULT_PORT,
+                 subscriber_ttl: float = 30.0, logger: Optional[logging.Logger] = None):
+        self.bus = bus
+        self.capacity = capacity
+        self.port = port
+        self.subscriber_ttl = subscriber_ttl
+        self.logger = logger or logging.getLogger(__name__)
+        self.rings: Dict[Tuple[str, str], SharedRing] = {}
+        self.subscribers: Dict[Tuple[str, int], float] = {}
+        self._lock = threading.Lock()
+        self._sock: Optional[socket.socket] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self) -> "MarketBusPublisher":
+        if self._thread is not None:
+            return self
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind(('127.0.0.1', self.port))
+        self._sock.settimeout(0.5)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._serve, name="market-bus", daemon=True)
+        self._thread.start()
+        self.logger.info(f"Market bus '{self.bus}' listening on udp://127.0.0.1:{self.port}")
+        return self
+
+    def stop(self, unlink: bool = True):
+        """停止通知线程；unlink 为 True 时同时删除所有共享内存"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        if unlink:
+            with self._lock:
+                for ring in self.rings.values():
+                    ring.close()
+                self.rings.clear()
+
+    def _serve(self):
+        """接收订阅和心跳"""
+        while not self._stop.is_set():
+            try:
+                message, addr = self._sock.recvfrom(64)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            with self._lock:
+                if message == _SUBSCRIBE:
+                    if addr not in self.subscribers:
+                        self.logger.info(f"Market bus subscriber joined: {addr}")
+                    self.subscribers[addr] = time.monotonic()
+                elif message == _UNSUBSCRIBE:
+                    self.subscribers.pop(addr, None)
+
+    def _ring(self, symbol: str, period: str) -> SharedRing:
+        ring = self.rings.get((symbol, period))
+        if ring is None:
+            ring = SharedRing.create(ring_name(self.bus, symbol, period), self.capacity)
+            self.rings[(symbol, period)] = ring
+        return ring
+
+    def _notify(self, symbol: str, period: str, seq: int):
+        if self._sock is None or not self.subscribers:
+            return
+        payload = f"{symbol}\t{period}\t{seq}".encode('utf-8')
+        expire = time.monotonic() - self.subscriber_ttl
+        for addr, seen in list(self.subscribers.items()):
+            if seen < expire:
+                self.subscribers.pop(addr, None)
+                continue
+            try:
+                self._sock.sendto(payload, addr)
+            except OSError as e:
+                self.logger.debug(f"Dropping market bus subscriber {addr}: {e}")
+                self.subscribers.pop(addr, None)
+
+    def publish(self, symbol: str, ts: int, kind: int, open_: float, high: float, low: float, close: float,
+                volume: float = 0.0, amount: float = 0.0, hold: float = 0.0, period: str = DEFAULT_PERIOD) -> int:
+        with self._lock:
+            seq = self._ring(symbol, period).write(ts, kind, open_, high, low, close, volume, amount, hold)
+            self._notify(symbol, period, seq)
+        return seq
+
+    def publish_bar(self, symbol: str, bar: Mapping, period: str = DEFAULT_PERIOD) -> int:
+        """bar 可以是 xtquant 的 bar 字典（time/openInterest），也可以是 dealer 的 bar（ts/datetime/hold）"""
+        ts = bar.get('ts')
+        if ts is None:
+            ts = to_epoch_ns(bar['time'] if 'time' in bar else bar['datetime'])
+        hold = bar.get('hold', bar.get('openInterest', 0))
+        return self.publish(symbol, int(ts), KIND_BAR, bar['open'], bar['high'], bar['low'], bar['close'],
+                            bar.get('volume', 0) or 0, bar.get('amount', 0) or 0, hold or 0, period)
+
+    def publish_tick(self, symbol: str, tick: Mapping) -> int:
+        """xtquant 的 tick 字典，lastPrice 写入 close"""
+        price = tick.get('lastPrice', tick.get('close'))
+        return self.publish(symbol, to_epoch_ns(tick['time']), KIND_TICK,
+                            tick.get('open', price), tick.get('high', price), tick.get('low', price), price,
+                            tick.get('volume', 0) or 0, tick.get('amount', 0) or 0,
+                            tick.get('openInterest', 0) or 0, TICK_PERIOD)
+
+    def xt_callback(self, period: str = DEFAULT_PERIOD) -> Callable[[Dict[str, List[Dict]]], None]:
+        """返回可以直接传给 xtdata.subscribe_quote(period=period) 的回调"""
+        if period == TICK_PERIOD:
+            publish = self.publish_tick
+        else:
+            def publish(symbol, item):
+                return self.publish_bar(symbol, item, period)
+
+        def callback(data):
+            for symbol, items in data.items():
+                for item in items:
+                    try:
+                        publish(symbol, item)
+                    except Exception as e:
+                        self.logger.error(f"Failed to publish {symbol} to market bus: {e}")
+        return callback
+
+
+class MarketBusReader:
+    """
+    行情总线的读取端，在策略进程中使用，每个读取端读取一个周期（period 为 'tick' 时读取 tick）。
+
+    收到 UDP 通知后直接从共享内存读取新记录，不经过 xtdata 的解码；
+    UDP 通知丢失时，poll 超时后也会检查一遍所有缓冲区的序号，不会漏数据。
+    symbols 为 None 时读取所有收到通知的合约。
+    """
+
+    def __init__(self, symbols: Optional[Iterable[str]] = None, bus: str = DEFAULT_BUS, port: int = DEFAULT_PORT,
+                 heartbeat: float = 5.0, from_start: bool = False, period: str = DEFAULT_PERIOD,
+                 logger: Optional[logging.Logger] = None):
+        """
+        :param from_start: True 时读取构造时已经存在的缓冲区中的全部记录，否则只读之后的新记录；
+                           构造之后才出现的合约总是从头读取
+        """
+        self.symbols = set(symbols) if symbols is not None else None
+        self.bus = bus
+        self.port = port
+        self.heartbeat = heartbeat
+        self.from_start = from_start
+        self.period = period
+        self.logger = logger or logging.getLogger(__name__)
+        self.rings: Dict[str, SharedRing] = {}
+        self.positions: Dict[str, int] = {}
+        self.dropped = 0
+        self._last_heartbeat = 0.0
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.setblocking(False)
+        if self.symbols:
+            for symbol in self.symbols:
+                self._open(symbol, existing=True)
+
+    def _open(self, symbol: str, existing: bool = False) -> Optional[SharedRing]:
+        ring = self.rings.get(symbol)
+        if ring is not None:
+            return ring
+        try:
+            ring = SharedRing.open(ring_name(self.bus, symbol, self.period))
+        except FileNotFoundError:
+            return None  # 发布端还没有写过这个合约
+        self.rings[symbol] = ring
+        self.positions[symbol] = ring.seq if existing and not self.from_start else 0
+        return ring
+
+    def _heartbeat(self):
+        now = time.monotonic()
+        if now - self._last_heartbeat >= self.heartbeat:
+            try:
+                self._sock.sendto(_SUBSCRIBE, ('127.0.0.1', self.port))
+            except OSError as e:
+                self.logger.debug(f"Market bus heartbeat failed: {e}")
+            self._last_heartbeat = now
+
+    def read(self, symbol: str) -> np.ndarray:
+        """读取某个合约自上次读取以来的新记录"""
+        ring = self._open(symbol)
+        if ring is None:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        records, self.positions[symbol], dropped = ring.read(self.positions[symbol])
+        if dropped:
+            self.dropped += dropped
+            self.logger.warning(f"Market bus reader fell behind on {symbol}, skipped {dropped} records")
+        return records
+
+    def poll(self, timeout: float = 1.0) -> Dict[str, np.ndarray]:
+        """等待通知，返回 {合约: 新记录}"""
+        self._heartbeat()
+        notified = set()
+        ready, _, _ = select.select([self._sock], [], [], timeout)
+        if ready:
+            while True:
+                try:
+                    message, _ = self._sock.recvfrom(256)
+                except (BlockingIOError, OSError):
+                    break
+                parts = message.decode('utf-8', 'replace').split('\t')
+                symbol, period = parts[0], parts[1] if len(parts) > 2 else DEFAULT_PERIOD
+                if period != self.period:
+                    continue
+                if self.symbols is None or symbol in self.symbols:
+                    notified.add(symbol)
+        else:
+            notified = set(self.symbols or self.rings)
+
+        result = {}
+        for symbol in notified:
+            records = self.read(symbol)
+            if len(records):
+                result[symbol] = records
+        return result
+
+    def run(self, callback: Callable[[str, pd.Series], None], stop_event: Optional[threading.Event] = None,
+            kind: Optional[int] = None):
+        """持续读取并逐条回调 callback(symbol, bar)；周期已由 period 选定，kind 不为 None 时再按记录类型过滤"""
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            for symbol, records in self.poll().items():
+                if kind is not None:
+                    records = records[records['kind'] == kind]
+                for record in records:
+                    callback(symbol, record_to_bar(record))
+
+    def close(self):
+        try:
+            self._sock.sendto(_UNSUBSCRIBE, ('127.0.0.1', self.port))
+        except OSError:
+            pass
+        self._sock.close()
+        for ring in self.rings.values():
+            ring.close()
+        self.rings.clear()
+
+
+class ReplayPublisher:
+    """
+    不依赖 QMT 的替代发布端：把文件中的历史 bar 按时间顺序发布到行情总线。
+
+    文件为 csv / pkl / parquet，需要 symbol 列和 datetime（或 time）列，以及 open/high/low/close；
+    speed 为回放速度倍数，0 表示不等待、尽快发布。
+    """
+
+    def __init__(self, publisher: MarketBusPublisher, data, speed: float = 0.0, period: str = DEFAULT_PERIOD,
+                 logger: Optional[logging.Logger] = None):
+        self.publisher = publisher
+        self.frame = self._load(data)
+        self.speed = speed
+        self.period = period
+        self.logger = logger or logging.getLogger(__name__)
+
+    @staticmethod
+    def _load(data) -> pd.DataFrame:
+        if isinstance(data, pd.DataFrame):
+            df = data.copy()
+        elif str(data).endswith('.csv'):
+            df = pd.read_csv(data)
+        elif str(data).endswith('.parquet'):
+            df = pd.read_parquet(data)
+        else:
+            df = pd.read_pickle(data)
+        if 'ts' not in df.columns:
+            df['ts'] = to_epoch_ns_array(df['time'] if 'time' in df.columns else df['datetime'])
+        if 'hold' not in df.columns:
+            df['hold'] = df['open_interest'] if 'open_interest' in df.columns else 0.0
+        for column in ('volume', 'amount'):
+            if column not in df.columns:
+                df[column] = 0.0
+        return df.sort_values('ts', kind='stable').reset_index(drop=True)
+
+    def run(self, stop_event: Optional[threading.Event] = None) -> int:
+        """回放全部数据，返回发布的记录数"""
+        published = 0
+        started = time.monotonic()
+        first_ts = int(self.frame['ts'].iloc[0]) if len(self.frame) else 0
+        columns = ['symbol', 'ts', 'open', 'high', 'low', 'close', 'volume', 'amount', 'hold']
+        for symbol, ts, open_, high, low, close, volume, amount, hold in self.frame[columns].itertuples(index=False):
+            if stop_event is not None and stop_event.is_set():
+                break
+            if self.speed > 0:
+                delay = (ts - first_ts) / 1e9 / self.speed - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            self.publisher.publish(symbol, int(ts), KIND_BAR, open_, high, low, close, volume, amount, hold,
+                                   self.period)
+            published += 1
+        self.logger.info(f"Replayed {published} bars to market bus '{self.publisher.bus}'")
+        return published
+
+
+# 使用示例
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    publisher = MarketBusPublisher(bus='demo', capacity=64, port=58621).start()
+    reader = MarketBusReader(['rb2501.SF'], bus='demo', port=58621, from_start=True)
+    reader.poll(timeout=0.1)  # 发送订阅
+    time.sleep(0.2)
+
+    start = pd.Timestamp("2024-06-10 09:00", tz='Asia/Shanghai')
+    frame = pd.DataFrame({
+        'symbol': 'rb2501.SF',
+        'datetime': [start + pd.Timedelta(minutes=i) for i in range(5)],
+        'open': 3500.0, 'high': 3505.0, 'low': 3495.0, 'close': [3500.0 + i for i in range(5)], 'volume': 10.0,
+    })
+    ReplayPublisher(publisher, frame).run()
+    for symbol, records in reader.poll(timeout=1.0).items():
+        for record in records:
+            print(symbol, record_to_bar(record).to_dict())
+    reader.close()
+    publisher.stop()
@@ -0,0 +1,321 @@
+import atexit
+import heapq
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+# 新闻时间统一转换到北京时间
+NEWS_TIMEZONE = 'Asia/Shanghai'
+
+
+def parse_news_time(value) -> Optional[pd.Timestamp]:
+    """解析新闻发布时间：支持毫秒/秒级时间戳和时间字符串，返回带北京时区的时间，失败返回 None"""
+    if value is None or value == '':
+        return None
+    try:
+        if isinstance(value, str) and value.strip().isdigit():
+            value = int(value)
+        if isinstance(value, (int, float)):
+            unit = 'ms' if value > 1e11 else 's'
+            return pd.to_datetime(value, unit=unit, utc=True).tz_convert(NEWS_TIMEZONE)
+        ts = pd.Timestamp(value)
+        return ts.tz_localize(NEWS_TIMEZONE) if ts.tz is None else ts.tz_convert(NEWS_TIMEZONE)
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+
+def normalize_news(raw) -> List[Dict[str, Any]]:
+    """
+    把数据源返回的 DataFrame 或字典列表统一成字典列表，
+    每条包含 key、title、content、publish_time、url，key 用于去重。
+    """
+    if raw is None:
+        return []
+    if isinstance(raw, pd.DataFrame):
+        records = raw.to_dict('records')
+    else:
+        records = list(raw)
+
+    items = []
+    for record in records:
+        title = str(record.get('title') or '').strip()
+        if not title:
+            continue
+        published = parse_news_time(record.get('publish_time', record.get('datetime')))
+        url = record.get('url') or ''
+        items.append({
+            'key': url or f"{title}|{published}",
+            'title': title,
+            'content': str(record.get('content') or ''),
+            'publish_time': published,
+            'url': url,
+        })
+    return items
+
+
+def _default_summary(symbol: str, items: List[Dict[str, Any]]) -> str:
+    return "\n".join(f"- {item['title']}" for item in items)
+
+
+def make_llm_summarizer(llm_client, content_chars: int = 0, max_chars: int = 200) -> Callable[[str, List[Dict[str, Any]]], str]:
+    """
+    用 LLM 把新闻整理成交易提示简报的摘要函数。
+
+    :param content_chars: 每条新闻附带的正文字数，0 表示只用标题
+    :param max_chars: 摘要最大长度
+    """
+    def summarize(symbol: str, items: List[Dict[str, Any]]) -> str:
+        if not items:
+            return ""
+        if content_chars:
+            news_text = "\n".join(f"- {item['title']}: {item['content'][:content_chars]}..." for item in items)
+        else:
+            news_text = "\n".join(f"- {item['title']}" for item in items)
+        prompt = f"请将以下新闻整理成不超过{max_chars}字的今日交易提示简报：\n\n{news_text}"
+        return llm_client.one_chat(prompt)[:max_chars]
+    return summarize
+
+
+class _Source:
+    def __init__(self, symbol: str, name: str, fetch: Callable[[str], Any], interval: float):
+        self.symbol = symbol
+        self.name = name
+        self.fetch = fetch
+        self.interval = interval
+
+
+class NewsService:
+    """
+    后台新闻服务。
+
+    每个新闻源按自己的轮询间隔在后台线程中抓取，新条目按 key 去重后交给摘要线程，
+    摘要完成后更新该合约的 (摘要, 版本号)。bar 处理只调用 get_summary 读取内存中的结果，
+    不会等待任何网络请求或 LLM 调用；版本号变化即表示有新的新闻摘要。
+    同一进程中摘要配置相同的 dealer 通过 default() 共用一个实例，同一合约的新闻只抓取和摘要一次。
+    """
+
+    _defaults: Dict[Tuple[Any, int, int], "NewsService"] = {}
+    _default_lock = threading.Lock()
+
+    def __init__(self, summarize: Optional[Callable[[str, List[Dict[str, Any]]], str]] = None,
+                 max_items: int = 20, fetch_workers: int = 4, logger: Optional[logging.Logger] = None):
+        """
+        :param summarize: summarize(symbol, items) -> 摘要文本，items 按发布时间从新到旧排列；
+                          默认把标题逐行列出
+        :param max_items: 每个合约保留并参与摘要的最新新闻条数
+        :param fetch_workers: 并行抓取的线程数，避免一个慢的源拖住其他源
+        """
+        self.summarize = summarize or _default_summary
+        self.max_items = max_items
+        self.fetch_workers = max(1, fetch_workers)
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._sources: Dict[Tuple[str, str], _Source] = {}
+        self._schedule: List[Tuple[float, int, _Source]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+        self._items: Dict[str, List[Dict[str, Any]]] = {}
+        self._seen: Dict[str, OrderedDict] = {}
+        self._items_lock = threading.Lock()
+
+        # symbol -> (摘要, 版本号)，整体替换，读取时无需加锁
+        self._summaries: Dict[str, Tuple[str, int]] = {}
+        self._listeners: List[Callable[[str, str], None]] = []
+
+        self._summary_queue: queue.Queue = queue.Queue()
+        self._pending: set = set()
+        self._running = False
+        self._threads: List[threading.Thread] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @classmethod
+    def default(cls, llm_client=None, content_chars: int = 0, max_chars: int = 200,
+                logger: Optional[logging.Logger] = None) -> "NewsService":
+        """
+        进程内共享的新闻服务，按摘要配置 (llm_client, content_chars, max_chars) 区分，
+        配置相同的调用方得到同一个实例。第一次使用时创建并启动，进程退出时停止。
+        llm_client 为 None 时只列出标题，不调用 LLM。
+        """
+        key = (llm_client, content_chars, max_chars)
+        with cls._default_lock:
+            service = cls._defaults.get(key)
+            if service is None:
+                summarize = make_llm_summarizer(llm_client, content_chars, max_chars) if llm_client is not None else None
+                service = cls(summarize=summarize, logger=logger)
+                service.start()
+                atexit.register(service.stop)
+                cls._defaults[key] = service
+            return service
+
+    def add_source(self, symbol: str, fetch: Callable[[str], Any], interval: float = 60.0, name: str = 'default'):
+        """
+        订阅一个新闻源；同一合约可以有多个不同 name 的源，重复添加会替换原来的源。
+
+        :param fetch: fetch(symbol) 返回新闻 DataFrame 或字典列表，字段见 normalize_news
+        :param interval: 轮询间隔（秒）
+        """
+        source = _Source(symbol, name, fetch, interval)
+        with self._cond:
+            self._sources[(symbol, name)] = source
+            heapq.heappush(self._schedule, (time.monotonic(), next(self._seq), source))
+            self._cond.notify()
+
+    def remove_source(self, symbol: str, name: str = 'default'):
+        with self._cond:
+            self._sources.pop((symbol, name), None)
+
+    def has_source(self, symbol: str, name: str = 'default') -> bool:
+        return (symbol, name) in self._sources
+
+    def add_listener(self, callback: Callable[[str, str], None]):
+        """摘要更新后在摘要线程中调用 callback(symbol, summary)"""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[str, str], None]):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def get_summary(self, symbol: str) -> Tuple[str, int]:
+        """返回 (最新摘要, 版本号)，还没有摘要时返回 ("", 0)"""
+        return self._summaries.get(symbol, ("", 0))
+
+    def get_items(self, symbol: str) -> List[Dict[str, Any]]:
+        with self._items_lock:
+            return list(self._items.get(symbol, []))
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._executor = ThreadPoolExecutor(max_workers=self.fetch_workers, thread_name_prefix="news-fetch")
+        self._threads = [
+            threading.Thread(target=self._poll_loop, name="news-poller", daemon=True),
+            threading.Thread(target=self._summary_loop, name="news-summary", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        self.logger.info(f"NewsService started with {len(self._sources)} sources")
+
+    def stop(self, timeout: float = 5.0):
+        if not self._running:
+            return
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+        self._summary_queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._executor.shutdown(wait=False)
+        self._threads = []
+        self.logger.info("NewsService stopped")
+
+    def _poll_loop(self):
+        while self._running:
+            due_sources = []
+            with self._cond:
+                now = time.monotonic()
+                while self._schedule and self._schedule[0][0] <= now:
+                    _, _, source = heapq.heappop(self._schedule)
+                    # 被移除或替换的源不再轮询
+                    if self._sources.get((source.symbol, source.name)) is source:
+                        due_sources.append(source)
+                if not due_sources:
+                    timeout = self._schedule[0][0] - now if self._schedule else None
+                    self._cond.wait(timeout)
+                    continue
+            for source in due_sources:
+                self._executor.submit(self._poll_source, source)
+
+    def _poll_source(self, source: _Source):
+        try:
+            items = normalize_news(source.fetch(source.symbol))
+            if self._ingest(source.symbol, items):
+                self._request_summary(source.symbol)
+        except Exception as e:
+            self.logger.warning(f"News fetch failed for {source.symbol} ({source.name}): {str(e)}")
+        finally:
+            with self._cond:
+                if self._sources.get((source.symbol, source.name)) is source:
+                    heapq.heappush(self._schedule, (time.monotonic() + source.interval, next(self._seq), source))
+                    self._cond.notify()
+
+    def _ingest(self, symbol: str, items: List[Dict[str, Any]]) -> bool:
+        """合并新条目，返回是否有之前没见过的新闻"""
+        with self._items_lock:
+            seen = self._seen.setdefault(symbol, OrderedDict())
+            fresh = []
+            for item in items:
+                if item['key'] in seen:
+                    continue
+                seen[item['key']] = None
+                fresh.append(item)
+            if not fresh:
+                return False
+            # 去重记录只需覆盖数据源一页能返回的范围
+            while len(seen) > self.max_items * 20:
+                seen.popitem(last=False)
+
+            merged = self._items.get(symbol, []) + fresh
+            merged.sort(key=lambda item: item['publish_time'] or pd.Timestamp.min.tz_localize(NEWS_TIMEZONE),
+                        reverse=True)
+            self._items[symbol] = merged[:self.max_items]
+        self.logger.info(f"{len(fresh)} new news items for {symbol}")
+        return True
+
+    def _request_summary(self, symbol: str):
+        # 摘要尚未开始时合并重复请求，摘要时总是使用最新的条目
+        with self._items_lock:
+            if symbol in self._pending:
+                return
+            self._pending.add(symbol)
+        self._summary_queue.put(symbol)
+
+    def _summary_loop(self):
+        while True:
+            symbol = self._summary_queue.get()
+            if symbol is None:
+                return
+            with self._items_lock:
+                self._pending.discard(symbol)
+                items = list(self._items.get(symbol, []))
+            try:
+                summary = self.summarize(symbol, items)
+            except Exception as e:
+                self.logger.error(f"Error summarizing news for {symbol}: {str(e)}")
+                continue
+
+            previous, version = self.get_summary(symbol)
+            if not summary or summary == previous:
+                self.logger.info(f"No significant changes in news summary for {symbol}")
+                continue
+            self._summaries[symbol] = (summary, version + 1)
+            self.logger.info(f"Updated news summary for {symbol}: {summary[:100]}...")
+            for callback in self._listeners:
+                try:
+                    callback(symbol, summary)
+                except Exception as e:
+                    self.logger.error(f"News listener failed for {symbol}: {str(e)}")
+
+
+# 使用示例
+if __name__ == "__main__":
+    from dealer.futures_provider import MainContractProvider
+
+    logging.basicConfig(level=logging.INFO)
+    provider = MainContractProvider()
+    service = NewsService()
+    service.add_source("SC0", lambda symbol: provider.get_futures_news(symbol, page_num=0, page_size=20), interval=60)
+    service.start()
+    try:
+        time.sleep(10)
+        print(service.get_summary("SC0"))
+    finally:
+        service.stop()
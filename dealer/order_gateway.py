@@ -0,0 +1,639 @@
+import hashlib
+import itertools
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+# 订单状态
+PENDING_NEW = 'pending_new'            # 已进入网关队列，柜台尚未确认
+SUBMITTED = 'submitted'                # 柜台已接受，未成交
+PARTIALLY_FILLED = 'partially_filled'  # 部分成交
+PENDING_CANCEL = 'pending_cancel'      # 已发出撤单，等待柜台确认
+FILLED = 'filled'                      # 全部成交
+CANCELLED = 'cancelled'                # 已撤单（可能有部分成交）
+REJECTED = 'rejected'                  # 被柜台拒绝或报单失败
+
+TERMINAL_STATES = frozenset({FILLED, CANCELLED, REJECTED})
+
+# 允许的状态迁移，终态之后的迟到回报只更新成交量不改变状态
+_TRANSITIONS = {
+    PENDING_NEW: {SUBMITTED, PARTIALLY_FILLED, FILLED, PENDING_CANCEL, CANCELLED, REJECTED},
+    SUBMITTED: {PARTIALLY_FILLED, FILLED, PENDING_CANCEL, CANCELLED, REJECTED},
+    PARTIALLY_FILLED: {PARTIALLY_FILLED, FILLED, PENDING_CANCEL, CANCELLED},
+    # 撤单被拒绝时回到 SUBMITTED / PARTIALLY_FILLED
+    PENDING_CANCEL: {SUBMITTED, PARTIALLY_FILLED, FILLED, CANCELLED},
+}
+
+
+# QMT order_remark 的长度上限；追单的订单号在原订单号后加 "R<次数>"，预留 3 个字符（最多 99 次）
+ORDER_REMARK_LIMIT = 16
+_REPLACE_SUFFIX_LEN = 3
+MAX_REPLACES_LIMIT = 99
+
+
+def make_client_order_id(*parts, prefix: str = 'LLM') -> str:
+    """
+    由决策内容（合约、bar 时间、指令等）生成确定的客户端订单号。
+    同一个决策被重复投递时得到相同的订单号，网关据此去重。
+    订单号作为 QMT 的 order_remark 回传，加上追单后缀后长度仍在 16 个字符以内。
+    """
+    digest = hashlib.sha1("|".join(str(p) for p in parts).encode('utf-8')).hexdigest()
+    return f"{prefix}{digest[:ORDER_REMARK_LIMIT - _REPLACE_SUFFIX_LEN - len(prefix)]}"
+
+
+class Fill:
+    def __init__(self, fill_id: str, price: float, volume: int, time_: datetime):
+        self.fill_id = fill_id
+        self.price = price
+        self.volume = volume
+        self.time = time_
+
+    def to_dict(self) -> dict:
+        return {'fill_id': self.fill_id, 'price': self.price, 'volume': self.volume, 'time': self.time.isoformat()}
+
+
+class Order:
+    """网关订单簿中的一笔委托，所有字段只在 OrderGateway 的锁内修改"""
+
+    def __init__(self, client_order_id: str, symbol: str, side: str, volume: int,
+                 price: float, market: bool = False, root_id: Optional[str] = None, replace_count: int = 0):
+        """
+        :param side: 交易指令 buy / sell / short / cover，由后端映射为柜台的委托类型
+        :param market: 市价委托，不参与超时改价
+        :param root_id: 改单链上第一笔委托的订单号
+        """
+        self.client_order_id = client_order_id
+        self.symbol = symbol
+        self.side = side
+        self.volume = volume
+        self.price = price
+        self.market = market
+        self.root_id = root_id or client_order_id
+        self.replace_count = replace_count
+
+        self.order_id = None          # 柜台订单号
+        self.status = PENDING_NEW
+        self.message = ""
+        self.fills: List[Fill] = []
+        self.reported_volume = 0      # 委托回报中的成交量，成交回报可能晚于委托回报到达
+        self.created_at = datetime.now()
+        self.updated_at = self.created_at
+        self.submitted_at: Optional[float] = None  # time.monotonic()，用于判断超时
+        self.replace_requested = False
+        self.replaced_by: Optional[str] = None
+
+    @property
+    def filled_volume(self) -> int:
+        return max(sum(f.volume for f in self.fills), self.reported_volume)
+
+    @property
+    def remaining(self) -> int:
+        return max(self.volume - self.filled_volume, 0)
+
+    @property
+    def avg_fill_price(self) -> Optional[float]:
+        volume = sum(f.volume for f in self.fills)
+        if volume == 0:
+            return None
+        return sum(f.price * f.volume for f in self.fills) / volume
+
+    @property
+    def is_active(self) -> bool:
+        return self.status not in TERMINAL_STATES
+
+    def to_dict(self) -> dict:
+        return {
+            'client_order_id': self.client_order_id,
+            'order_id': self.order_id,
+            'symbol': self.symbol,
+            'side': self.side,
+            'volume': self.volume,
+            'price': self.price,
+            'market': self.market,
+            'status': self.status,
+            'filled_volume': self.filled_volume,
+            'avg_fill_price': self.avg_fill_price,
+            'message': self.message,
+            'root_id': self.root_id,
+            'replaced_by': self.replaced_by,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat(),
+        }
+
+    def __repr__(self):
+        return (f"Order({self.client_order_id} {self.side} {self.symbol} {self.filled_volume}/{self.volume}"
+                f" @ {'market' if self.market else self.price} {self.status})")
+
+
+class OrderGateway:
+    """
+    QMT 策略的异步下单网关。
+
+    决策线程调用 submit() 只是在订单簿中登记订单并放入队列，立即返回；
+    网关线程负责调用后端报单和撤单。柜台的委托、成交、报错回调通过
+    on_order_status / on_fill / on_reject 更新订单状态，策略在下一次决策前
+    即可从订单簿读到部分成交、拒单以及仍在途的委托量。
+
+    客户端订单号作为 order_remark 报给柜台，回报据此对应到订单；
+    重复提交同一个订单号时直接返回已有订单，不会重复报单。
+    限价单在 stale_after 秒内没有全部成交时撤单，撤单确认后按 reprice 给出的新价格
+    对剩余数量重新报单，最多 max_replaces 次。
+    """
+
+    def __init__(self, backend, stale_after: Optional[float] = 30.0, max_replaces: int = 2,
+                 reprice: Optional[Callable[[Order], Optional[float]]] = None,
+                 check_interval: float = 1.0, logger: Optional[logging.Logger] = None):
+        """
+        :param backend: 下单后端，需要实现 bind(gateway)、submit(order)、cancel(order)
+        :param stale_after: 限价单超时秒数，None 表示不做超时改价
+        :param reprice: 根据被撤订单返回新的委托价，返回 None 时沿用原价
+        :param check_interval: 网关线程检查超时订单的间隔（秒）
+        """
+        self.backend = backend
+        self.stale_after = stale_after
+        self.max_replaces = min(max_replaces, MAX_REPLACES_LIMIT)
+        self.reprice = reprice
+        self.check_interval = check_interval
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._lock = threading.RLock()
+        self._orders: Dict[str, Order] = {}
+        self._by_order_id: Dict[object, str] = {}
+        self._seen_fills = set()
+        self._listeners: List[Callable[[Order], None]] = []
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        self._counter = itertools.count(1)
+
+        self.backend.bind(self)
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="order-gateway", daemon=True)
+        self._thread.start()
+        self.logger.info("OrderGateway started")
+
+    def stop(self, timeout: Optional[float] = 5.0):
+        """停止网关线程，队列中尚未报出的订单仍会先报出"""
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+        self.logger.info(f"OrderGateway stopped. {self.describe()}")
+
+    def add_listener(self, callback: Callable[[Order], None]):
+        """订单状态或成交量变化时调用 callback(order)，在回调线程中执行"""
+        self._listeners.append(callback)
+
+    # ---- 下单 ----
+
+    def submit(self, symbol: str, side: str, volume: int, price: float, market: bool = False,
+               client_order_id: Optional[str] = None) -> Order:
+        """登记一笔委托并放入报单队列，返回订单；订单号已存在时返回已有订单"""
+        with self._lock:
+            if client_order_id is not None and client_order_id in self._orders:
+                order = self._orders[client_order_id]
+                self.logger.info(f"Duplicate order {client_order_id} ignored: {order}")
+                return order
+            if client_order_id is None:
+                client_order_id = f"GW{int(time.time()) % 100000:05d}{next(self._counter):05d}"
+            order = Order(client_order_id, symbol, side, int(volume), price, market)
+            self._orders[client_order_id] = order
+        self._queue.put(('submit', order))
+        self.logger.info(f"Order queued: {order}")
+        return order
+
+    def cancel(self, client_order_id: str) -> bool:
+        """请求撤单，订单不存在或已是终态时返回 False"""
+        with self._lock:
+            order = self._orders.get(client_order_id)
+            if order is None or not order.is_active or order.status == PENDING_CANCEL:
+                return False
+        self._queue.put(('cancel', order))
+        return True
+
+    def cancel_all(self, symbol: Optional[str] = None):
+        for order in self.orders(symbol, active_only=True):
+            self.cancel(order.client_order_id)
+
+    # ---- 网关线程 ----
+
+    def _run(self):
+        while True:
+            try:
+                command = self._queue.get(timeout=self.check_interval)
+            except queue.Empty:
+                command = False
+            if command is None:
+                break
+            if command:
+                action, order = command
+                try:
+                    if action == 'submit':
+                        self._send(order)
+                    else:
+                        self._send_cancel(order)
+                except Exception as e:
+                    self.logger.error(f"OrderGateway failed to {action} {order}: {str(e)}", exc_info=True)
+            if self.stale_after is not None:
+                self._check_stale()
+        # 停止前报出队列中剩余的订单
+        while True:
+            try:
+                command = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if command and command[0] == 'submit':
+                self._send(command[1])
+
+    def _send(self, order: Order):
+        with self._lock:
+            if order.status != PENDING_NEW:
+                return
+            order.submitted_at = time.monotonic()
+        try:
+            self.backend.submit(order)
+        except Exception as e:
+            self.on_reject(order.client_order_id, message=f"submit failed: {str(e)}")
+
+    def _send_cancel(self, order: Order):
+        with self._lock:
+            if not order.is_active or order.status == PENDING_CANCEL:
+                return
+            if order.order_id is None:
+                # 尚未报出的订单直接撤销
+                if order.status == PENDING_NEW and order.submitted_at is None:
+                    self._set_status(order, CANCELLED, "cancelled before submit")
+                    return
+                self.logger.warning(f"Cannot cancel {order}: no broker order id yet")
+                order.replace_requested = False
+                return
+            self._set_status(order, PENDING_CANCEL)
+        try:
+            self.backend.cancel(order)
+        except Exception as e:
+            self.on_cancel_reject(order.client_order_id, message=str(e))
+
+    def _check_stale(self):
+        now = time.monotonic()
+        stale = []
+        with self._lock:
+            for order in self._orders.values():
+                if (order.market or order.status not in (SUBMITTED, PARTIALLY_FILLED)
+                        or order.replace_requested or order.submitted_at is None):
+                    continue
+                if now - order.submitted_at >= self.stale_after:
+                    # 改单次数用完后只撤单，不再重报
+                    order.replace_requested = order.replace_count < self.max_replaces
+                    stale.append(order)
+        for order in stale:
+            self.logger.info(f"Order stale after {self.stale_after}s, cancelling"
+                             f"{' for replace' if order.replace_requested else ''}: {order}")
+            self._send_cancel(order)
+
+    def _replace(self, order: Order):
+        """被撤订单的剩余数量按新价格重新报单"""
+        price = order.price
+        if self.reprice is not None:
+            try:
+                new_price = self.reprice(order)
+                if new_price is not None:
+                    price = new_price
+            except Exception as e:
+                self.logger.error(f"Reprice failed for {order}: {str(e)}")
+        count = order.replace_count + 1
+        replacement = Order(f"{order.root_id}R{count}", order.symbol, order.side, order.remaining,
+                            price, order.market, root_id=order.root_id, replace_count=count)
+        self._orders[replacement.client_order_id] = replacement
+        order.replaced_by = replacement.client_order_id
+        self._queue.put(('submit', replacement))
+        self.logger.info(f"Replacing {order.client_order_id} with {replacement}")
+
+    # ---- 柜台回报 ----
+
+    def _find(self, client_order_id: Optional[str], order_id=None) -> Optional[Order]:
+        order = self._orders.get(client_order_id) if client_order_id else None
+        if order is None and order_id is not None:
+            order = self._orders.get(self._by_order_id.get(order_id))
+        return order
+
+    def _set_status(self, order: Order, status: str, message: str = "") -> bool:
+        if status != order.status and status not in _TRANSITIONS.get(order.status, ()):
+            self.logger.debug(f"Ignored transition {order.status} -> {status} for {order.client_order_id}")
+            return False
+        order.status = status
+        if message:
+            order.message = message
+        order.updated_at = datetime.now()
+        if status == CANCELLED and order.replace_requested and order.remaining > 0 and self._running:
+            self._replace(order)
+        return True
+
+    def _notify(self, order: Order):
+        for callback in self._listeners:
+            try:
+                callback(order)
+            except Exception as e:
+                self.logger.error(f"Order listener failed: {str(e)}", exc_info=True)
+
+    def on_submitted(self, client_order_id: str, order_id):
+        """后端报单成功，记录柜台订单号"""
+        with self._lock:
+            order = self._orders.get(client_order_id)
+            if order is None:
+                return
+            order.order_id = order_id
+            self._by_order_id[order_id] = client_order_id
+            self._set_status(order, SUBMITTED)
+        self._notify(order)
+
+    def on_order_status(self, client_order_id: Optional[str], order_id, status: str,
+                        filled_volume: Optional[int] = None, message: str = ""):
+        """委托回报，status 为本模块的订单状态"""
+        with self._lock:
+            order = self._find(client_order_id, order_id)
+            if order is None:
+                self.logger.debug(f"Order status for unknown order {client_order_id}/{order_id}: {status}")
+                return
+            if order_id is not None and order.order_id is None:
+                order.order_id = order_id
+                self._by_order_id[order_id] = order.client_order_id
+            if filled_volume is not None:
+                order.reported_volume = max(order.reported_volume, int(filled_volume))
+            if status == FILLED:
+                order.reported_volume = order.volume
+            self._set_status(order, status, message)
+        self._notify(order)
+
+    def on_fill(self, client_order_id: Optional[str], order_id, fill_id: str, price: float, volume: int):
+        """成交回报，同一个 fill_id 只计一次；终态之后的迟到成交同样计入"""
+        with self._lock:
+            order = self._find(client_order_id, order_id)
+            if order is None:
+                self.logger.debug(f"Fill for unknown order {client_order_id}/{order_id}")
+                return
+            key = (order.client_order_id, fill_id)
+            if key in self._seen_fills:
+                return
+            self._seen_fills.add(key)
+            order.fills.append(Fill(fill_id, price, int(volume), datetime.now()))
+            if order.filled_volume >= order.volume:
+                self._set_status(order, FILLED)
+            elif order.status != PENDING_CANCEL:
+                self._set_status(order, PARTIALLY_FILLED)
+            else:
+                order.updated_at = datetime.now()
+        self.logger.info(f"Fill {volume} @ {price}: {order}")
+        self._notify(order)
+
+    def on_reject(self, client_order_id: Optional[str], order_id=None, message: str = ""):
+        """报单被拒绝"""
+        with self._lock:
+            order = self._find(client_order_id, order_id)
+            if order is None:
+                return
+            self._set_status(order, REJECTED, message)
+        self.logger.error(f"Order rejected: {order} {message}")
+        self._notify(order)
+
+    def on_cancel_reject(self, client_order_id: Optional[str], order_id=None, message: str = ""):
+        """撤单失败，订单回到撤单前的状态"""
+        with self._lock:
+            order = self._find(client_order_id, order_id)
+            if order is None:
+                return
+            order.replace_requested = False
+            if order.status == PENDING_CANCEL:
+                self._set_status(order, PARTIALLY_FILLED if order.filled_volume else SUBMITTED, message)
+        self.logger.warning(f"Cancel rejected: {order} {message}")
+        self._notify(order)
+
+    # ---- 查询 ----
+
+    def get_order(self, client_order_id: str) -> Optional[Order]:
+        with self._lock:
+            return self._orders.get(client_order_id)
+
+    def orders(self, symbol: Optional[str] = None, active_only: bool = False) -> List[Order]:
+        with self._lock:
+            return [o for o in self._orders.values()
+                    if (symbol is None or o.symbol == symbol) and (not active_only or o.is_active)]
+
+    def working_volume(self, symbol: str, side: Optional[str] = None) -> int:
+        """在途（已报未成交）的委托数量，下单前用它扣减可开仓数量"""
+        with self._lock:
+            return sum(o.remaining for o in self._orders.values()
+                       if o.symbol == symbol and o.is_active and (side is None or o.side == side))
+
+    def filled_volume(self, symbol: str, side: Optional[str] = None) -> int:
+        with self._lock:
+            return sum(o.filled_volume for o in self._orders.values()
+                       if o.symbol == symbol and (side is None or o.side == side))
+
+    def describe(self, symbol: Optional[str] = None) -> str:
+        with self._lock:
+            orders = [o for o in self._orders.values() if symbol is None or o.symbol == symbol]
+            counts: Dict[str, int] = {}
+            for order in orders:
+                counts[order.status] = counts.get(order.status, 0) + 1
+            active = [repr(o) for o in orders if o.is_active]
+        summary = ", ".join(f"{status}={count}" for status, count in sorted(counts.items())) or "no orders"
+        return f"orders: {summary}" + (f"; active: {'; '.join(active)}" if active else "")
+
+
+class XtQuantBackend:
+    """
+    通过 XtQuantTrader 报单的后端。
+
+    报单和撤单在网关线程中同步调用 order_stock / cancel_order_stock；
+    策略把 XtQuantTraderCallback 的回调转发给同名方法，由这里转换成网关的回报。
+    """
+
+    def __init__(self, trader, account, side_types: Dict[str, int], market_price_type: int,
+                 strategy_name: str = 'LLM_strategy', logger: Optional[logging.Logger] = None):
+        """
+        :param side_types: 交易指令到 xtconstant 委托类型的映射
+        :param market_price_type: 市价委托使用的报价类型
+        """
+        from xtquant import xtconstant
+
+        self.trader = trader
+        self.account = account
+        self.side_types = side_types
+        self.market_price_type = market_price_type
+        self.limit_price_type = xtconstant.FIX_PRICE
+        self.strategy_name = strategy_name
+        self.logger = logger or logging.getLogger(__name__)
+        self.gateway: Optional[OrderGateway] = None
+
+        # xtconstant 委托状态 -> 网关订单状态
+        status_names = {
+            'ORDER_UNREPORTED': SUBMITTED,
+            'ORDER_WAIT_REPORTING': SUBMITTED,
+            'ORDER_REPORTED': SUBMITTED,
+            'ORDER_REPORTED_CANCEL': PENDING_CANCEL,
+            'ORDER_PARTSUCC_CANCEL': PENDING_CANCEL,
+            'ORDER_PART_CANCEL': CANCELLED,
+            'ORDER_CANCELED': CANCELLED,
+            'ORDER_PART_SUCC': PARTIALLY_FILLED,
+            'ORDER_SUCCEEDED': FILLED,
+            'ORDER_JUNK': REJECTED,
+        }
+        self.status_map = {getattr(xtconstant, name): status
+                           for name, status in status_names.items() if hasattr(xtconstant, name)}
+
+    @classmethod
+    def futures(cls, trader, account, **kwargs) -> 'XtQuantBackend':
+        from xtquant import xtconstant
+        return cls(trader, account, {
+            'buy': xtconstant.FUTURE_OPEN_LONG,
+            'sell': xtconstant.FUTURE_CLOSE_LONG_TODAY,
+            'short': xtconstant.FUTURE_OPEN_SHORT,
+            'cover': xtconstant.FUTURE_CLOSE_SHORT_TODAY,
+        }, xtconstant.MARKET_BEST, **kwargs)
+
+    @classmethod
+    def stock(cls, trader, account, **kwargs) -> 'XtQuantBackend':
+        from xtquant import xtconstant
+        return cls(trader, account, {
+            'buy': xtconstant.STOCK_BUY,
+            'sell': xtconstant.STOCK_SELL,
+        }, xtconstant.LATEST_PRICE, **kwargs)
+
+    def bind(self, gateway: OrderGateway):
+        self.gateway = gateway
+
+    def submit(self, order: Order):
+        if order.side not in self.side_types:
+            self.gateway.on_reject(order.client_order_id, message=f"unsupported side {order.side}")
+            return
+        price_type = self.market_price_type if order.market else self.limit_price_type
+        order_id = self.trader.order_stock(self.account, order.symbol, self.side_types[order.side], order.volume,
+                                           price_type, order.price, self.strategy_name, order.client_order_id)
+        if order_id is None or order_id < 0:
+            self.gateway.on_reject(order.client_order_id, message=f"order_stock returned {order_id}")
+        else:
+            self.gateway.on_submitted(order.client_order_id, order_id)
+
+    def cancel(self, order: Order):
+        result = self.trader.cancel_order_stock(self.account, order.order_id)
+        if result != 0:
+            self.gateway.on_cancel_reject(order.client_order_id, order.order_id, f"cancel_order_stock returned {result}")
+
+    # ---- XtQuantTraderCallback 转发 ----
+
+    def on_stock_order(self, order):
+        status = self.status_map.get(order.order_status)
+        if status is None:
+            self.logger.debug(f"Unmapped order status {order.order_status} for {order.order_remark}")
+            return
+        self.gateway.on_order_status(order.order_remark, order.order_id, status,
+                                     order.traded_volume, getattr(order, 'status_msg', ''))
+
+    def on_stock_trade(self, trade):
+        self.gateway.on_fill(trade.order_remark, trade.order_id, str(trade.traded_id),
+                             trade.traded_price, trade.traded_volume)
+
+    def on_order_error(self, order_error):
+        self.gateway.on_reject(order_error.order_remark, order_error.order_id, order_error.error_msg)
+
+    def on_cancel_error(self, cancel_error):
+        self.gateway.on_cancel_reject(None, cancel_error.order_id, cancel_error.error_msg)
+
+
+class SimulatedBackend:
+    """
+    不连接柜台的模拟后端，用于测试网关和策略的下单流程。
+
+    市价单按最新价立即全部成交；限价买单在最新价不高于委托价、限价卖单在最新价不低于委托价时成交。
+    每次撮合最多成交剩余数量的 fill_ratio（至少 1 手），可以模拟部分成交。
+    reject_symbols 中的合约直接拒单。
+    """
+
+    def __init__(self, fill_ratio: float = 1.0, reject_symbols=(), logger: Optional[logging.Logger] = None):
+        self.fill_ratio = fill_ratio
+        self.reject_symbols = set(reject_symbols)
+        self.logger = logger or logging.getLogger(__name__)
+        self.gateway: Optional[OrderGateway] = None
+        self.prices: Dict[str, float] = {}
+        self._resting: Dict[int, Order] = {}
+        self._order_ids = itertools.count(1)
+        self._fill_ids = itertools.count(1)
+        self._lock = threading.RLock()
+
+    def bind(self, gateway: OrderGateway):
+        self.gateway = gateway
+
+    def set_price(self, symbol: str, price: float):
+        """更新最新价并撮合挂单"""
+        with self._lock:
+            self.prices[symbol] = price
+            for order in list(self._resting.values()):
+                if order.symbol == symbol:
+                    self._match(order)
+
+    def submit(self, order: Order):
+        if order.symbol in self.reject_symbols:
+            self.gateway.on_reject(order.client_order_id, message="simulated reject")
+            return
+        with self._lock:
+            order_id = next(self._order_ids)
+            self.gateway.on_submitted(order.client_order_id, order_id)
+            self._resting[order_id] = order
+            self._match(order)
+
+    def cancel(self, order: Order):
+        with self._lock:
+            if self._resting.pop(order.order_id, None) is None:
+                self.gateway.on_cancel_reject(order.client_order_id, order.order_id, "order not resting")
+                return
+        self.gateway.on_order_status(order.client_order_id, order.order_id, CANCELLED)
+
+    def _match(self, order: Order):
+        price = self.prices.get(order.symbol)
+        if price is None or order.remaining <= 0:
+            return
+        if not order.market:
+            buying = order.side in ('buy', 'cover')
+            if (buying and price > order.price) or (not buying and price < order.price):
+                return
+        volume = order.remaining if order.market else min(order.remaining, max(1, int(order.remaining * self.fill_ratio)))
+        self.gateway.on_fill(order.client_order_id, order.order_id, f"F{next(self._fill_ids)}", price, volume)
+        if order.remaining == 0:
+            self._resting.pop(order.order_id, None)
+
+
+# 使用示例
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    backend = SimulatedBackend(fill_ratio=0.5)
+    gateway = OrderGateway(backend, stale_after=2.0, reprice=lambda o: backend.prices.get(o.symbol))
+    gateway.start()
+
+    backend.set_price("rb2410.SF", 3500.0)
+    market = gateway.submit("rb2410.SF", 'buy', 4, 3500.0, market=True,
+                            client_order_id=make_client_order_id("rb2410.SF", "2024-06-03 09:31", 'buy'))
+    # 同一个决策重复提交，不会重复报单
+    gateway.submit("rb2410.SF", 'buy', 4, 3500.0, market=True, client_order_id=market.client_order_id)
+
+    # 低于市价的限价卖单不会成交，超时后撤单并按最新价重报
+    limit = gateway.submit("rb2410.SF", 'sell', 2, 3520.0)
+    time.sleep(1)
+    backend.set_price("rb2410.SF", 3501.0)
+    time.sleep(4)
+    for o in gateway.orders():
+        print(o.to_dict())
+    print(gateway.describe())
+    gateway.stop()
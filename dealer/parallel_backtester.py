@@ -0,0 +1,212 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import pandas as pd
+from tqdm import tqdm
+
+from dealer.backtester import Backtester
+from dealer.futures_provider import MainContractProvider
+from dealer.llm_dealer import LLMDealer
+from core.utils.llm_cache import CachedLLMClient, LLMResponseCache
+
+# LLMDealer 在回测模式下用到的周期，以及 get_bar_data 对应的回看天数
+HISTORY_PERIODS = {'1': 5, '60': 5, 'D': 365}
+
+
+class BarDataCache:
+    """
+    一次性获取整个回测区间（含历史预热）的 bar 数据并保存为 pickle，
+    之后各个回测进程只读这个文件，不再逐日访问 rqdatac。
+    """
+
+    def __init__(self, symbol: str, start_date: str, end_date: str, data_provider: MainContractProvider,
+                 cache_dir: str = './output/backtest_cache'):
+        self.symbol = symbol
+        self.start_date = start_date
+        self.end_date = end_date
+        self.data_provider = data_provider
+        self.cache_dir = cache_dir
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.cache_dir, f"{self.symbol}_{self.start_date}_{self.end_date}.pkl")
+
+    def load(self) -> str:
+        """确保缓存文件存在并返回其路径"""
+        if os.path.exists(self.path):
+            self.logger.info(f"Using cached bar data: {self.path}")
+            return self.path
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        start = datetime.strptime(self.start_date, '%Y-%m-%d')
+        frames = {}
+        for period, lookback_days in HISTORY_PERIODS.items():
+            range_start = (start - timedelta(days=lookback_days)).strftime('%Y-%m-%d')
+            self.logger.info(f"Fetching {self.symbol} period {period} from {range_start} to {self.end_date}")
+            frames[period] = self.data_provider.get_bar_range(self.symbol, period, range_start, self.end_date)
+
+        tmp_path = self.path + '.tmp'
+        pd.to_pickle(frames, tmp_path)
+        os.replace(tmp_path, self.path)
+        self.logger.info(f"Bar data cached to {self.path}")
+        return self.path
+
+
+class CachedBarProvider:
+    """
+    用预加载的数据模拟 MainContractProvider 的回测接口，
+    get_bar_data 返回的时间窗口与 MainContractProvider.get_bar_data 相同。
+    """
+
+    def __init__(self, frames: Dict[str, pd.DataFrame]):
+        self.frames = {}
+        for period, df in frames.items():
+            df = df.copy()
+            key = self._date_column(df)
+            df[key] = pd.to_datetime(df[key])
+            self.frames[period] = df
+
+    @staticmethod
+    def _date_column(df: pd.DataFrame) -> str:
+        for column in ('trading_date', 'date', 'datetime'):
+            if column in df.columns:
+                return column
+        raise ValueError("Cached bar data has no date column")
+
+    def get_bar_data(self, name: str, period: str = '1', date: Optional[str] = None) -> pd.DataFrame:
+        if period not in self.frames:
+            raise ValueError(f"Period {period} is not cached")
+        end_date = pd.Timestamp(date or datetime.now().strftime('%Y-%m-%d'))
+        start_date = end_date - timedelta(days=HISTORY_PERIODS.get(period, 5))
+
+        df = self.frames[period]
+        key = self._date_column(df)
+        mask = (df[key] >= start_date) & (df[key] < end_date + timedelta(days=1))
+        return df[mask].copy()
+
+    def trading_dates(self, start_date: datetime, end_date: datetime) -> List[datetime]:
+        df = self.frames['1']
+        dates = pd.DatetimeIndex(df[self._date_column(df)].dt.normalize().unique())
+        return sorted(d.to_pydatetime() for d in dates if start_date <= d <= end_date)
+
+    def get_futures_news(self, *args, **kwargs):
+        return None
+
+
+# 每个工作进程只初始化一次的上下文：bar 数据和该进程自己的 LLM 客户端
+_worker_context = {}
+
+
+def _init_worker(cache_path: str, llm_api: Optional[str], llm_factory: Optional[Callable],
+                 llm_cache_path: Optional[str] = None):
+    _worker_context['provider'] = CachedBarProvider(pd.read_pickle(cache_path))
+    if llm_factory is not None:
+        llm_client = llm_factory()
+    else:
+        from core.llms.llm_factory import LLMFactory
+        llm_client = LLMFactory().get_instance(llm_api or "")
+    if llm_cache_path:
+        # 各进程共享同一个 SQLite 响应缓存，重复的 prompt 不再请求 API
+        llm_client = CachedLLMClient(llm_client, LLMResponseCache(llm_cache_path))
+    _worker_context['llm_client'] = llm_client
+
+
+def _run_day(symbol: str, trading_date: datetime, start_date: datetime,
+             dealer_kwargs: Dict) -> Tuple[datetime, List[Tuple[str, Union[int, str], float, datetime]]]:
+    """回测单个交易日，返回当天每根 bar 的 (指令, 数量, 收盘价, 时间)"""
+    provider = _worker_context['provider']
+    llm_client = _worker_context['llm_client']
+    date_str = trading_date.strftime('%Y-%m-%d')
+
+    dealer = LLMDealer(llm_client, symbol, provider, backtest_date=date_str, **dealer_kwargs)
+    trading_day_data = provider.get_bar_data(symbol, '1', date_str)
+    filtered_data = trading_day_data[
+        (trading_day_data['trading_date'] == trading_date) &
+        (trading_day_data['datetime'] >= start_date)
+    ]
+
+    decisions = []
+    for _, bar in filtered_data.iterrows():
+        close, bar_time = bar['close'], bar['datetime']
+        result = dealer.process_bar(bar)
+        decisions.append((result[0], result[1], close, bar_time))
+    return trading_date, decisions
+
+
+class ParallelBacktester(Backtester):
+    """
+    多进程回测：整个区间的数据只获取一次，按交易日分片到进程池中并行回测，
+    每个进程持有自己的 LLM 客户端，最后按日期顺序把各日的决策回放到统一的交易记录中。
+
+    各交易日的 LLMDealer 本来就是独立创建的（日内策略，收盘前平仓），所以分片不改变回测结果。
+    """
+
+    def __init__(self, symbol: str, start_date: str, end_date: str, data_provider: MainContractProvider,
+                 llm_api: Optional[str] = None, llm_factory: Optional[Callable] = None,
+                 compact_mode=False, max_position: int = 5, workers: Optional[int] = None,
+                 cache_dir: str = './output/backtest_cache', llm_cache_path: Optional[str] = None):
+        """
+        :param llm_api: 工作进程中通过 LLMFactory 创建的 LLM 客户端类名
+        :param llm_factory: 可 pickle 的无参函数，返回 LLM 客户端；优先于 llm_api
+        :param workers: 进程数，默认为 CPU 核数
+        :param llm_cache_path: LLM 响应缓存文件，提供时重复回测不再请求 API
+        """
+        super().__init__(symbol, start_date, end_date, None, data_provider,
+                         compact_mode=compact_mode, max_position=max_position)
+        self.llm_api = llm_api
+        self.llm_factory = llm_factory
+        self.workers = workers or os.cpu_count() or 1
+        self.llm_cache_path = llm_cache_path
+        self.cache = BarDataCache(symbol, start_date, end_date, data_provider, cache_dir)
+        self.failed_dates: List[datetime] = []
+
+    def run_backtest(self):
+        cache_path = self.cache.load()
+        provider = CachedBarProvider(pd.read_pickle(cache_path))
+        trading_dates = provider.trading_dates(self.start_date, self.end_date)
+        dealer_kwargs = {'max_position': self.max_position, 'compact_mode': self.compact_mode}
+
+        self.logger.info(f"Backtesting {len(trading_dates)} trading days with {self.workers} processes")
+        daily_results: Dict[datetime, list] = {}
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(cache_path, self.llm_api, self.llm_factory, self.llm_cache_path)) as executor:
+            futures = {
+                executor.submit(_run_day, self.symbol, trading_date, self.start_date, dealer_kwargs): trading_date
+                for trading_date in trading_dates
+            }
+            with tqdm(total=len(futures), desc="Overall Progress") as pbar:
+                for future in as_completed(futures):
+                    trading_date = futures[future]
+                    try:
+                        _, decisions = future.result()
+                        daily_results[trading_date] = decisions
+                    except Exception as e:
+                        self.failed_dates.append(trading_date)
+                        self.logger.error(f"Backtest failed for {trading_date.strftime('%Y-%m-%d')}: {str(e)}", exc_info=True)
+                    pbar.update(1)
+
+        # 按日期顺序回放，得到与串行回测一致的交易记录
+        for trading_date in sorted(daily_results):
+            for instruction, quantity, price, timestamp in daily_results[trading_date]:
+                self.ledger.add_mark(price, timestamp)
+                self._record_trade(instruction, quantity, price, timestamp)
+
+        if self.failed_dates:
+            self.logger.warning(f"{len(self.failed_dates)} trading days failed: "
+                                f"{[d.strftime('%Y-%m-%d') for d in sorted(self.failed_dates)]}")
+        self._calculate_performance()
+        print("\nBacktest completed!")
+
+
+# 使用示例
+if __name__ == "__main__":
+    from core.config import get_key
+
+    backtester = ParallelBacktester("SC", "2023-01-01", "2023-12-31", MainContractProvider(),
+                                    llm_api=get_key('llm_api', default="MiniMaxClient"))
+    backtester.run_backtest()
+    print(backtester.get_trade_history())
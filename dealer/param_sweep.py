@@ -0,0 +1,177 @@
+import itertools
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+import pandas as pd
+from tqdm import tqdm
+
+from dealer.backtest_analytics import compute_performance
+from dealer.backtester import Backtester
+from dealer.futures_provider import MainContractProvider
+from dealer.parallel_backtester import BarDataCache, CachedBarProvider, _init_worker, _run_day
+
+# 可以扫描的 LLMDealer 参数
+SWEEP_PARAMETERS = ('trade_rules', 'max_position', 'compact_mode',
+                    'max_daily_bars', 'max_hourly_bars', 'max_minute_bars')
+
+# 结果表中保留的绩效指标
+RESULT_METRICS = ('total_pnl', 'realized_pnl', 'win_rate', 'avg_trade_pnl', 'profit_factor',
+                  'max_drawdown', 'sharpe', 'sortino', 'closed_trades', 'fills', 'turnover_notional')
+
+
+def expand_grid(grid: Union[Dict[str, Iterable], List[Dict]]) -> List[Dict]:
+    """
+    把参数网格展开为参数组合列表。
+
+    grid 为 {参数名: 取值列表} 时取笛卡尔积；为字典列表时视为已经展开的组合，
+    可以用来只比较几组手工挑选的参数。
+    """
+    if isinstance(grid, dict):
+        names = list(grid)
+        combos = [dict(zip(names, values)) for values in itertools.product(*(list(grid[n]) for n in names))]
+    else:
+        combos = [dict(combo) for combo in grid]
+    for combo in combos:
+        unknown = set(combo) - set(SWEEP_PARAMETERS)
+        if unknown:
+            raise ValueError(f"Unknown sweep parameters: {sorted(unknown)}")
+    return combos
+
+
+class ParameterSweep:
+    """
+    在同一段行情上比较多组 LLMDealer 参数。
+
+    整个区间的 bar 数据只获取一次（与 ParallelBacktester 共用 BarDataCache），
+    所有 (参数组合, 交易日) 任务放进同一个进程池调度，进程数不受组合数限制。
+    各进程的 LLM 客户端共享一个 SQLite 响应缓存：中断后重跑或在网格中加入新的取值时，
+    已经回测过的 prompt 直接命中缓存。
+    每组参数的决策按日期顺序回放到各自的 Backtester 中计算绩效，最后汇总为一张结果表。
+    """
+
+    def __init__(self, symbol: str, start_date: str, end_date: str, data_provider: MainContractProvider,
+                 grid: Union[Dict[str, Iterable], List[Dict]], llm_api: Optional[str] = None,
+                 llm_factory: Optional[Callable] = None, workers: Optional[int] = None,
+                 cache_dir: str = './output/backtest_cache', llm_cache_path: Optional[str] = None,
+                 output_path: Optional[str] = None, multiplier: float = 1.0,
+                 initial_capital: Optional[float] = None):
+        """
+        :param grid: 参数网格，见 expand_grid；未给出的参数使用 LLMDealer 的默认值，max_position 默认为 5
+        :param llm_cache_path: LLM 响应缓存文件，默认放在 cache_dir 下
+        :param output_path: 结果表 CSV 路径，默认 ./output/sweeps/{symbol}_{start}_{end}.csv
+        """
+        self.symbol = symbol
+        self.start_date = start_date
+        self.end_date = end_date
+        self.data_provider = data_provider
+        self.combos = expand_grid(grid)
+        self.llm_api = llm_api
+        self.llm_factory = llm_factory
+        self.workers = workers or os.cpu_count() or 1
+        self.cache = BarDataCache(symbol, start_date, end_date, data_provider, cache_dir)
+        self.llm_cache_path = llm_cache_path or os.path.join(cache_dir, 'llm_responses.db')
+        self.output_path = output_path or os.path.join('./output/sweeps', f"{symbol}_{start_date}_{end_date}.csv")
+        self.multiplier = multiplier
+        self.initial_capital = initial_capital
+        self.logger = logging.getLogger(__name__)
+
+        self.backtesters: List[Backtester] = []
+        self.failed: Dict[int, List[datetime]] = {}
+        self.results = pd.DataFrame()
+
+    def _make_backtester(self, combo: Dict) -> Backtester:
+        return Backtester(self.symbol, self.start_date, self.end_date, None, self.data_provider,
+                          compact_mode=combo.get('compact_mode', False),
+                          max_position=combo.get('max_position', 5),
+                          multiplier=self.multiplier, initial_capital=self.initial_capital)
+
+    def run(self) -> pd.DataFrame:
+        cache_path = self.cache.load()
+        provider = CachedBarProvider(pd.read_pickle(cache_path))
+        start = datetime.strptime(self.start_date, '%Y-%m-%d')
+        trading_dates = provider.trading_dates(start, datetime.strptime(self.end_date, '%Y-%m-%d'))
+
+        self.backtesters = [self._make_backtester(combo) for combo in self.combos]
+        dealer_kwargs = [{'max_position': bt.max_position, **combo} for bt, combo in zip(self.backtesters, self.combos)]
+        self.failed = {i: [] for i in range(len(self.combos))}
+        daily_results: Dict[int, Dict[datetime, list]] = {i: {} for i in range(len(self.combos))}
+
+        self.logger.info(f"Sweeping {len(self.combos)} parameter sets over {len(trading_dates)} trading days "
+                         f"with {self.workers} processes")
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(cache_path, self.llm_api, self.llm_factory, self.llm_cache_path)) as executor:
+            # 按日期优先排列，各组参数的进度大致同步，中途查看结果时可以比较
+            futures = {
+                executor.submit(_run_day, self.symbol, trading_date, start, dealer_kwargs[i]): (i, trading_date)
+                for trading_date in trading_dates for i in range(len(self.combos))
+            }
+            with tqdm(total=len(futures), desc="Parameter sweep") as pbar:
+                for future in as_completed(futures):
+                    i, trading_date = futures[future]
+                    try:
+                        _, decisions = future.result()
+                        daily_results[i][trading_date] = decisions
+                    except Exception as e:
+                        self.failed[i].append(trading_date)
+                        self.logger.error(f"Run {i} failed for {trading_date.strftime('%Y-%m-%d')}: {str(e)}", exc_info=True)
+                    pbar.update(1)
+
+        rows = []
+        for i, (combo, backtester) in enumerate(zip(self.combos, self.backtesters)):
+            for trading_date in sorted(daily_results[i]):
+                for instruction, quantity, price, timestamp in daily_results[i][trading_date]:
+                    backtester.ledger.add_mark(price, timestamp)
+                    backtester._record_trade(instruction, quantity, price, timestamp)
+            backtester.performance = compute_performance(backtester.ledger, self.multiplier, self.initial_capital)
+            backtester.profit_loss = backtester.performance['total_pnl']
+            rows.append(self._result_row(i, combo, backtester))
+
+        self.results = pd.DataFrame(rows).set_index('run_id')
+        self.save()
+        return self.results
+
+    def _result_row(self, run_id: int, combo: Dict, backtester: Backtester) -> Dict:
+        row = {'run_id': run_id}
+        for name in SWEEP_PARAMETERS:
+            if name in combo:
+                row[name] = combo[name]
+        performance = backtester.performance
+        row.update({metric: performance.get(metric) for metric in RESULT_METRICS})
+        row['open_trades'] = backtester.open_trades
+        row['close_trades'] = backtester.close_trades
+        row['failed_days'] = len(self.failed.get(run_id, []))
+        return row
+
+    def save(self):
+        """写出结果表 CSV，以及包含完整绩效报告的同名 JSON"""
+        if self.results.empty:
+            return
+        os.makedirs(os.path.dirname(self.output_path) or '.', exist_ok=True)
+        self.results.to_csv(self.output_path, encoding='utf-8-sig')
+        reports = [{'run_id': i, 'params': combo, 'performance': bt.performance,
+                    'failed_days': [d.strftime('%Y-%m-%d') for d in sorted(self.failed.get(i, []))]}
+                   for i, (combo, bt) in enumerate(zip(self.combos, self.backtesters))]
+        with open(os.path.splitext(self.output_path)[0] + '.json', 'w', encoding='utf-8') as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2, default=str)
+        self.logger.info(f"Sweep results written to {self.output_path}")
+
+    def best(self, metric: str = 'total_pnl', ascending: bool = False) -> pd.Series:
+        """按某个指标返回最优的一组参数及其结果"""
+        return self.results.sort_values(metric, ascending=ascending).iloc[0]
+
+
+# 使用示例
+if __name__ == "__main__":
+    from core.config import get_key
+
+    sweep = ParameterSweep("SC", "2024-03-01", "2024-03-31", MainContractProvider(), {
+        'max_position': [1, 3],
+        'compact_mode': [False, True],
+        'max_minute_bars': [120, 240],
+    }, llm_api=get_key('llm_api', default="MiniMaxClient"))
+    print(sweep.run())
+    print(sweep.best('sharpe'))
@@ -0,0 +1,111 @@
+import hashlib
+import inspect
+import json
+import re
+import sqlite3
+import time
+import unicodedata
+from typing import Any, Dict, Optional
+
+from core.utils.sqlite_store import SQLiteStore
+from .logger import logger
+
+# 查询末尾不影响含义的标点
+_TRAILING_PUNCTUATION = "。．.！!？?；;，,、 "
+
+
+def normalize_query(query: str) -> str:
+    """
+    查询文本归一化：全角转半角、去掉多余空白和末尾标点、英文转小写。
+    "从百度热榜挑选5支值得短线关注的股票。" 和 "从百度热榜挑选５支值得短线关注的股票" 得到同一个 key。
+    """
+    text = unicodedata.normalize('NFKC', query)
+    text = re.sub(r'\s+', ' ', text).strip().rstrip(_TRAILING_PUNCTUATION)
+    return text.lower()
+
+
+def provider_signature(provider) -> str:
+    """
+    数据提供者的签名：自我描述文本加上所有公开方法的参数签名的哈希。
+    数据函数增删或改参数后，旧的计划和代码不再命中。
+    """
+    parts = []
+    if hasattr(provider, 'get_self_description'):
+        parts.append(provider.get_self_description())
+    for name, member in sorted(inspect.getmembers(type(provider), inspect.isfunction)):
+        if name.startswith('_'):
+            continue
+        try:
+            parts.append(f"{name}{inspect.signature(member)}")
+        except (TypeError, ValueError):
+            parts.append(name)
+    return hashlib.sha256("\n".join(parts).encode('utf-8')).hexdigest()[:16]
+
+
+class QueryCache(SQLiteStore):
+    """
+    StockQuery / StockQueryStream 的计划和代码缓存，保存在 SQLite 中。
+
+    key 为 (查询类型, 归一化后的查询, 数据提供者签名)；只保存执行成功的最终代码
+    （经过运行时修复后的版本）。缓存的代码执行失败时由调用方 invalidate 后重新生成。
+    """
+
+    def __init__(self, path: str = "./output/query_cache.db", timeout: float = 30.0):
+        super().__init__(path, ["CREATE TABLE IF NOT EXISTS queries (key TEXT PRIMARY KEY, kind TEXT NOT NULL, "
+                                "query TEXT NOT NULL, signature TEXT NOT NULL, plan TEXT NOT NULL, code TEXT NOT NULL, "
+                                "hits INTEGER NOT NULL DEFAULT 0, created REAL NOT NULL, last_used REAL NOT NULL)"],
+                         timeout)
+
+    @staticmethod
+    def make_key(kind: str, query: str, signature: str) -> str:
+        payload = f"{kind}\n{normalize_query(query)}\n{signature}"
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, kind: str, query: str, signature: str) -> Optional[Dict[str, Any]]:
+        """命中时返回 {'plan': ..., 'code': ...}"""
+        key = self.make_key(kind, query, signature)
+        try:
+            conn = self._connection()
+            row = conn.execute("SELECT plan, code FROM queries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE queries SET hits = hits + 1, last_used = ? WHERE key = ?", (time.time(), key))
+            return {'plan': json.loads(row[0]), 'code': json.loads(row[1])}
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning(f"查询缓存读取失败: {e}")
+            return None
+
+    def put(self, kind: str, query: str, signature: str, plan: Any, code: Any):
+        now = time.time()
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO queries (key, kind, query, signature, plan, code, hits, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?)",
+                (self.make_key(kind, query, signature), kind, normalize_query(query), signature,
+                 json.dumps(plan, ensure_ascii=False), json.dumps(code, ensure_ascii=False), now, now))
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logger.warning(f"查询缓存写入失败: {e}")
+
+    def invalidate(self, kind: str, query: str, signature: str):
+        try:
+            self._connection().execute("DELETE FROM queries WHERE key = ?", (self.make_key(kind, query, signature),))
+        except sqlite3.Error as e:
+            logger.warning(f"查询缓存删除失败: {e}")
+
+    def clear(self, kind: Optional[str] = None):
+        if kind is None:
+            self._connection().execute("DELETE FROM queries")
+        else:
+            self._connection().execute("DELETE FROM queries WHERE kind = ?", (kind,))
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM queries").fetchone()[0]
+
+
+# 使用示例
+if __name__ == "__main__":
+    cache = QueryCache("./output/query_cache_demo.db")
+    cache.put("stock_query", "从百度热榜挑选5支值得短线关注的股票。", "demo",
+              [{"description": "示例步骤"}], ["code_tools.add('output_result', 1)"])
+    print(cache.get("stock_query", " 从百度热榜挑选５支值得短线关注的股票 ", "demo"))
+    print(len(cache))
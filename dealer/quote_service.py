@@ -0,0 +1,158 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+TRADING_DAYS_PER_YEAR = 250
+
+
+def plain_code(symbol: str) -> str:
+    """去掉市场后缀，600000.SH -> 600000"""
+    return symbol.split(".")[0]
+
+
+class QuoteService:
+    """
+    股票组合估值和风险计算用的行情服务。
+
+    最新价来自一次全市场快照（stock_zh_a_spot_em），在 snapshot_ttl 秒内复用；
+    每只股票的日收盘价序列按自然日缓存，当天只下载一次。
+    波动率和协方差对所有持仓一起做向量化计算。
+    """
+
+    def __init__(self, data_provider, snapshot_ttl: float = 5.0, lookback_days: int = 30,
+                 fetch_workers: int = 4, logger: Optional[logging.Logger] = None):
+        """
+        :param snapshot_ttl: 全市场价格快照的有效期（秒）
+        :param lookback_days: 计算波动率使用的自然日天数，与 get_stock_volatility 的默认值一致
+        :param fetch_workers: 并行下载日线数据的线程数
+        """
+        self.data_provider = data_provider
+        self.snapshot_ttl = snapshot_ttl
+        self.lookback_days = lookback_days
+        self.fetch_workers = max(1, fetch_workers)
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._snapshot: Dict[str, float] = {}
+        self._snapshot_time = 0.0
+        # 股票代码 -> (下载日期, 收盘价序列)
+        self._closes: Dict[str, Tuple[date, pd.Series]] = {}
+
+    def get_prices(self, symbols: Iterable[str]) -> Dict[str, float]:
+        """
+        返回 {symbol: 最新价}，key 与传入的代码相同。
+        快照中没有的股票逐只查询，仍然失败的股票不包含在结果中。
+        """
+        symbols = list(dict.fromkeys(symbols))
+        if not symbols:
+            return {}
+        snapshot = self._get_snapshot()
+        prices = {}
+        for symbol in symbols:
+            price = snapshot.get(plain_code(symbol))
+            if price is None:
+                try:
+                    price = self.data_provider.get_latest_price(symbol)
+                except Exception as e:
+                    self.logger.error(f"Error getting latest price for {symbol}: {str(e)}")
+                    continue
+            prices[symbol] = price
+        return prices
+
+    def get_price(self, symbol: str) -> Optional[float]:
+        return self.get_prices([symbol]).get(symbol)
+
+    def _get_snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            if time.monotonic() - self._snapshot_time <= self.snapshot_ttl:
+                return self._snapshot
+            try:
+                self._snapshot = self.data_provider.get_latest_prices()
+            except Exception as e:
+                # 快照失败时沿用旧快照，调用方对缺失的股票会逐只查询
+                self.logger.error(f"Error fetching market snapshot: {str(e)}")
+            self._snapshot_time = time.monotonic()
+            return self._snapshot
+
+    def invalidate(self):
+        """让下一次 get_prices 重新获取快照"""
+        with self._lock:
+            self._snapshot_time = 0.0
+
+    def get_closes(self, symbols: Iterable[str]) -> pd.DataFrame:
+        """返回按日期对齐的收盘价，列为股票代码；今天已经下载过的股票直接使用缓存"""
+        symbols = list(dict.fromkeys(symbols))
+        today = datetime.now().date()
+        with self._lock:
+            missing = [s for s in symbols if s not in self._closes or self._closes[s][0] != today]
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(self.fetch_workers, len(missing))) as executor:
+                fetched = dict(zip(missing, executor.map(self._fetch_closes, missing)))
+            with self._lock:
+                for symbol, closes in fetched.items():
+                    if closes is not None:
+                        self._closes[symbol] = (today, closes)
+
+        with self._lock:
+            series = {s: self._closes[s][1] for s in symbols if s in self._closes}
+        if not series:
+            return pd.DataFrame()
+        return pd.concat(series, axis=1).sort_index()
+
+    def _fetch_closes(self, symbol: str) -> Optional[pd.Series]:
+        end_date = datetime.now().strftime('%Y%m%d')
+        start_date = (datetime.now() - timedelta(days=self.lookback_days)).strftime('%Y%m%d')
+        try:
+            df = self.data_provider.get_historical_daily_data(plain_code(symbol), start_date, end_date)
+            return pd.Series(df['收盘'].astype(float).values, index=pd.to_datetime(df['日期']))
+        except Exception as e:
+            self.logger.error(f"Error fetching daily history for {symbol}: {str(e)}")
+            return None
+
+    def get_returns(self, symbols: Iterable[str]) -> pd.DataFrame:
+        """日收益率矩阵，行是日期，列是股票代码"""
+        closes = self.get_closes(symbols)
+        if closes.empty:
+            return closes
+        return closes.pct_change().iloc[1:]
+
+    def get_volatilities(self, symbols: Iterable[str], annualize: bool = True) -> pd.Series:
+        """各股票日收益率的标准差，算法与 get_stock_volatility 相同"""
+        returns = self.get_returns(symbols)
+        if returns.empty:
+            return pd.Series(dtype=float)
+        volatility = returns.std()
+        return volatility * np.sqrt(TRADING_DAYS_PER_YEAR) if annualize else volatility
+
+    def get_covariance(self, symbols: Iterable[str], annualize: bool = True) -> pd.DataFrame:
+        """收益率协方差矩阵，按两只股票共同的交易日计算"""
+        returns = self.get_returns(symbols)
+        if returns.empty:
+            return pd.DataFrame()
+        covariance = returns.cov()
+        return covariance * TRADING_DAYS_PER_YEAR if annualize else covariance
+
+    def clear(self):
+        with self._lock:
+            self._snapshot = {}
+            self._snapshot_time = 0.0
+            self._closes.clear()
+
+
+# 使用示例
+if __name__ == "__main__":
+    from dealer.stock_data_provider import StockDataProvider
+    from core.llms.llm_factory import LLMFactory
+
+    provider = StockDataProvider(LLMFactory().get_instance())
+    quotes = QuoteService(provider)
+    symbols: List[str] = ["600000.SH", "000001.SZ", "600519.SH"]
+    print(quotes.get_prices(symbols))
+    print(quotes.get_volatilities(symbols))
+    print(quotes.get_covariance(symbols))
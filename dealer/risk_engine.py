@@ -0,0 +1,300 @@
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from statistics import NormalDist
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from dealer.quote_service import QuoteService, TRADING_DAYS_PER_YEAR
+
+
+def ledoit_wolf_correlation(returns: np.ndarray) -> Tuple[np.ndarray, float]:
+    """
+    对相关系数矩阵做 Ledoit-Wolf 收缩（目标为单位阵），即把相关系数向 0 收缩而保留各自的方差。
+
+    :param returns: n x p 收益率矩阵
+    :return: (收缩后的相关系数矩阵, 收缩强度)
+    """
+    n, p = returns.shape
+    std = returns.std(axis=0)
+    std[std == 0] = 1.0
+    x = (returns - returns.mean(axis=0)) / std
+    sample = x.T @ x / n
+    mu = np.trace(sample) / p
+    delta = np.sum((sample - mu * np.eye(p)) ** 2) / p
+    if delta == 0:
+        return sample, 0.0
+    row_norms = np.sum(x ** 2, axis=1)
+    beta = (np.sum(row_norms ** 2) / n - np.sum(sample ** 2)) / (n * p)
+    shrinkage = min(max(beta, 0.0), delta) / delta
+    shrunk = shrinkage * mu * np.eye(p) + (1 - shrinkage) * sample
+    # 还原为相关系数（对角线为 1）
+    scale = np.sqrt(np.diag(shrunk))
+    return shrunk / np.outer(scale, scale), shrinkage
+
+
+class RiskEngine:
+    """
+    股票组合风险引擎。
+
+    为持仓和关注股票维护一个滚动的日收益率窗口，样本协方差通过窗口内的和与叉积和增量更新
+    （新的一天加入一行、移出最旧的一行），相关系数按 Ledoit-Wolf 收缩。
+    协方差每天只在 update 时重新计算一次，组合波动率、边际风险贡献和 VaR
+    都只是对缓存矩阵的几次矩阵乘法。
+    没有任何历史收益率的股票不进入协方差，记录在 uncovered 中，不参与风险计算。
+    """
+
+    def __init__(self, quotes: QuoteService, window: int = 60, confidence: float = 0.95,
+                 logger: Optional[logging.Logger] = None):
+        """
+        :param quotes: 提供日收盘价的行情服务，其 lookback_days 需要覆盖 window 个交易日
+        :param window: 滚动窗口的交易日数
+        :param confidence: VaR 的置信水平
+        """
+        self.quotes = quotes
+        self.window = window
+        self.confidence = confidence
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self.symbols: List[str] = []
+        self.uncovered: List[str] = []
+        self._index: Dict[str, int] = {}
+        self._rows: deque = deque()
+        self._last_date: Optional[pd.Timestamp] = None
+        self._sum = np.zeros(0)
+        self._cross = np.zeros((0, 0))
+        self._covariance: Optional[np.ndarray] = None
+        self.shrinkage = 0.0
+        self._updated_on: Optional[date] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="risk-engine")
+        self._refreshing = False
+        self._prices: Dict[str, float] = {}
+
+    @property
+    def ready(self) -> bool:
+        return self._covariance is not None
+
+    def _is_current(self, symbols: List[str]) -> bool:
+        return self._updated_on == datetime.now().date() and set(symbols) <= set(self.symbols) | set(self.uncovered)
+
+    def update(self, symbols: Iterable[str]) -> bool:
+        """
+        把新的交易日加入窗口并重新计算协方差；股票范围扩大时从历史数据重建。
+        同一天内对已覆盖的股票重复调用直接返回。
+
+        :return: 协方差是否可用
+        """
+        symbols = list(dict.fromkeys(symbols))
+        today = datetime.now().date()
+        with self._lock:
+            if self._is_current(symbols):
+                return self.ready
+            universe = self.symbols + [s for s in symbols if s not in self._index]
+
+        returns = self.quotes.get_returns(universe)
+        if returns.empty:
+            self.logger.warning("No return data available for risk engine")
+            return self.ready
+        # 完全没有历史数据的股票不能按 0 方差处理，否则会稀释组合波动率和 VaR
+        uncovered = [s for s in universe if s not in returns.columns or returns[s].isna().all()]
+        if uncovered:
+            self.logger.warning(f"No price history for {uncovered}, excluded from risk engine")
+        universe = [s for s in universe if s not in uncovered]
+        # 停牌或上市较晚的股票在缺失的日子按 0 收益处理
+        returns = returns.reindex(columns=universe).fillna(0.0)
+
+        with self._lock:
+            self.uncovered = uncovered
+            if not universe:
+                self.symbols, self._index, self._covariance = [], {}, None
+                self._updated_on = today
+                return self.ready
+            if universe != self.symbols or self._last_date is None:
+                self._rebuild(universe, returns)
+            else:
+                for day, row in returns[returns.index > self._last_date].iterrows():
+                    self._push(day, row.values)
+            self._recompute()
+            self._updated_on = today
+        return self.ready
+
+    def refresh_async(self, symbols: Iterable[str], price_symbols: Optional[Iterable[str]] = None):
+        """
+        在后台线程中调用 update，已有刷新在进行时忽略。
+
+        :param price_symbols: 同时在后台刷新这些股票的最新价，之后用 cached_prices 读取
+        """
+        symbols = list(symbols)
+        price_symbols = list(price_symbols) if price_symbols is not None else None
+        with self._lock:
+            stale = not self._is_current(symbols)
+            if self._refreshing or (not stale and not price_symbols):
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                if price_symbols:
+                    prices = self.quotes.get_prices(price_symbols)
+                    with self._lock:
+                        self._prices.update(prices)
+                if stale:
+                    self.update(symbols)
+            except Exception as e:
+                self.logger.error(f"Risk engine refresh failed: {str(e)}", exc_info=True)
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        self._executor.submit(run)
+
+    def cached_prices(self) -> Dict[str, float]:
+        """refresh_async 最近一次在后台取得的价格，不访问网络"""
+        with self._lock:
+            return dict(self._prices)
+
+    def _rebuild(self, universe: List[str], returns: pd.DataFrame):
+        self.symbols = universe
+        self._index = {symbol: i for i, symbol in enumerate(universe)}
+        self._rows.clear()
+        self._sum = np.zeros(len(universe))
+        self._cross = np.zeros((len(universe), len(universe)))
+        self._last_date = None
+        for day, row in returns.tail(self.window).iterrows():
+            self._push(day, row.values)
+
+    def _push(self, day: pd.Timestamp, row: np.ndarray):
+        row = np.asarray(row, dtype=float)
+        self._rows.append(row)
+        self._sum += row
+        self._cross += np.outer(row, row)
+        if len(self._rows) > self.window:
+            old = self._rows.popleft()
+            self._sum -= old
+            self._cross -= np.outer(old, old)
+        self._last_date = day
+
+    def _recompute(self):
+        n = len(self._rows)
+        if n < 2:
+            self._covariance = None
+            return
+        mean = self._sum / n
+        sample = (self._cross - n * np.outer(mean, mean)) / (n - 1)
+        variances = np.clip(np.diag(sample), 0.0, None)
+        correlation, self.shrinkage = ledoit_wolf_correlation(np.vstack(self._rows))
+        std = np.sqrt(variances)
+        self._covariance = correlation * np.outer(std, std)
+
+    def covariance(self, annualize: bool = True) -> pd.DataFrame:
+        with self._lock:
+            if self._covariance is None:
+                return pd.DataFrame()
+            cov = self._covariance * (TRADING_DAYS_PER_YEAR if annualize else 1)
+            return pd.DataFrame(cov, index=self.symbols, columns=self.symbols)
+
+    def _exposure(self, values: Dict[str, float]):
+        """按缓存的股票顺序排列持仓市值；不在风险范围内的股票不计入"""
+        with self._lock:
+            covariance = self._covariance
+            index = self._index
+            symbols = self.symbols
+        if covariance is None:
+            return None, None, []
+        exposure = np.zeros(len(symbols))
+        for symbol, value in values.items():
+            if symbol in index:
+                exposure[index[symbol]] = value
+        return exposure, covariance, symbols
+
+    def portfolio_volatility(self, values: Dict[str, float], annualize: bool = True) -> Optional[float]:
+        """
+        组合收益率的波动率。
+
+        :param values: {symbol: 持仓市值}
+        :return: 相对总市值的波动率，协方差尚不可用时返回 None
+        """
+        exposure, covariance, _ = self._exposure(values)
+        total = exposure.sum() if exposure is not None else 0
+        if exposure is None or total <= 0:
+            return None
+        weights = exposure / total
+        volatility = float(np.sqrt(max(weights @ covariance @ weights, 0.0)))
+        return volatility * np.sqrt(TRADING_DAYS_PER_YEAR) if annualize else volatility
+
+    def risk_contributions(self, values: Dict[str, float]) -> pd.DataFrame:
+        """
+        各持仓的风险贡献（按年化计算）。
+
+        marginal: 增加单位权重时组合波动率的变化
+        contribution: 权重 x marginal，各项之和等于组合波动率
+        share: contribution 占组合波动率的比例
+        """
+        exposure, covariance, symbols = self._exposure(values)
+        if exposure is None or exposure.sum() <= 0:
+            return pd.DataFrame(columns=['weight', 'marginal', 'contribution', 'share'])
+        weights = exposure / exposure.sum()
+        cov_weights = covariance @ weights * TRADING_DAYS_PER_YEAR
+        volatility = np.sqrt(max(weights @ cov_weights, 0.0))
+        if volatility == 0:
+            marginal = np.zeros(len(symbols))
+        else:
+            marginal = cov_weights / volatility
+        contribution = weights * marginal
+        df = pd.DataFrame({
+            'weight': weights,
+            'marginal': marginal,
+            'contribution': contribution,
+            'share': contribution / volatility if volatility else 0.0,
+        }, index=symbols)
+        return df[df['weight'] != 0].sort_values('contribution', ascending=False)
+
+    def value_at_risk(self, values: Dict[str, float], horizon_days: int = 1,
+                      confidence: Optional[float] = None) -> Optional[float]:
+        """参数法（正态）VaR，返回在给定置信水平下 horizon_days 天内的最大损失金额"""
+        exposure, covariance, _ = self._exposure(values)
+        if exposure is None:
+            return None
+        z = NormalDist().inv_cdf(confidence or self.confidence)
+        daily_std = np.sqrt(max(exposure @ covariance @ exposure, 0.0))
+        return float(z * daily_std * np.sqrt(horizon_days))
+
+    def describe(self, values: Dict[str, float]) -> str:
+        """用于 prompt 的一段风险描述，协方差尚不可用时返回空字符串"""
+        volatility = self.portfolio_volatility(values)
+        if volatility is None:
+            return ""
+        var = self.value_at_risk(values)
+        contributions = self.risk_contributions(values)
+        top = ", ".join(f"{symbol} {row['share']:.0%}" for symbol, row in contributions.head(3).iterrows())
+        text = (f"组合年化波动率：{volatility:.2%}，{self.confidence:.0%} 置信度单日 VaR：{var:.2f}，"
+                f"主要风险来源：{top}")
+        with self._lock:
+            index = self._index
+        uncovered = [symbol for symbol in values if symbol not in index]
+        if uncovered:
+            text += f"；缺少历史数据、未计入风险：{', '.join(uncovered)}"
+        return text
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+# 使用示例
+if __name__ == "__main__":
+    from dealer.stock_data_provider import StockDataProvider
+    from core.llms.llm_factory import LLMFactory
+
+    provider = StockDataProvider(LLMFactory().get_instance())
+    engine = RiskEngine(QuoteService(provider, lookback_days=120))
+    holdings = {"600000.SH": 100000.0, "000001.SZ": 50000.0, "600519.SH": 200000.0}
+    engine.update(holdings)
+    print(engine.covariance())
+    print(engine.portfolio_volatility(holdings))
+    print(engine.risk_contributions(holdings))
+    print(engine.value_at_risk(holdings))
@@ -0,0 +1,114 @@
+import re
+from functools import lru_cache
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from dealer.time_normalizer import minute_of_day as ns_minute_of_day
+from dealer.trade_time import trading_hours
+
+MINUTES_PER_DAY = 1440
+NIGHT_START = 21 * 60
+
+# 日盘时段（含收盘那一分钟的 bar），收盘时间按品种取自 trade_time
+DAY_SESSIONS = ((9 * 60, 11 * 60 + 30), (13 * 60, None))
+# 品种不在 trade_time 中时使用的默认时段：15:00 收盘，夜盘到 02:30
+DEFAULT_HOURS = ['15:00', '02:30']
+
+NO_SESSION, DAY_SESSION, NIGHT_SESSION = 0, 1, 2
+
+
+def _to_minute(hhmm: str) -> int:
+    hour, minute = map(int, hhmm.split(':'))
+    return hour * 60 + minute
+
+
+def product_code(symbol: str) -> str:
+    """合约代码转品种代码，例如 rb2501 -> RB, SC0 -> SC"""
+    match = re.match(r'[A-Za-z]+', symbol)
+    return (match.group(0) if match else symbol).upper()
+
+
+class SessionCalendar:
+    """
+    单个品种的交易时段表。
+
+    构造时按品种的日盘/夜盘收盘时间生成长度 1440 的分钟数组：
+    session[m] 表示该分钟属于哪个时段，minutes_to_close[m] 表示距离所在时段收盘还有几分钟。
+    之后的判断和过滤都是一次数组下标访问，DataFrame 过滤也是向量化的。
+    """
+
+    def __init__(self, product: str):
+        self.product = product
+        day_close, night_close = trading_hours.get(product, DEFAULT_HOURS)
+        self.day_close = _to_minute(day_close)
+        self.night_close = _to_minute(night_close) if night_close else None
+
+        self.session = np.zeros(MINUTES_PER_DAY, dtype=np.int8)
+        self.minutes_to_close = np.full(MINUTES_PER_DAY, -1, dtype=np.int16)
+
+        for start, end in DAY_SESSIONS:
+            end = self.day_close if end is None else end
+            self.session[start:end + 1] = DAY_SESSION
+        day_minutes = np.flatnonzero(self.session == DAY_SESSION)
+        self.minutes_to_close[day_minutes] = self.day_close - day_minutes
+
+        if self.night_close is not None:
+            # 夜盘跨过午夜时，收盘时间按第二天计算
+            close = self.night_close if self.night_close >= NIGHT_START else self.night_close + MINUTES_PER_DAY
+            night_minutes = np.arange(NIGHT_START, close + 1)
+            wrapped = night_minutes % MINUTES_PER_DAY
+            self.session[wrapped] = NIGHT_SESSION
+            self.minutes_to_close[wrapped] = close - night_minutes
+
+        self.mask = self.session != NO_SESSION
+
+    @classmethod
+    def for_symbol(cls, symbol: str) -> "SessionCalendar":
+        return _calendar_for_product(product_code(symbol))
+
+    @property
+    def has_night_session(self) -> bool:
+        return self.night_close is not None
+
+    @staticmethod
+    def minute_of_day(dt) -> int:
+        """dt 可以是 datetime，也可以是 epoch 纳秒（bar['ts']）"""
+        if isinstance(dt, (int, np.integer)):
+            return int(ns_minute_of_day(dt))
+        return dt.hour * 60 + dt.minute
+
+    def is_trading_time(self, dt) -> bool:
+        return bool(self.mask[self.minute_of_day(dt)])
+
+    def session_of(self, dt) -> Optional[str]:
+        """返回 'day'、'night'，不在交易时段时返回 None"""
+        code = self.session[self.minute_of_day(dt)]
+        return 'day' if code == DAY_SESSION else 'night' if code == NIGHT_SESSION else None
+
+    def minutes_until_close(self, dt) -> int:
+        """距离所在时段收盘的分钟数，不在交易时段时返回 -1"""
+        return int(self.minutes_to_close[self.minute_of_day(dt)])
+
+    def trading_mask(self, datetimes: pd.Series) -> np.ndarray:
+        """对一列时间做向量化判断，带时区的时间先转换为北京时间；int64 列视为 epoch 纳秒"""
+        if pd.api.types.is_integer_dtype(datetimes):
+            return self.mask[ns_minute_of_day(np.asarray(datetimes, dtype=np.int64))]
+        datetimes = pd.to_datetime(datetimes)
+        if datetimes.dt.tz is not None:
+            datetimes = datetimes.dt.tz_convert('Asia/Shanghai')
+        minutes = datetimes.dt.hour.values * 60 + datetimes.dt.minute.values
+        return self.mask[minutes]
+
+    def filter_frame(self, df: pd.DataFrame, column: str = 'datetime') -> pd.DataFrame:
+        if df.empty:
+            return df
+        if column == 'datetime' and 'ts' in df.columns:
+            column = 'ts'
+        return df[self.trading_mask(df[column])]
+
+
+@lru_cache(maxsize=None)
+def _calendar_for_product(product: str) -> SessionCalendar:
+    return SessionCalendar(product)
@@ -2611,6 +2611,18 @@ class StockDataProvider:
         except Exception as e:
             raise ValueError(f"无法获取股票 {symbol} 的最新价格: {str(e)}")
 
+    def get_latest_prices(self) -> Dict[str, float]:
+        """
+        一次请求获取全部A股的最新价格。
+
+        返回:
+        Dict[str, float]: 不带市场后缀的股票代码到最新价的字典，停牌等无价格的股票不包含在内
+        """
+        df = ak.stock_zh_a_spot_em()
+        prices = pd.to_numeric(df['最新价'], errors='coerce')
+        valid = prices.notna()
+        return dict(zip(df.loc[valid, '代码'].astype(str), prices[valid].astype(float)))
+
     def get_concept_board_components(self, symbol: str = '车联网') -> dict:
         """
         获取指定概念板块的成分股。参数symbol: str = '车联网' 返回值 dict[symbol,str]
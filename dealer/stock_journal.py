@@ -0,0 +1,168 @@
+import copy
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Optional
+
+# 日志中的事件类型
+PORTFOLIO = 'portfolio'                # 整个投资组合
+PORTFOLIO_STOCK = 'portfolio_stock'    # 单只股票的交易计划 {'symbol', 'info'}
+PORTFOLIO_REMOVE = 'portfolio_remove'  # 从投资组合移除的股票代码
+POSITIONS = 'positions'                # 全部持仓
+CASH = 'cash'                          # 可用资金
+META = 'meta'                          # last_trade_date / last_msg
+
+# 修改同一部分状态的事件类型：写入其中一种后，其他类型的"上一条内容"不再代表当前状态
+_RELATED_KINDS = {
+    PORTFOLIO: (PORTFOLIO_STOCK, PORTFOLIO_REMOVE),
+    PORTFOLIO_STOCK: (PORTFOLIO, PORTFOLIO_REMOVE),
+    PORTFOLIO_REMOVE: (PORTFOLIO, PORTFOLIO_STOCK),
+}
+
+
+def empty_state() -> Dict[str, Any]:
+    return {"portfolio": {}, "positions": [], "cash": None, "last_trade_date": None, "last_msg": ""}
+
+
+def apply_event(state: Dict[str, Any], kind: str, payload: Any):
+    """把一条日志事件应用到状态字典上，回放和写入共用这一逻辑"""
+    if kind == PORTFOLIO:
+        state["portfolio"] = payload
+    elif kind == PORTFOLIO_STOCK:
+        state["portfolio"][payload["symbol"]] = payload["info"]
+    elif kind == PORTFOLIO_REMOVE:
+        state["portfolio"].pop(payload, None)
+    elif kind == POSITIONS:
+        state["positions"] = payload
+    elif kind == CASH:
+        state["cash"] = payload
+    elif kind == META:
+        state.update(payload)
+    else:
+        raise ValueError(f"Unknown journal event: {kind}")
+
+
+class StockStateJournal:
+    """
+    LLMStockDealer 状态的追加式日志，存储在 SQLite（WAL 模式）中。
+
+    每次状态变化只追加一条事件（单个事务，崩溃时要么完整写入要么没有），
+    与上一条同类事件内容相同、且期间没有修改同一部分状态的其他事件时直接跳过，
+    因此频繁的账户同步几乎没有写入开销。
+    事件数达到 compact_every 时把当前状态写成快照并删除旧事件；
+    启动时读取快照再回放其后的事件。
+    """
+
+    def __init__(self, path: str = "./output/stock_dealer_state.db", compact_every: int = 500,
+                 logger: Optional[logging.Logger] = None):
+        self.path = path
+        self.compact_every = compact_every
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS snapshot (id INTEGER PRIMARY KEY CHECK (id = 1), seq INTEGER NOT NULL, data TEXT NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS journal (seq INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, payload TEXT NOT NULL)")
+
+        self.state = empty_state()
+        self._last_payload: Dict[str, str] = {}
+        self._pending_events = 0
+        self._empty = True
+        self._replay()
+
+    def _replay(self):
+        row = self._conn.execute("SELECT seq, data FROM snapshot WHERE id = 1").fetchone()
+        snapshot_seq = 0
+        if row is not None:
+            snapshot_seq = row[0]
+            self.state.update(json.loads(row[1]))
+            self._empty = False
+
+        events = self._conn.execute("SELECT kind, payload FROM journal WHERE seq > ? ORDER BY seq", (snapshot_seq,)).fetchall()
+        for kind, payload in events:
+            apply_event(self.state, kind, json.loads(payload))
+            self._remember(kind, payload)
+        self._pending_events = len(events)
+        if events:
+            self._empty = False
+        self.logger.info(f"Loaded stock dealer state from {self.path}: snapshot seq {snapshot_seq}, {len(events)} journal events replayed")
+
+    @property
+    def is_empty(self) -> bool:
+        """没有任何快照或事件，即新建的日志"""
+        return self._empty
+
+    def load(self) -> Dict[str, Any]:
+        """返回当前状态的副本"""
+        with self._lock:
+            return copy.deepcopy(self.state)
+
+    def append(self, kind: str, payload: Any) -> bool:
+        """追加一条事件，内容与上一条同类事件相同时不写入，返回是否写入"""
+        encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+        with self._lock:
+            if self._last_payload.get(kind) == encoded:
+                return False
+            with self._conn:
+                self._conn.execute("INSERT INTO journal (kind, payload) VALUES (?, ?)", (kind, encoded))
+            apply_event(self.state, kind, json.loads(encoded))
+            self._remember(kind, encoded)
+            self._pending_events += 1
+            self._empty = False
+            if self._pending_events >= self.compact_every:
+                self._write_snapshot()
+        return True
+
+    def _remember(self, kind: str, encoded: str):
+        self._last_payload[kind] = encoded
+        for related in _RELATED_KINDS.get(kind, ()):
+            self._last_payload.pop(related, None)
+
+    def compact(self):
+        """把当前状态写成快照并删除已包含在快照中的事件"""
+        with self._lock:
+            self._write_snapshot()
+
+    def reset(self, state: Dict[str, Any]):
+        """用给定状态替换全部内容，用于从旧的 JSON 文件迁移"""
+        with self._lock:
+            self.state = empty_state()
+            self.state.update(copy.deepcopy(state))
+            self._last_payload.clear()
+            self._write_snapshot()
+
+    def _write_snapshot(self):
+        data = json.dumps(self.state, ensure_ascii=False)
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            seq = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM journal").fetchone()[0]
+            self._conn.execute("INSERT OR REPLACE INTO snapshot (id, seq, data) VALUES (1, ?, ?)", (seq, data))
+            self._conn.execute("DELETE FROM journal WHERE seq <= ?", (seq,))
+        self._pending_events = 0
+        self._empty = False
+        self.logger.debug(f"Compacted stock dealer journal at seq {seq}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def migrate_json_file(journal: StockStateJournal, json_path: str) -> bool:
+    """日志为空且存在旧的 JSON 数据文件时导入其内容，返回是否导入"""
+    if not journal.is_empty or not os.path.exists(json_path):
+        return False
+    with open(json_path, 'r') as f:
+        data = json.load(f)
+    journal.reset({
+        "portfolio": data.get("portfolio", {}),
+        "positions": data.get("positions", []),
+        "last_trade_date": data.get("last_trade_date"),
+        "last_msg": data.get("last_msg", ""),
+    })
+    journal.logger.info(f"Migrated stock dealer data from {json_path} to {journal.path}")
+    return True
@@ -1,28 +1,83 @@
 import json
 from core.utils.code_tools import code_tools
+from core.utils.memo_proxy import QueryMemo
 from core.interpreter.ast_code_runner import ASTCodeRunner
 import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Optional, Set, Tuple
 from .plan_template_manager import PlanTemplateManager
+from .query_cache import QueryCache, provider_signature
 from .logger import logger
 
+CACHE_KIND = "stock_query"
+# 由 StockQuery 自己放入 code_tools 的变量，步骤把它们列为输入时不构成依赖
+BUILTIN_VARS = {'stock_data_provider', 'llm_client'}
+
 
 class StockQuery:
-    def __init__(self, llm_client, stock_data_provider):
+    def __init__(self, llm_client, stock_data_provider, query_cache: Optional[QueryCache] = None, use_cache: bool = True,
+                 max_parallel_steps: int = 4, code_runner=None):
+        """
+        :param query_cache: 计划和代码缓存，默认使用 ./output/query_cache.db
+        :param use_cache: 为 False 时每次都重新生成计划和代码
+        :param code_runner: 生成代码的执行器，例如在子进程中执行的 SandboxCodeRunner，默认在本进程中执行
+        :param max_parallel_steps: 同时执行的互不依赖的步骤数，1 表示按顺序执行
+        """
+        self.max_parallel_steps = max(1, max_parallel_steps)
         self.llm_client = llm_client
         self.stock_data_provider = stock_data_provider
-        self.code_runner = ASTCodeRunner()
+        self.code_runner = code_runner or ASTCodeRunner()
         self.template_manager = PlanTemplateManager(llm_client)
         self.template_manager.load_templates_from_file("./json/stock_flows.md")
+        self.query_cache = (query_cache or QueryCache()) if use_cache else None
+        self._provider_signature = None
         code_tools.add_var('stock_data_provider', self.stock_data_provider)
         code_tools.add_var('llm_client', self.llm_client) 
 
+    @property
+    def provider_signature(self) -> str:
+        if self._provider_signature is None:
+            self._provider_signature = provider_signature(self.stock_data_provider)
+        return self._provider_signature
+
     def query(self, query: str) -> str:
+        # 同一次查询内的代码修复重试共享已经成功的数据接口和 LLM 调用结果，修复只为改动的代码付出代价
+        with QueryMemo(self.stock_data_provider, self.llm_client):
+            return self._query(query)
+
+    def _query(self, query: str) -> str:
         logger.info(f"开始处理查询: {query}")
+        if self.query_cache is not None:
+            cached = self.query_cache.get(CACHE_KIND, query, self.provider_signature)
+            if cached is not None:
+                result = self._run_cached(cached['code'], query)
+                if result is not None:
+                    logger.info("查询处理完成（使用缓存的计划和代码）")
+                    return result
+                logger.warning("缓存的代码执行失败，重新生成计划和代码")
+                self.query_cache.invalidate(CACHE_KIND, query, self.provider_signature)
         plan = self._generate_plan(query)
         result = self._execute_plan(plan, query)
         logger.info("查询处理完成")
         return result
 
+    def _run_cached(self, step_codes: list, query: str) -> Optional[str]:
+        """直接执行缓存的各步骤代码，任何一步出错返回 None"""
+        logger.info(f"命中查询缓存，直接执行 {len(step_codes)} 个步骤的代码")
+        if 'output_result' in code_tools:
+            code_tools.del_var('output_result')
+        for i, code in enumerate(step_codes, 1):
+            try:
+                result = self.code_runner.run(code)
+            except Exception as e:
+                result = {'error': str(e)}
+            if result['error']:
+                logger.warning(f"缓存的步骤 {i}/{len(step_codes)} 执行出错: {result['error']}")
+                return None
+        if 'output_result' not in code_tools:
+            return None
+        return self._format_result(query)
+
     def _generate_plan(self, query: str) -> list:
         logger.info("正在生成执行计划...")
         provider_description = self.stock_data_provider.get_self_description()
@@ -95,14 +150,84 @@ class StockQuery:
         matches = re.findall(code_pattern, response, re.DOTALL)
         return matches[0] if matches else response
 
+    @staticmethod
+    def _var_names(variables) -> List[str]:
+        return [v['name'] if isinstance(v, dict) else str(v) for v in (variables or [])]
+
+    def _build_dependencies(self, plan: list) -> Tuple[List[Set[int]], List[Set[int]]]:
+        """
+        根据各步骤声明的 input_vars / output_vars 建立依赖图。
+
+        :return: (after, needs)。after[i] 为步骤 i 开始前必须结束的步骤，
+                 needs[i] 为步骤 i 的输入变量的生产步骤，其中任何一个失败时步骤 i 被跳过
+        """
+        producers = {}
+        after, needs = [], []
+        for i, step in enumerate(plan):
+            step_after, step_needs = set(), set()
+            for name in self._var_names(step.get('input_vars')):
+                if name in producers:
+                    step_needs.add(producers[name])
+                elif name not in BUILTIN_VARS:
+                    # 没有前面的步骤声明产生这个变量：计划的声明不完整，保守地等前面的步骤都结束
+                    step_after.update(range(i))
+            step_after |= step_needs
+            for name in self._var_names(step.get('output_vars')):
+                producers[name] = i
+            after.append(step_after)
+            needs.append(step_needs)
+        # 最后一步产生 output_result，在其他步骤都结束之后执行
+        if plan:
+            after[-1] = set(range(len(plan) - 1))
+        return after, needs
+
+    def _run_step(self, step: dict, query: str, step_number: int, total_steps: int) -> Optional[str]:
+        logger.info(f"执行步骤 {step_number}/{total_steps}: {step['description']}")
+        step_code, prompt = self._generate_step_code(step, query, step_number, total_steps)
+        return self._execute_code(step_code, prompt)
+
     def _execute_plan(self, plan: list, query: str) -> str:
-        for i, step in enumerate(plan, 1):
-            logger.info(f"执行步骤 {i}/{len(plan)}: {step['description']}")
-            step_code, prompt = self._generate_step_code(step, query, i, len(plan))
-            self._execute_code(step_code, prompt)
+        """
+        按依赖图执行计划：互不依赖的步骤（例如获取不同来源的数据）在线程池中同时生成代码和执行，
+        步骤失败时只跳过依赖它的输出的步骤。
+        """
+        if 'output_result' in code_tools:
+            code_tools.del_var('output_result')
+        after, needs = self._build_dependencies(plan)
+        total = len(plan)
+        final_codes: List[Optional[str]] = [None] * total
+        succeeded = {}
+        pending = set(range(total))
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_parallel_steps, thread_name_prefix="stock-query") as executor:
+            while pending or running:
+                # 依赖只指向更早的步骤，按序号顺序检查一遍即可把跳过传递下去
+                for i in sorted(pending):
+                    if any(d in succeeded and not succeeded[d] for d in needs[i]):
+                        logger.warning(f"步骤 {i + 1}/{total} 依赖的步骤执行失败，跳过: {plan[i]['description']}")
+                        succeeded[i] = False
+                        pending.discard(i)
+                    elif all(d in succeeded for d in after[i]):
+                        running[executor.submit(self._run_step, plan[i], query, i + 1, total)] = i
+                        pending.discard(i)
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = running.pop(future)
+                    try:
+                        final_codes[i] = future.result()
+                    except Exception as e:
+                        logger.error(f"步骤 {i + 1}/{total} 执行异常: {str(e)}", exc_info=True)
+                    succeeded[i] = final_codes[i] is not None
 
         logger.info("所有步骤执行完成")
-        
+
+        if self.query_cache is not None and 'output_result' in code_tools and all(final_codes):
+            self.query_cache.put(CACHE_KIND, query, self.provider_signature, plan, final_codes)
+        return self._format_result(query)
+
+    def _format_result(self, query: str) -> str:
         if 'output_result' in code_tools:
             result = code_tools['output_result']
             logger.info(f"原始查询结果: {result}")
@@ -189,12 +314,14 @@ class StockQuery:
         logger.info("步骤代码生成完成")
         return self._extract_code(code), prompt
 
-    def _execute_code(self, code: str, prompt: str, max_attempts: int = 8) -> None:
+    def _execute_code(self, code: str, prompt: str, max_attempts: int = 8) -> Optional[str]:
+        """执行代码，出错时让 LLM 修复后重试；返回最终执行成功的代码，失败返回 None"""
         logger.info("正在执行代码...")
         attempt = 1
         while attempt <= max_attempts:
             try:
-                result = self.code_runner.run(code)
+                # 多个步骤可能同时执行，不替换全局的 sys.stdout
+                result = self.code_runner.run(code, redirect_std=False)
                 if result['error']:
                     if attempt < max_attempts:
                         logger.warning(f"代码执行出错（尝试 {attempt}/{max_attempts}），正在修复...")
@@ -205,7 +332,7 @@ class StockQuery:
                         return
                 else:
                     logger.info(f"代码执行成功（尝试 {attempt}/{max_attempts}）")
-                    return
+                    return code
             except Exception as e:
                 if attempt < max_attempts:
                     logger.warning(f"执行代码时发生异常（尝试 {attempt}/{max_attempts}）: {str(e)}，正在尝试修复...")
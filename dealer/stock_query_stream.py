@@ -1,29 +1,78 @@
 import json
-from typing import Dict, Any, Generator
+from typing import Dict, Any, Generator, Optional
 from core.utils.code_tools import code_tools
+from core.utils.memo_proxy import QueryMemo
 from core.interpreter.step_code_runner import StepCodeRunner
 import re
 from .plan_template_manager import PlanTemplateManager
+from .query_cache import QueryCache, provider_signature
 from .logger import logger
 
+CACHE_KIND = "stock_query_stream"
+
 class StockQueryStream:
-    def __init__(self, llm_client, stock_data_provider):
+    def __init__(self, llm_client, stock_data_provider, query_cache: Optional[QueryCache] = None, use_cache: bool = True, code_runner=None):
+        """
+        :param query_cache: 计划和代码缓存，默认使用 ./output/query_cache.db
+        :param use_cache: 为 False 时每次都重新生成计划和代码
+        :param code_runner: 生成代码的执行器，例如在子进程中执行的 SandboxCodeRunner，默认在本进程中执行
+        """
         self.llm_client = llm_client
         self.stock_data_provider = stock_data_provider
-        self.code_runner = StepCodeRunner()
+        self.code_runner = code_runner or StepCodeRunner()
         self.template_manager = PlanTemplateManager(llm_client)
         self.template_manager.load_templates_from_file("./json/stock_flows.md")
+        self.query_cache = (query_cache or QueryCache()) if use_cache else None
+        self._provider_signature = None
         code_tools.add_var('stock_data_provider', self.stock_data_provider)
         code_tools.add_var('llm_client', self.llm_client) 
 
+    @property
+    def provider_signature(self) -> str:
+        if self._provider_signature is None:
+            self._provider_signature = provider_signature(self.stock_data_provider)
+        return self._provider_signature
+
     def query(self, query: str) -> Generator[Dict[str, Any], None, None]:
+        # 同一次查询内的代码修复重试共享已经成功的数据接口和 LLM 调用结果，修复只为改动的代码付出代价
+        with QueryMemo(self.stock_data_provider, self.llm_client):
+            yield from self._query(query)
+
+    def _query(self, query: str) -> Generator[Dict[str, Any], None, None]:
         logger.info(f"开始处理查询: {query}")
+        if self.query_cache is not None:
+            cached = self.query_cache.get(CACHE_KIND, query, self.provider_signature)
+            if cached is not None:
+                succeeded = yield from self._run_cached(cached['code'])
+                if succeeded:
+                    logger.info("查询处理完成（使用缓存的计划和代码）")
+                    return
+                self.query_cache.invalidate(CACHE_KIND, query, self.provider_signature)
+                yield {"type": "message", "content": "缓存的代码执行失败，重新生成执行计划..."}
         yield {"type": "message", "content": "开始生成执行计划..."}
         plan = yield from self._generate_plan(query)
         yield {"type": "message", "content": "执行计划生成完成，开始执行..."}
         yield from self._execute_plan(plan, query)
         logger.info("查询处理完成")
 
+    def _run_cached(self, code: str) -> Generator[Dict[str, Any], None, bool]:
+        """直接执行缓存的代码，跳过计划生成、代码生成和代码优化；执行失败返回 False"""
+        logger.info("命中查询缓存，直接执行缓存的代码")
+        yield {"type": "message", "content": "命中查询缓存，直接执行..."}
+        yield {"type": "code", "content": code}
+        if 'output_result' in code_tools:
+            code_tools.del_var('output_result')
+        try:
+            result = self.code_runner.run(code)
+        except Exception as e:
+            result = {'error': str(e)}
+        if result['error'] or 'output_result' not in code_tools:
+            logger.warning(f"缓存的代码执行失败: {result['error']}")
+            return False
+        yield {"type": "message", "content": "代码执行成功，正在生成结果..."}
+        yield from self._format_result(code_tools['output_result'])
+        return True
+
     def _generate_plan(self, query: str) -> Generator[Dict[str, Any], None, None]:
         logger.info("正在生成执行计划...")
         provider_description = self.stock_data_provider.get_self_description()
@@ -183,7 +232,11 @@ class StockQueryStream:
             else:
                 yield chunk
 
-        yield from self._execute_code(code, prompt)
+        if 'output_result' in code_tools:
+            code_tools.del_var('output_result')
+        final_code = yield from self._execute_code(code, prompt)
+        if final_code is not None and self.query_cache is not None:
+            self.query_cache.put(CACHE_KIND, query, self.provider_signature, plan, final_code)
 
     def _generate_step_code(self, step: dict, query: str) -> Generator[Dict[str, Any], None, None]:
         logger.info("正在生成步骤代码...")
@@ -234,7 +287,8 @@ class StockQueryStream:
         yield {"type": "code", "content": extracted_code}
         yield {"type": "message", "content": "data: [Done]", "code": extracted_code, "prompt": prompt}
 
-    def _execute_code(self, code: str, prompt: str, max_attempts: int = 8) -> Generator[Dict[str, Any], None, None]:
+    def _execute_code(self, code: str, prompt: str, max_attempts: int = 8) -> Generator[Dict[str, Any], None, Optional[str]]:
+        """执行代码，出错时修复后重试；生成器的返回值为最终执行成功的代码，失败为 None"""
         logger.info("正在执行代码...")
         attempt = 1
         while attempt <= max_attempts:
@@ -264,7 +318,8 @@ class StockQueryStream:
                         yield from self._format_result(result)
                     else:
                         yield {"type": "message", "content": "未能获取查询结果"}
-                    return
+                        return None
+                    return code
             except Exception as e:
                 if attempt < max_attempts:
                     logger.warning(f"执行代码时发生异常（尝试 {attempt}/{max_attempts}）: {str(e)}，正在尝试修复...")
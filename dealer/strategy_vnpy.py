@@ -9,7 +9,9 @@ from vnpy.app.cta_strategy import (
     ArrayManager,
 )
 from dealer.llm_dealer import LLMDealer
+from dealer.decision_worker import DecisionWorker
 from dealer.futures_provider import MainContractProvider
+from dealer.time_normalizer import to_epoch_ns
 from datetime import datetime, timedelta
 import pandas as pd
 
@@ -48,6 +50,9 @@ class LLMDealerStrategy(CtaTemplate):
             max_position=self.max_position
         )
 
+        # on_bar 只投递最新 bar，LLM 决策在工作线程中完成
+        self.decision_worker = DecisionWorker(self._decide_bar, self._on_decision, name=f"vnpy-{strategy_name}")
+
     def on_init(self):
         """
         Callback when strategy is inited.
@@ -60,12 +65,15 @@ class LLMDealerStrategy(CtaTemplate):
         Callback when strategy is started.
         """
         self.write_log("策略启动")
+        self.decision_worker.start()
 
     def on_stop(self):
         """
         Callback when strategy is stopped.
         """
         self.write_log("策略停止")
+        self.decision_worker.stop(timeout=5)
+        self.write_log(f"决策队列统计: {self.decision_worker.format_metrics()}")
 
     def on_tick(self, tick: TickData):
         """
@@ -83,6 +91,7 @@ class LLMDealerStrategy(CtaTemplate):
 
         # 将 vnpy 的 BarData 转换为 LLMDealer 期望的格式
         llm_bar = {
+            'ts': to_epoch_ns(bar.datetime),
             'datetime': bar.datetime,
             'open': bar.open_price,
             'high': bar.high_price,
@@ -92,11 +101,22 @@ class LLMDealerStrategy(CtaTemplate):
             'hold': bar.open_interest
         }
 
-        # 获取新闻数据（这里需要实现获取新闻的逻辑）
+        self.decision_worker.submit(self.symbol, (pd.Series(llm_bar), bar))
+
+    def _decide_bar(self, symbol, item):
+        """
+        在决策线程中使用 LLMDealer 处理 bar 数据
+        """
+        llm_bar, _ = item
         news = self.get_news()
+        return self.llm_dealer.process_bar(llm_bar, news)
 
-        # 使用 LLMDealer 处理 bar 数据
-        trade_instruction, quantity, next_msg = self.llm_dealer.process_bar(pd.Series(llm_bar), news)
+    def _on_decision(self, symbol, item, result):
+        """
+        决策返回后执行交易指令
+        """
+        _, bar = item
+        trade_instruction, quantity, next_msg = result[0], result[1], result[2]
 
         # 执行交易指令
         self.execute_trade(trade_instruction, quantity, bar)
@@ -0,0 +1,146 @@
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+TIMEZONE = 'Asia/Shanghai'
+NS_PER_US = 1000
+NS_PER_MS = 1000000
+NS_PER_SECOND = 1000000000
+NS_PER_MINUTE = 60 * NS_PER_SECOND
+NS_PER_DAY = 1440 * NS_PER_MINUTE
+# 北京时间没有夏令时，固定 UTC+8，分钟/日期可以直接由 epoch 整数算出
+BEIJING_OFFSET_NS = 8 * 3600 * NS_PER_SECOND
+
+_BEIJING = timezone(timedelta(hours=8))
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_DATE = date(1970, 1, 1)
+
+
+def _unit_scale(value: float) -> int:
+    """数值时间戳按量级判断单位：xtquant 为毫秒，也兼容秒、微秒和纳秒"""
+    if value > 1e17:
+        return 1
+    if value > 1e14:
+        return NS_PER_US
+    if value > 1e11:
+        return NS_PER_MS
+    return NS_PER_SECOND
+
+
+def _numeric_to_ns(value) -> int:
+    scale = _unit_scale(value)
+    return int(value * scale) if scale == NS_PER_SECOND else int(value) * scale
+
+
+def to_epoch_ns(value) -> int:
+    """
+    把单个时间转换为 UTC epoch 纳秒。
+
+    支持 xtquant 的毫秒时间戳、vnpy 的 datetime、akshare 的时间字符串以及 pd.Timestamp；
+    不带时区的时间按北京时间处理。
+    """
+    if isinstance(value, (int, np.integer)) and not isinstance(value, bool):
+        return _numeric_to_ns(int(value))
+    if isinstance(value, (float, np.floating)):
+        return _numeric_to_ns(float(value))
+    if isinstance(value, pd.Timestamp):
+        if value.tzinfo is None:
+            return value.value - BEIJING_OFFSET_NS
+        return value.value
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=_BEIJING)
+        delta = value - datetime(1970, 1, 1, tzinfo=timezone.utc)
+        return (delta.days * 86400 + delta.seconds) * NS_PER_SECOND + delta.microseconds * NS_PER_US
+    if isinstance(value, np.datetime64):
+        return int(value.astype('datetime64[ns]').astype(np.int64)) - BEIJING_OFFSET_NS
+    if isinstance(value, str):
+        text = value.strip()
+        if text.isdigit():
+            return _numeric_to_ns(int(text))
+        try:
+            # 常见的 'YYYY-MM-DD HH:MM:SS' 走标准库的快速路径
+            return to_epoch_ns(datetime.fromisoformat(text))
+        except ValueError:
+            return to_epoch_ns(pd.Timestamp(text))
+    raise ValueError(f"Unexpected timestamp type: {type(value)}")
+
+
+def from_epoch_ns(ns: int) -> pd.Timestamp:
+    """epoch 纳秒 -> 带北京时区的 pd.Timestamp"""
+    return pd.Timestamp(ns, unit='ns', tz='UTC').tz_convert(TIMEZONE)
+
+
+def local_datetime(ns: int) -> datetime:
+    """epoch 纳秒 -> 不带时区的北京时间 datetime，只做整数运算"""
+    return _EPOCH + timedelta(microseconds=(ns + BEIJING_OFFSET_NS) // NS_PER_US)
+
+
+def local_date(ns: int) -> date:
+    return _EPOCH_DATE + timedelta(days=(ns + BEIJING_OFFSET_NS) // NS_PER_DAY)
+
+
+def minute_of_day(ns):
+    """北京时间的分钟序号（0-1439），标量和 numpy 数组都适用"""
+    return (ns + BEIJING_OFFSET_NS) % NS_PER_DAY // NS_PER_MINUTE
+
+
+def to_epoch_ns_array(values) -> np.ndarray:
+    """
+    一列时间转换为 int64 epoch 纳秒数组，整列只转换一次。
+    数值列按量级判断单位，不带时区的时间按北京时间处理。
+    """
+    series = values if isinstance(values, pd.Series) else pd.Series(values)
+    if series.empty:
+        return np.empty(0, dtype=np.int64)
+    if pd.api.types.is_numeric_dtype(series):
+        # 同一列的单位相同，按第一个值判断
+        values = series.to_numpy()
+        scale = _unit_scale(float(values[0]))
+        if pd.api.types.is_integer_dtype(series) or scale != NS_PER_SECOND:
+            return values.astype(np.int64) * scale
+        return (values * scale).astype(np.int64)
+    if not pd.api.types.is_datetime64_any_dtype(series):
+        series = pd.to_datetime(series, utc=False)
+    if series.dt.tz is None:
+        return series.to_numpy(dtype='datetime64[ns]').astype(np.int64) - BEIJING_OFFSET_NS
+    return series.dt.tz_convert('UTC').dt.tz_localize(None).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+
+
+def datetimes_from_ns(ns: np.ndarray) -> pd.DatetimeIndex:
+    return pd.to_datetime(np.asarray(ns, dtype=np.int64), unit='ns', utc=True).tz_convert(TIMEZONE)
+
+
+def normalize_bar(bar, time_key: Optional[str] = None):
+    """
+    在 bar（pd.Series 或 dict）上写入 ts（int64 epoch 纳秒）和对应的北京时间 datetime。
+    已经有 ts 的 bar 直接返回，下游代码只读取这两个字段。
+    """
+    if 'ts' in bar and bar['ts'] is not None:
+        return bar
+    if time_key is None:
+        time_key = 'time' if 'time' in bar else 'datetime'
+    ts = to_epoch_ns(bar[time_key])
+    bar['ts'] = ts
+    bar['datetime'] = from_epoch_ns(ts)
+    return bar
+
+
+def normalize_frame(df: pd.DataFrame, time_key: str = 'datetime') -> pd.DataFrame:
+    """返回加上 ts 列、datetime 列统一为带北京时区时间的新 DataFrame"""
+    if df is None or df.empty:
+        return df
+    ts = df['ts'].to_numpy(dtype=np.int64) if 'ts' in df.columns else to_epoch_ns_array(df[time_key])
+    return df.assign(ts=ts, datetime=datetimes_from_ns(ts))
+
+
+# 使用示例
+if __name__ == "__main__":
+    for value in (1718000000000, "2024-06-10 14:13:20", datetime(2024, 6, 10, 14, 13, 20),
+                  pd.Timestamp("2024-06-10 06:13:20", tz='UTC')):
+        ns = to_epoch_ns(value)
+        print(repr(value), ns, from_epoch_ns(ns), local_datetime(ns), minute_of_day(ns))
+    frame = normalize_frame(pd.DataFrame({'datetime': ["2024-06-10 21:01:00", "2024-06-10 21:02:00"]}))
+    print(frame, frame.dtypes, sep="\n")
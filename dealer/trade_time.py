@@ -1,3 +1,7 @@
+from datetime import date, timedelta
+
+import numpy as np
+
 # 创建交易时间字典
 trading_hours = {
     'CU': ['15:00', '01:00'],
@@ -107,4 +111,29 @@ def get_trading_end_time(code, session):
     else:
       return "无效的交易时段。请选择 'day' 或 'night'"
   else:
-    return "合约代码不存在"
\ No newline at end of file
+    return "合约代码不存在"
+
+# 夜盘（21:00 之后直到次日凌晨）属于下一个交易日，时间平移 3 小时后取日期即可区分
+NIGHT_SESSION_SHIFT = np.timedelta64(3, 'h')
+
+
+def infer_trading_dates(datetimes) -> np.ndarray:
+  """
+  根据 bar 时间推断所属交易日（向量化）。
+
+  夜盘 bar 平移 3 小时后落在下一个自然日，再顺延到工作日，
+  因此周五夜盘和周六凌晨的 bar 都归属下周一。节假日不在考虑范围内。
+
+  :param datetimes: 北京时间（不带时区）的 datetime64 数组
+  :return: datetime64[D] 数组
+  """
+  days = (np.asarray(datetimes, dtype='datetime64[ns]') + NIGHT_SESSION_SHIFT).astype('datetime64[D]')
+  return np.busday_offset(days, 0, roll='forward')
+
+
+def trading_date_of(dt) -> date:
+  """单个 bar 时间（北京时间）所属的交易日，规则与 infer_trading_dates 相同"""
+  day = (dt + timedelta(hours=3)).date()
+  while day.weekday() >= 5:
+    day += timedelta(days=1)
+  return day
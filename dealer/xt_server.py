@@ -4,6 +4,22 @@ xt_key = get_key('xt_key')
 if not xt_key:
     exit(1)
 
+def start_market_bus(symbols, periods=('1m',)):
+    """
+    把 symbols 的行情发布到共享内存行情总线，同一台机器上的多个策略进程通过 MarketBusReader 读取，
+    不再各自订阅和解码 xtdata 行情。period 为 'tick' 时发布 tick，其他周期发布 bar。
+    """
+    from xtquant import xtdata
+    from dealer.market_bus import MarketBusPublisher
+    publisher = MarketBusPublisher(port=int(get_key('market_bus_port', default='58620'))).start()
+    for period in periods:
+        # 每个周期写入各自的缓冲区，读取端用 MarketBusReader(period=...) 选择周期
+        callback = publisher.xt_callback(period)
+        for symbol in symbols:
+            xtdata.subscribe_quote(symbol, period=period, callback=callback)
+    print(f'market bus publishing {len(symbols)} symbols, periods: {",".join(periods)}')
+    return publisher
+
 def start_xtserver():
     xtdc.set_token(xt_key)
     xtdc.init() # 初始化行情模块，加载合约数据，会需要大约十几秒的时间
@@ -13,5 +29,10 @@ def start_xtserver():
     listen_addr = xtdc.listen(port = 58610)
     print(f'done, listen_addr:{listen_addr}')
     from xtquant import xtdata
+    # 可选：setting.ini 中配置 market_bus_symbols（逗号分隔）时，同时发布到共享内存行情总线
+    bus_symbols = [s.strip() for s in (get_key('market_bus_symbols', default='') or '').split(',') if s.strip()]
+    if bus_symbols:
+        periods = [p.strip() for p in get_key('market_bus_periods', default='1m').split(',') if p.strip()]
+        start_market_bus(bus_symbols, periods)
     print('running')
-    xtdata.run() #循环，维持程序运行
\ No newline at end of file
+    xtdata.run() #循环，维持程序运行
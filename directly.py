@@ -103,6 +103,8 @@ def test_sse():
             print(f"Output: {event['content']}")
         elif event['type'] == 'error':
             print(f"Error: {event['content']}")
+        elif event['type'] == 'code_tools':
+            print(f"Variable ready: {event['content']['name']}")
         elif event['type'] == 'result':
             print(f"Final result: {event['content']}")
         elif event['type'] == 'debug':
@@ -1,13 +1,15 @@
 # coding:utf-8
 import time
 import random
-from typing import List, Dict
+from typing import List, Dict, Optional
 from xtquant import xtdata
 from xtquant.xttrader import XtQuantTrader, XtQuantTraderCallback
 from xtquant.xttype import StockAccount
-from xtquant import xtconstant
 from dealer.llm_futures_dealer import LLMFuturesDealer
 from dealer.futures_provider import MainContractProvider
+from dealer.decision_worker import DecisionWorker
+from dealer.order_gateway import OrderGateway, XtQuantBackend, make_client_order_id
+from dealer.time_normalizer import NS_PER_MS, from_epoch_ns
 import pandas as pd
 from datetime import datetime, timedelta
 import logging
@@ -21,7 +23,8 @@ logger = logging.getLogger(__name__)
 beijing_tz = pytz.timezone('Asia/Shanghai')
 
 class LLMMultiFuturesStrategy(XtQuantTraderCallback):
-    def __init__(self, path, session_id, account_id, futures_symbols, llm_client, trade_rules="", start_time=None, use_market_order=False, price_tolerance=0.2):
+    def __init__(self, path, session_id, account_id, futures_symbols, llm_client, trade_rules="", start_time=None, use_market_order=False, price_tolerance=0.2,
+                 decision_workers: int = 1, bar_deadline: Optional[float] = None, stale_order_seconds: float = 30):
         self.path = path
         self.session_id = session_id
         self.account_id = account_id
@@ -33,6 +36,13 @@ class LLMMultiFuturesStrategy(XtQuantTraderCallback):
         self.xt_trader = None
         self.account = None
         self.last_processed_time = None
+        # 各合约最近一次行情的收盘价，用于超时订单重新定价
+        self.last_prices: Dict[str, float] = {}
+
+        # 下单网关在 start() 中随交易连接一起创建
+        self.stale_order_seconds = stale_order_seconds
+        self.order_backend = None
+        self.order_gateway = None
 
         # 使用北京时间
         current_time = datetime.now(beijing_tz)
@@ -46,9 +56,15 @@ class LLMMultiFuturesStrategy(XtQuantTraderCallback):
             self.futures_symbols, 
             self.data_provider, 
             trade_rules,
-            backtest_date=self.start_time.strftime('%Y-%m-%d')
+            backtest_date=self.start_time.strftime('%Y-%m-%d'),
+            max_concurrency=decision_workers,
+            bar_deadline=bar_deadline
         )
 
+        # 每个合约一个 latest-wins 槽位，行情回调不等待 LLM
+        self.decision_worker = DecisionWorker(self._decide_symbol, self._on_decision,
+                                              num_workers=decision_workers, name="qmt-multi-futures", logger=logger)
+
         logger.info(f"Strategy initialized with start time: {self.start_time} for symbols: {self.futures_symbols}")
 
     def start(self):
@@ -58,6 +74,11 @@ class LLMMultiFuturesStrategy(XtQuantTraderCallback):
         # 创建资金账号对象，期货账号为FUTURE
         self.account = StockAccount(self.account_id, 'FUTURE')
         logger.info(f"Created account object for account ID: {self.account_id}")
+
+        # 报单在网关线程中进行，柜台回报由回调转发给网关的订单簿
+        self.order_backend = XtQuantBackend.futures(self.xt_trader, self.account, logger=logger)
+        self.order_gateway = OrderGateway(self.order_backend, stale_after=self.stale_order_seconds,
+                                          reprice=self._reprice_order, logger=logger)
         
         # 注册回调
         self.xt_trader.register_callback(self)
@@ -81,7 +102,9 @@ class LLMMultiFuturesStrategy(XtQuantTraderCallback):
             logger.error("Failed to subscribe to trading callbacks")
             return False
         
-        # 订阅行情数据
+        # 启动下单网关和决策线程后再订阅行情数据
+        self.order_gateway.start()
+        self.decision_worker.start()
         self.subscribe_market_data()
         
         logger.info("LLMMultiFuturesStrategy started successfully")
@@ -102,7 +125,6 @@ class LLMMultiFuturesStrategy(XtQuantTraderCallback):
     def on_bar_data(self, data):
         """处理实时行情数据的回调函数"""
         bars = {}
-        news = {}
         current_time = None
         
         for symbol, symbol_data in data.items():
@@ -110,10 +132,13 @@ class LLMMultiFuturesStrategy(XtQuantTraderCallback):
                 bar_data = symbol_data[0]
                 logger.debug(f"Received raw bar data for {symbol}: {bar_data}")
                 try:
-                    current_time = pd.to_datetime(bar_data['time'], unit='ms', utc=True).tz_convert(beijing_tz)
-                    
+                    # xtquant 的 time 为毫秒时间戳，入口处转换为 epoch 纳秒
+                    ts = int(bar_data['time']) * NS_PER_MS
+                    current_time = from_epoch_ns(ts)
+
                     # 更新当前bar数据
                     new_bar_data = pd.Series({
+                        'ts': ts,
                         'datetime': current_time,
                         'open': bar_data['open'],
                         'high': bar_data['high'],
@@ -125,7 +150,7 @@ class LLMMultiFuturesStrategy(XtQuantTraderCallback):
                     })
                     
                     bars[symbol] = new_bar_data
-                    news[symbol] = self.get_latest_news(symbol)
+                    self.last_prices[symbol] = bar_data['close']
                     
                 except Exception as e:
                     logger.error(f"Error processing bar for {symbol}: {str(e)}")
@@ -136,13 +161,14 @@ class LLMMultiFuturesStrategy(XtQuantTraderCallback):
         if current_time and (self.last_processed_time is None or current_time.minute != self.last_processed_time.minute):
             logger.info(f"Processing new bar data for time: {current_time}")
             if current_time >= self.start_time:
-                self.process_bars(bars, news)
+                for symbol, bar in bars.items():
+                    self.decision_worker.submit(symbol, bar)
             else:
                 logger.info(f"Skipping bar data before start time: {current_time}")
             self.last_processed_time = current_time
 
     def process_bars(self, bars: Dict[str, pd.Series], news: Dict[str, str]):
-        """处理多个合约的bar数据"""
+        """同步处理多个合约的bar数据"""
         if not self.is_trading_time(bars[next(iter(bars))]['datetime']):
             logger.info(f"Not trading time: {bars[next(iter(bars))]['datetime']}")
             return
@@ -153,14 +179,30 @@ class LLMMultiFuturesStrategy(XtQuantTraderCallback):
         results = self.dealer.process_bars(bars, news)
         
         for symbol, result in results.items():
-            trade_instruction, quantity, next_msg, trade_reason, trade_plan = result
+            self._on_decision(symbol, bars[symbol], result)
 
-            logger.info(f"LLM decision for {symbol}: {trade_instruction}, quantity: {quantity}")
-            logger.info(f"Trade reason for {symbol}: {trade_reason}")
-            logger.info(f"Trade plan for {symbol}: {trade_plan}")
+    def _decide_symbol(self, symbol: str, bar: pd.Series):
+        """在决策线程中处理单个合约的最新 bar，非交易时间返回 None"""
+        if not self.is_trading_time(bar['datetime']):
+            logger.info(f"Not trading time for {symbol}: {bar['datetime']}")
+            return None
+        news = self.get_latest_news(symbol)
+        deadline = time.monotonic() + self.dealer.bar_deadline if self.dealer.bar_deadline is not None else None
+        return self.dealer.process_bar(symbol, bar, news, deadline)
 
-            if trade_instruction != 'hold':
-                self.execute_trade(symbol, trade_instruction, quantity, bars[symbol]['close'])
+    def _on_decision(self, symbol: str, bar: pd.Series, result):
+        """决策返回后执行交易"""
+        if result is None:
+            return
+        trade_instruction, quantity, next_msg, trade_reason, trade_plan = result
+
+        logger.info(f"LLM decision for {symbol}: {trade_instruction}, quantity: {quantity}")
+        logger.info(f"Trade reason for {symbol}: {trade_reason}")
+        logger.info(f"Trade plan for {symbol}: {trade_plan}")
+        logger.info(f"Decision pipeline: {self.decision_worker.format_metrics()}")
+
+        if trade_instruction != 'hold':
+            self.execute_trade(symbol, trade_instruction, quantity, bar['close'], bar['datetime'])
 
     def is_trading_time(self, current_time):
         # 实现交易时间判断逻辑
@@ -184,53 +226,71 @@ class LLMMultiFuturesStrategy(XtQuantTraderCallback):
         return False
 
     def get_latest_news(self, symbol):
-        news_df = self.data_provider.get_futures_news(symbol, page_num=0, page_size=1)
-        if news_df is not None and not news_df.empty:
-            return news_df.iloc[0]['summary']
-        return ""
+        """读取 dealer 后台新闻服务缓存的摘要，不在决策路径上请求网络"""
+        if self.dealer.news_service is None:
+            return ""
+        return self.dealer.news_service.get_summary(symbol)[0]
 
-    def execute_trade(self, symbol, instruction, quantity, price):
-        logger.info(f"尝试执行交易: 合约={symbol}, 指令={instruction}, 数量={quantity}, 价格={price}")
+    def _limit_price(self, instruction, price):
+        """限价委托在最新价上加减价格容忍度"""
+        if instruction in ['buy', 'cover']:
+            return price * (1 + self.price_tolerance)
+        return price * (1 - self.price_tolerance)
 
-        try:
-            order_price = price
-            order_type = xtconstant.FIX_PRICE
+    def _reprice_order(self, order):
+        """超时撤单后按合约最新价重新计算委托价"""
+        price = self.last_prices.get(order.symbol)
+        return None if price is None else self._limit_price(order.side, price)
 
-            if self.use_market_order:
-                order_type = xtconstant.MARKET_BEST
-            else:
-                if instruction in ['buy', 'cover']:
-                    order_price = price * (1 + self.price_tolerance)
-                elif instruction in ['sell', 'short']:
-                    order_price = price * (1 - self.price_tolerance)
-
-            if instruction == 'buy':
-                order_id = self.xt_trader.order_stock(self.account, symbol, xtconstant.FUTURE_OPEN_LONG, 
-                                                    quantity, order_type, order_price, 'LLM_strategy', 'LLM_buy')
-            elif instruction == 'sell':
-                order_id = self.xt_trader.order_stock(self.account, symbol, xtconstant.FUTURE_CLOSE_LONG_TODAY, 
-                                                    quantity, order_type, order_price, 'LLM_strategy', 'LLM_sell')
-            elif instruction == 'short':
-                order_id = self.xt_trader.order_stock(self.account, symbol, xtconstant.FUTURE_OPEN_SHORT, 
-                                                    quantity, order_type, order_price, 'LLM_strategy', 'LLM_short')
-            elif instruction == 'cover':
-                order_id = self.xt_trader.order_stock(self.account, symbol, xtconstant.FUTURE_CLOSE_SHORT_TODAY, 
-                                                    quantity, order_type, order_price, 'LLM_strategy', 'LLM_cover')
-            else:
-                logger.warning(f"未知的交易指令: {instruction}")
-                return
+    def execute_trade(self, symbol, instruction, quantity, price, bar_time=None):
+        logger.info(f"尝试执行交易: 合约={symbol}, 指令={instruction}, 数量={quantity}, 价格={price}")
 
-            logger.info(f"已发送订单: ID={order_id}, 合约={symbol}, 指令={instruction}, 数量={quantity}, 价格类型={order_type}, 价格={order_price}")
+        if instruction not in ['buy', 'sell', 'short', 'cover']:
+            logger.warning(f"未知的交易指令: {instruction}")
+            return
+
+        try:
+            order_price = price if self.use_market_order else self._limit_price(instruction, price)
+            # 同一根 bar 的同一决策只报一次单
+            client_order_id = make_client_order_id(symbol, bar_time, instruction) if bar_time is not None else None
+            order = self.order_gateway.submit(symbol, instruction, quantity, order_price,
+                                              market=self.use_market_order, client_order_id=client_order_id)
+            logger.info(f"已提交订单: {order}")
+            logger.info(self.order_gateway.describe(symbol))
 
         except Exception as e:
             logger.error(f"执行交易时发生错误: {str(e)}", exc_info=True)
 
-    # Implement other necessary methods (callbacks, etc.)
+    # XtQuantTraderCallback 回调，委托和成交回报转发给下单网关
+    def on_disconnected(self):
+        logger.warning('连接断开回调')
+
+    def on_stock_order(self, order):
+        logger.info(f'委托回调 {order.stock_code} 投资备注 {order.order_remark} 状态 {order.order_status}')
+        self.order_backend.on_stock_order(order)
+
+    def on_stock_trade(self, trade):
+        logger.info(f'成交回调 {trade.stock_code} {trade.order_remark} 成交价格 {trade.traded_price} 成交数量 {trade.traded_volume}')
+        self.order_backend.on_stock_trade(trade)
+
+    def on_order_error(self, order_error):
+        logger.error(f"委托报错回调 {order_error.order_remark} {order_error.error_msg}")
+        self.order_backend.on_order_error(order_error)
+
+    def on_cancel_error(self, cancel_error):
+        logger.error(f"撤单错误 {cancel_error}")
+        self.order_backend.on_cancel_error(cancel_error)
 
     def run_strategy(self):
         """运行策略"""
         logger.info("Strategy is now running. Waiting for market data...")
-        self.xt_trader.run_forever()
+        try:
+            self.xt_trader.run_forever()
+        finally:
+            self.decision_worker.stop(timeout=5)
+            self.order_gateway.stop()
+            self.dealer.shutdown()
+            logger.info(self.dealer.get_latency_report())
 
 if __name__ == "__main__":
     from core.config import get_key
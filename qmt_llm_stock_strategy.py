@@ -5,14 +5,15 @@ from typing import List
 from xtquant import xtdata
 from xtquant.xttrader import XtQuantTrader, XtQuantTraderCallback
 from xtquant.xttype import StockAccount
-from xtquant import xtconstant
 from dealer.llm_stock_dealer import LLMStockDealer,StockDataProvider
-import pandas as pd
+from dealer.news_service import NewsService
+from dealer.bar_buffer import BarBuffer
+from dealer.order_gateway import OrderGateway, XtQuantBackend, make_client_order_id
+from dealer.time_normalizer import from_epoch_ns, to_epoch_ns
 from datetime import datetime, timedelta
 import re
 import logging
 import pytz
-from dateutil import parser
 
 
 # 设置日志
@@ -61,7 +62,8 @@ class XtCodeTrans:
 
 
 class LLMQMTStockStrategy(XtQuantTraderCallback):
-    def __init__(self, path, session_id, account_id, portfolios, llm_client, trade_rules="", use_market_order=False, price_tolerance=0.2):
+    def __init__(self, path, session_id, account_id, portfolios, llm_client, trade_rules="", use_market_order=False, price_tolerance=0.2,
+                 news_poll_interval=300, stale_order_seconds=30):
         self.path = path
         self.session_id = session_id
         self.account_id = account_id
@@ -75,10 +77,21 @@ class LLMQMTStockStrategy(XtQuantTraderCallback):
         self.account = None
         self.data_provider = StockDataProvider(llm_client)
         self.dealer = LLMStockDealer(self.llm_client, self.data_provider, self.trade_rules)
+        # 新闻在后台按股票轮询，处理 bar 时只读取缓存的新闻文本
+        self.news_service = NewsService(summarize=self.format_news, max_items=5, logger=logger)
+        self.news_poll_interval = news_poll_interval
 
-        self.bar_data_buffer = {}
+        # 按股票 id 预分配的列式聚合缓冲区，处理周期到达时交换出快照
+        self.bar_buffer = BarBuffer()
         self.last_process_time = time.time()
         self.process_interval = 60  # 60秒，即一分钟
+        # 各股票最近一次行情的收盘价，用于超时订单重新定价
+        self.last_prices = {}
+
+        # 下单网关在 initialize_xt_trader 中随交易连接一起创建
+        self.stale_order_seconds = stale_order_seconds
+        self.order_backend = None
+        self.order_gateway = None
         
         # 初始化讯投交易环境
         self.initialize_xt_trader()
@@ -97,6 +110,11 @@ class LLMQMTStockStrategy(XtQuantTraderCallback):
         self.account = StockAccount(self.account_id, 'STOCK')
         logger.info(f"Created account object for account ID: {self.account_id}")
 
+        # 报单在网关线程中进行，柜台回报由回调转发给网关的订单簿
+        self.order_backend = XtQuantBackend.stock(self.xt_trader, self.account, logger=logger)
+        self.order_gateway = OrderGateway(self.order_backend, stale_after=self.stale_order_seconds,
+                                          reprice=self._reprice_order, logger=logger)
+
         # 注册回调
         self.xt_trader.register_callback(self)
         logger.info("Registered callback")
@@ -119,6 +137,8 @@ class LLMQMTStockStrategy(XtQuantTraderCallback):
             logger.error("Failed to subscribe to trading callbacks")
             return False
 
+        self.order_gateway.start()
+
     def sync_with_account(self):
         """
         与账户同步持仓和资金信息
@@ -131,13 +151,16 @@ class LLMQMTStockStrategy(XtQuantTraderCallback):
         # 同步持仓信息
         positions = self.xt_trader.query_stock_positions(self.account)
         if positions:
+            # 账户不提供开仓时间：已有持仓沿用之前的时间，只有新出现的持仓使用当前时间，
+            # 持仓没有变化时 dealer 不会重复写入状态日志
+            known_entry_times = {p.symbol: p.entry_time for p in self.dealer.positions if not p.is_closed()}
             new_positions = []
             for pos in positions:
                 new_position = {
                     "symbol": pos.stock_code,
                     "entry_price": pos.avg_price,
                     "quantity": pos.volume,
-                    "entry_time": datetime.now().isoformat(),  # 使用当前时间，因为我们没有开仓时间的信息
+                    "entry_time": known_entry_times.get(pos.stock_code, datetime.now()).isoformat(),
                     "position_type": self.dealer.portfolio.get_stock(pos.stock_code)['type'] if pos.stock_code in self.dealer.portfolio.stocks else 'medium_term',
                     "available_quantity": pos.can_use_volume
                 }
@@ -182,6 +205,9 @@ class LLMQMTStockStrategy(XtQuantTraderCallback):
                 logger.info(f"Subscribed to 1-minute bar data for {stock}")
             except Exception as e:
                 logger.error(f"Error subscribing to market data for {stock}: {e}")
+            if not self.news_service.has_source(stock):
+                self.news_service.add_source(stock, self.fetch_news, interval=self.news_poll_interval)
+        self.news_service.start()
 
         logger.info(f"Total subscribed stocks: {len(stocks_to_subscribe)}")
 
@@ -191,32 +217,14 @@ class LLMQMTStockStrategy(XtQuantTraderCallback):
         current_time = time.time()
         #print(current_time)
         
+        portfolio = self.dealer.portfolio.get_all_stocks()
         for stock, bar_data in data.items():
-            if stock in self.dealer.portfolio.get_all_stocks():
+            if stock in portfolio:
                 try:
-                    bar = pd.Series({
-                        'datetime': self.parse_timestamp(bar_data[0]['time']),
-                        'open': bar_data[0]['open'],
-                        'high': bar_data[0]['high'],
-                        'low': bar_data[0]['low'],
-                        'close': bar_data[0]['close'],
-                        'volume': bar_data[0]['volume'],
-                        'amount': bar_data[0]['amount'],
-                        'hold': bar_data[0]['openInterest']
-                    })
-                    
-                    # 更新或添加到缓冲区
-                    if stock not in self.bar_data_buffer:
-                        self.bar_data_buffer[stock] = bar
-                    else:
-                        # 更新现有数据
-                        self.bar_data_buffer[stock]['high'] = max(self.bar_data_buffer[stock]['high'], bar['high'])
-                        self.bar_data_buffer[stock]['low'] = min(self.bar_data_buffer[stock]['low'], bar['low'])
-                        self.bar_data_buffer[stock]['close'] = bar['close']
-                        self.bar_data_buffer[stock]['volume'] += bar['volume']
-                        self.bar_data_buffer[stock]['amount'] += bar['amount']
-                        self.bar_data_buffer[stock]['hold'] = bar['hold']
-                    
+                    tick = bar_data[0]
+                    self.bar_buffer.update(stock, tick['time'], tick['open'], tick['high'], tick['low'], tick['close'],
+                                           tick['volume'], tick['amount'], tick['openInterest'])
+                    self.last_prices[stock] = tick['close']
                 except Exception as e:
                     logger.error(f"Error processing bar data for {stock}: {e}")
             else:
@@ -228,15 +236,19 @@ class LLMQMTStockStrategy(XtQuantTraderCallback):
             self.last_process_time = current_time
 
     def process_buffered_data(self):
-        if not self.bar_data_buffer:
+        if not self.bar_buffer.pending():
             return
 
         try:
-            # 获取新闻数据
-            news = {stock: self.get_latest_news(stock) for stock in self.bar_data_buffer.keys()}
+            # 交换缓冲区，之后的行情写入另一个缓冲区
+            bars = self.bar_buffer.swap().to_series_dict()
+
+            # 读取后台新闻服务缓存的新闻
+            news = {stock: self.news_service.get_summary(stock)[0] or f"没有找到股票 {stock} 的最新新闻。"
+                    for stock in bars}
             
             # 处理所有收到的bar数据
-            results = self.dealer.process_bar(self.bar_data_buffer, news)
+            results = self.dealer.process_bar(bars, news)
             logger.debug(f"process_bar results: {results}")
             
             # 执行交易指令
@@ -246,11 +258,11 @@ class LLMQMTStockStrategy(XtQuantTraderCallback):
                     if len(result) == 3:
                         trade_instruction, quantity, next_msg = result
                         if trade_instruction != 'hold':
-                            self.execute_trade(stock, trade_instruction, quantity, self.bar_data_buffer[stock]['close'])
+                            self.execute_trade(stock, trade_instruction, quantity, bars[stock]['close'], bars[stock]['datetime'])
                     elif len(result) == 5:
                         trade_instruction, quantity, next_msg, trade_reason, trade_plan = result
                         if trade_instruction != 'hold':
-                            self.execute_trade(stock, trade_instruction, quantity, self.bar_data_buffer[stock]['close'])
+                            self.execute_trade(stock, trade_instruction, quantity, bars[stock]['close'], bars[stock]['datetime'])
                         logger.info(f"Trade reason for {stock}: {trade_reason}")
                         logger.info(f"Trade plan for {stock}: {trade_plan}")
                     else:
@@ -258,64 +270,56 @@ class LLMQMTStockStrategy(XtQuantTraderCallback):
                 else:
                     logger.warning(f"Unexpected result type for {stock}: {type(result)}")
             
-            # 清空缓冲区
-            self.bar_data_buffer.clear()
-            
         except Exception as e:
             logger.error(f"Error in batch processing of bar data: {e}", exc_info=True)
 
     def parse_timestamp(self, timestamp):
-        """解析时间戳"""
+        """解析时间戳，返回北京时间；各种格式的转换统一由 time_normalizer 完成"""
         try:
-            if isinstance(timestamp, (int, float)):
-                return datetime.fromtimestamp(timestamp / 1000, tz=beijing_tz)
-            elif isinstance(timestamp, str):
-                return parser.parse(timestamp).astimezone(beijing_tz)
-            elif isinstance(timestamp, pd.Timestamp):
-                return timestamp.tz_localize(beijing_tz) if timestamp.tz is None else timestamp.tz_convert(beijing_tz)
-            elif isinstance(timestamp, datetime):
-                return timestamp.astimezone(beijing_tz) if timestamp.tzinfo else beijing_tz.localize(timestamp)
-            else:
-                raise ValueError(f"Unexpected timestamp type: {type(timestamp)}")
+            return from_epoch_ns(to_epoch_ns(timestamp))
         except Exception as e:
             logger.error(f"Error parsing timestamp {timestamp}: {str(e)}")
             return datetime.now(beijing_tz)
 
-    def get_latest_news(self, symbol: str, num: int = 5) -> str:
+    def fetch_news(self, symbol: str, num: int = 5):
+        """新闻服务的数据源：获取指定股票的最新新闻"""
+        return self.data_provider.get_one_stock_news(symbol, num=num)
+
+    def format_news(self, symbol: str, news_list) -> str:
         """
-        获取指定股票的最新新闻。
+        把新闻服务中的最新新闻格式化为提供给 dealer 的文本。
 
         参数:
         symbol (str): 股票代码
-        num (int): 需要获取的新闻数量，默认为5条
+        news_list (list): 新闻服务去重后的新闻，按发布时间从新到旧排列
 
         返回:
         str: 包含最新新闻的字符串
         """
-        try:
-            # 使用 get_one_stock_news 方法获取最新新闻
-            news_list = self.data_provider.get_one_stock_news(symbol, num=num)
-            
-            if not news_list:
-                return f"没有找到股票 {symbol} 的最新新闻。"
-
-            # 格式化新闻信息
-            formatted_news = []
-            for news in news_list:
-                formatted_news.append(
-                    f"标题: {news['title']}\n"
-                    f"内容: {news['content']}\n"
-                    f"时间: {news['datetime']}\n"
-                    f"链接: {news['url']}\n"
-                    "----------------------"
-                )
-
-            return "\n".join(formatted_news)
+        formatted_news = []
+        for news in news_list:
+            formatted_news.append(
+                f"标题: {news['title']}\n"
+                f"内容: {news['content']}\n"
+                f"时间: {news['publish_time']}\n"
+                f"链接: {news['url']}\n"
+                "----------------------"
+            )
+
+        return "\n".join(formatted_news)
+
+    def _limit_price(self, action, price):
+        """限价委托在最新价上加减价格容忍度"""
+        if action == 'buy':
+            return price * (1 + self.price_tolerance)
+        return price * (1 - self.price_tolerance)
 
-        except Exception as e:
-            return f"获取股票 {symbol} 的新闻时发生错误: {str(e)}"
+    def _reprice_order(self, order):
+        """超时撤单后按股票最新价重新计算委托价"""
+        price = self.last_prices.get(order.symbol)
+        return None if price is None else self._limit_price(order.side, price)
 
-    def execute_trade(self, stock, trade_instruction, quantity, price):
+    def execute_trade(self, stock, trade_instruction, quantity, price, bar_time=None):
         logger.info(f"执行交易: {stock} {trade_instruction} {quantity} @ {price}")
         
         action = trade_instruction.split()[0]
@@ -324,43 +328,39 @@ class LLMQMTStockStrategy(XtQuantTraderCallback):
             logger.info(f"保持当前持仓，不执行交易: {stock}")
             return
 
-        order_price = price
-        order_type = xtconstant.FIX_PRICE
-
-        if self.use_market_order:
-            order_type = xtconstant.LATEST_PRICE
-        else:
-            if action == 'buy':
-                order_price = price * (1 + self.price_tolerance)
-            elif action == 'sell':
-                order_price = price * (1 - self.price_tolerance)
-
-        if action == 'buy':
-            order_id = self.xt_trader.order_stock(self.account, stock, xtconstant.STOCK_BUY, 
-                                                quantity, order_type, order_price, 'LLM_strategy', 'LLM_buy')
-        elif action == 'sell':
-            order_id = self.xt_trader.order_stock(self.account, stock, xtconstant.STOCK_SELL, 
-                                                quantity, order_type, order_price, 'LLM_strategy', 'LLM_sell')
-        else:
+        if action not in ['buy', 'sell']:
             logger.warning(f"未知的交易指令: {trade_instruction}")
             return
 
-        logger.info(f"已发送订单: ID={order_id}, 股票={stock}, 指令={trade_instruction}, 数量={quantity}, 价格类型={order_type}, 价格={order_price}")
+        order_price = price if self.use_market_order else self._limit_price(action, price)
+        # 同一根 bar 的同一决策只报一次单
+        client_order_id = make_client_order_id(stock, bar_time, action) if bar_time is not None else None
+        order = self.order_gateway.submit(stock, action, quantity, order_price,
+                                          market=self.use_market_order, client_order_id=client_order_id)
+        logger.info(f"已提交订单: {order}")
+        logger.info(self.order_gateway.describe(stock))
 
     def run_strategy(self):
         """运行策略"""
         logger.info("Strategy is now running. Waiting for market data...")
-        self.xt_trader.run_forever()
+        try:
+            self.xt_trader.run_forever()
+        finally:
+            self.order_gateway.stop()
+            self.news_service.stop()
+            logger.info(self.dealer.get_latency_report())
 
     # 以下是 XtQuantTraderCallback 的方法实现
     def on_disconnected(self):
         logger.warning('连接断开回调')
 
     def on_stock_order(self, order):
-        logger.info(f'委托回调 投资备注 {order.order_remark}')
+        logger.info(f'委托回调 投资备注 {order.order_remark} 状态 {order.order_status}')
+        self.order_backend.on_stock_order(order)
 
     def on_stock_trade(self, trade):
         logger.info(f'成交回调 {trade.order_remark}, 委托方向 {trade.order_type} 成交价格 {trade.traded_price} 成交数量 {trade.traded_volume}')
+        self.order_backend.on_stock_trade(trade)
         
         # 更新可用资金
         asset = self.xt_trader.query_stock_asset(self.account)
@@ -371,9 +371,11 @@ class LLMQMTStockStrategy(XtQuantTraderCallback):
 
     def on_order_error(self, order_error):
         logger.error(f"委托报错回调 {order_error.order_remark} {order_error.error_msg}")
+        self.order_backend.on_order_error(order_error)
 
     def on_cancel_error(self, cancel_error):
         logger.error(f"撤单错误 {cancel_error}")
+        self.order_backend.on_cancel_error(cancel_error)
 
     def on_order_stock_async_response(self, response):
         logger.info(f"异步委托回调 投资备注: {response.order_remark}")
@@ -1,5 +1,4 @@
 # coding:utf-8
-import time
 import datetime
 from xtquant import xtdata
 from xtquant.xttrader import XtQuantTrader, XtQuantTraderCallback
@@ -7,12 +6,14 @@ from xtquant.xttype import StockAccount
 from xtquant import xtconstant
 from dealer.llm_dealer import LLMDealer
 from dealer.futures_provider import MainContractProvider
+from dealer.decision_worker import DecisionWorker
+from dealer.order_gateway import OrderGateway, XtQuantBackend, make_client_order_id
+from dealer.time_normalizer import from_epoch_ns, to_epoch_ns
 import pandas as pd
 from datetime import datetime, timedelta
 import re
 import logging
 import pytz
-from dateutil import parser
 
 # 设置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -26,7 +27,8 @@ def interact():
     code.InteractiveConsole(locals=globals()).interact()
 
 class LLMQMTFuturesStrategy(XtQuantTraderCallback):
-    def __init__(self, path, session_id, account_id, symbol, llm_client, trade_rules = "", start_time=None,use_market_order=False, price_tolerance=0.2):
+    def __init__(self, path, session_id, account_id, symbol, llm_client, trade_rules = "", start_time=None,use_market_order=False, price_tolerance=0.2,
+                 stale_order_seconds=30):
         self.path = path
         self.session_id = session_id
         self.account_id = account_id
@@ -49,6 +51,13 @@ class LLMQMTFuturesStrategy(XtQuantTraderCallback):
         
         self.use_market_order = use_market_order
         self.price_tolerance = price_tolerance
+        # 下单网关在 start() 中随交易连接一起创建
+        self.stale_order_seconds = stale_order_seconds
+        self.order_backend = None
+        self.order_gateway = None
+
+        # 行情回调只负责投递 bar，LLM 决策在工作线程中完成
+        self.decision_worker = DecisionWorker(self._decide_bar, self._on_decision, name="qmt-futures", logger=logger)
 
         # 使用北京时间
         current_time = datetime.now(beijing_tz)
@@ -65,6 +74,11 @@ class LLMQMTFuturesStrategy(XtQuantTraderCallback):
         # 创建资金账号对象，期货账号为FUTURE
         self.account = StockAccount(self.account_id, 'FUTURE')
         logger.info(f"Created account object for account ID: {self.account_id}")
+
+        # 报单在网关线程中进行，柜台回报由回调转发给网关的订单簿
+        self.order_backend = XtQuantBackend.futures(self.xt_trader, self.account, logger=logger)
+        self.order_gateway = OrderGateway(self.order_backend, stale_after=self.stale_order_seconds,
+                                          reprice=self._reprice_order, logger=logger)
         
         # 注册回调
         self.xt_trader.register_callback(self)
@@ -88,7 +102,9 @@ class LLMQMTFuturesStrategy(XtQuantTraderCallback):
             logger.error("Failed to subscribe to trading callbacks")
             return False
         
-        # 订阅行情数据
+        # 启动下单网关和决策线程后再订阅行情数据
+        self.order_gateway.start()
+        self.decision_worker.start()
         self.subscribe_market_data()
         
         logger.info("LLMQMTFuturesStrategy started successfully")
@@ -111,10 +127,13 @@ class LLMQMTFuturesStrategy(XtQuantTraderCallback):
             bar_data = data[self.symbol][0]
             logger.debug(f"Received raw bar data: {bar_data}")
             try:
-                current_time = self.parse_timestamp(bar_data['time'])
-                
+                # 行情时间在入口处统一转换为 epoch 纳秒，下游只读取 ts 和 datetime
+                ts = to_epoch_ns(bar_data['time'])
+                current_time = from_epoch_ns(ts)
+
                 # 更新当前bar数据
                 new_bar_data = pd.Series({
+                    'ts': ts,
                     'datetime': current_time,
                     'open': bar_data['open'],
                     'high': bar_data['high'],
@@ -130,8 +149,8 @@ class LLMQMTFuturesStrategy(XtQuantTraderCallback):
                     logger.info(f"Processing new bar data for time: {current_time}")
                     if current_time >= self.start_time:
                         if self.current_bar_data is not None:
-                            # 处理上一个完整的分钟数据
-                            self.process_bar(self.current_bar_data)
+                            # 把上一个完整的分钟数据交给决策线程，不在回调线程中等待 LLM
+                            self.decision_worker.submit(self.symbol, self.current_bar_data)
                         # 重置当前bar数据
                         self.current_bar_data = new_bar_data
                         self.last_processed_time = current_time
@@ -153,35 +172,9 @@ class LLMQMTFuturesStrategy(XtQuantTraderCallback):
             logger.warning(f"Received data does not contain information for {self.symbol}")
 
     def parse_timestamp(self, timestamp):
-        """解析时间戳"""
-        logger.debug(f"Attempting to parse timestamp: {timestamp}")
+        """解析时间戳，返回北京时间；各种格式的转换统一由 time_normalizer 完成"""
         try:
-            # 尝试多种可能的时间戳格式
-            if isinstance(timestamp, (int, float)):
-                # 如果时间戳是以毫秒为单位
-                if timestamp > 1e12:
-                    # 检查时间戳是否超出合理范围（2262年之后）
-                    if timestamp > 9999999999999:
-                        logger.warning(f"Abnormally large timestamp detected: {timestamp}")
-                        # 尝试将其解释为纳秒级时间戳
-                        try:
-                            return pd.Timestamp(timestamp, unit='ns').tz_localize(beijing_tz)
-                        except Exception:
-                            logger.error(f"Failed to parse abnormally large timestamp: {timestamp}")
-                            return datetime.now(beijing_tz)
-                    return datetime.fromtimestamp(timestamp / 1000, tz=beijing_tz)
-                # 如果时间戳是以秒为单位
-                else:
-                    return datetime.fromtimestamp(timestamp, tz=beijing_tz)
-            elif isinstance(timestamp, str):
-                # 尝试使用dateutil解析字符串格式的时间戳
-                return parser.parse(timestamp).astimezone(beijing_tz)
-            elif isinstance(timestamp, pd.Timestamp):
-                return timestamp.tz_localize(beijing_tz) if timestamp.tz is None else timestamp.tz_convert(beijing_tz)
-            elif isinstance(timestamp, datetime):
-                return timestamp.astimezone(beijing_tz) if timestamp.tzinfo else beijing_tz.localize(timestamp)
-            else:
-                raise ValueError(f"Unexpected timestamp type: {type(timestamp)}")
+            return from_epoch_ns(to_epoch_ns(timestamp))
         except Exception as e:
             logger.error(f"Error parsing timestamp {timestamp}: {str(e)}")
             # 如果所有方法都失败，返回当前时间作为后备选项
@@ -196,21 +189,32 @@ class LLMQMTFuturesStrategy(XtQuantTraderCallback):
         return False
 
     def process_bar(self, bar_data):
-        """处理单个 bar 的数据"""
+        """同步处理单个 bar 的数据"""
+        self._on_decision(self.symbol, bar_data, self._decide_bar(self.symbol, bar_data))
+
+    def _decide_bar(self, symbol, bar_data):
+        """在决策线程中调用 LLM，返回决策结果；非交易时间返回 None"""
         if not self.is_trading_time(bar_data['datetime']):
             logger.info(f"Not trading time: {bar_data['datetime']}")
-            return
+            return None
 
         logger.info(f"Processing bar data: {bar_data}")
         news = self.get_latest_news()
-        trade_instruction, quantity, next_msg, trade_reason, trade_plan = self.llm_dealer.process_bar(bar_data, news)
+        return self.llm_dealer.process_bar(bar_data, news)
+
+    def _on_decision(self, symbol, bar_data, result):
+        """决策返回后执行交易"""
+        if result is None:
+            return
+        trade_instruction, quantity, next_msg, trade_reason, trade_plan = result
 
         logger.info(f"LLM decision: {trade_instruction}, quantity: {quantity}")
         logger.info(f"Trade reason: {trade_reason}")
         logger.info(f"Trade plan: {trade_plan}")
+        logger.info(f"Decision pipeline: {self.decision_worker.format_metrics()}")
 
         if trade_instruction != 'hold':
-            self.execute_trade(trade_instruction, quantity, bar_data['close'])
+            self.execute_trade(trade_instruction, quantity, bar_data['close'], bar_data['datetime'])
 
         self.last_trade_time = bar_data['datetime']
         self.last_msg = next_msg
@@ -239,17 +243,21 @@ class LLMQMTFuturesStrategy(XtQuantTraderCallback):
         logger.warning('连接断开回调')
 
     def on_stock_order(self, order):
-        logger.info(f'委托回调 投资备注 {order.order_remark}')
+        logger.info(f'委托回调 投资备注 {order.order_remark} 状态 {order.order_status}')
+        self.order_backend.on_stock_order(order)
 
     def on_stock_trade(self, trade):
         logger.info(f'成交回调 {trade.order_remark}, 委托方向(48买 49卖) {trade.offset_flag} 成交价格 {trade.traded_price} 成交数量 {trade.traded_volume}')
         self.update_positions(trade)
+        self.order_backend.on_stock_trade(trade)
 
     def on_order_error(self, order_error):
         logger.error(f"委托报错回调 {order_error.order_remark} {order_error.error_msg}")
+        self.order_backend.on_order_error(order_error)
 
     def on_cancel_error(self, cancel_error):
         logger.error(f"撤单错误 {cancel_error}")
+        self.order_backend.on_cancel_error(cancel_error)
 
     def on_order_stock_async_response(self, response):
         logger.info(f"异步委托回调 投资备注: {response.order_remark}")
@@ -276,84 +284,64 @@ class LLMQMTFuturesStrategy(XtQuantTraderCallback):
         logger.info(f"Updated positions: Long Today {self.long_position_today}, Long History {self.long_position_history}, Short Today {self.short_position_today}, Short History {self.short_position_history}")
 
     def get_latest_news(self):
-        news_df = self.data_provider.get_futures_news(self.symbol, page_num=0, page_size=1)
-        if news_df is not None and not news_df.empty:
-            return news_df.iloc[0]['summary']
-        return ""
-
-    def execute_trade(self, instruction, quantity, price):
+        """读取 dealer 后台新闻服务缓存的摘要，不在决策路径上请求网络"""
+        if self.llm_dealer.news_service is None:
+            return ""
+        return self.llm_dealer.news_service.get_summary(self.llm_dealer.symbol)[0]
+
+    def get_current_position(self) -> int:
+        """由成交回报累计的净持仓，多头为正、空头为负"""
+        return (self.long_position_today + self.long_position_history
+                - self.short_position_today - self.short_position_history)
+
+    def _limit_price(self, instruction, price):
+        """限价委托在最新价上加减价格容忍度"""
+        if instruction in ['buy', 'cover']:
+            return price * (1 + self.price_tolerance)
+        return price * (1 - self.price_tolerance)
+
+    def _reprice_order(self, order):
+        """超时撤单后按当前 bar 的最新价重新计算委托价"""
+        if self.current_bar_data is None:
+            return None
+        return self._limit_price(order.side, self.current_bar_data['close'])
+
+    def execute_trade(self, instruction, quantity, price, bar_time=None):
         logger.info(f"尝试执行交易: 指令={instruction}, 数量={quantity}, 价格={price}")
-        current_position = self.position_manager.get_current_position()
-        logger.info(f"当前仓位: {current_position}, 最大仓位: {self.max_position}")
+        max_position = self.llm_dealer.max_position
+        current_position = self.get_current_position()
+        long_position = max(current_position, 0)
+        short_position = max(-current_position, 0)
+        logger.info(f"当前仓位: {current_position}, 最大仓位: {max_position}")
 
         try:
-            order_price = price
-            order_type = xtconstant.FIX_PRICE
-
-            if self.use_market_order:
-                # 使用市价委托
-                order_type = xtconstant.MARKET_BEST  # 或者其他适合的市价委托类型
-            else:
-                # 使用限价委托，但添加一个价格容忍度
-                if instruction in ['buy', 'cover']:
-                    order_price = price * (1 + self.price_tolerance)
-                elif instruction in ['sell', 'short']:
-                    order_price = price * (1 - self.price_tolerance)
+            quantity = max_position if quantity == 'all' else int(quantity)
+            order_price = price if self.use_market_order else self._limit_price(instruction, price)
+            # 扣除同方向仍在途的委托，部分成交和拒单在下一次决策前已反映在订单簿中
+            working = self.order_gateway.working_volume(self.symbol, instruction)
 
             if instruction == 'buy':
-                max_buy = self.max_position - current_position
-                actual_quantity = min(quantity, max_buy)
-                if actual_quantity > 0:
-                    order_id = self.xt_trader.order_stock(self.account, self.symbol, xtconstant.FUTURE_OPEN_LONG, 
-                                                        actual_quantity, order_type, order_price, 'LLM_strategy', 'LLM_buy')
-                    logger.info(f"已发送买入订单: ID={order_id}, 数量={actual_quantity}, 价格类型={order_type}, 价格={order_price}")
-                else:
-                    logger.warning(f"买入订单未执行: 已达到最大仓位或无效数量. 最大可买入: {max_buy}, 尝试买入: {quantity}")
+                available = max_position - current_position - working
             elif instruction == 'sell':
-                actual_quantity = min(quantity, current_position)
-                if actual_quantity > 0:
-                    order_id = self.xt_trader.order_stock(self.account, self.symbol, xtconstant.FUTURE_CLOSE_LONG_TODAY, 
-                                                        actual_quantity, order_type, order_price, 'LLM_strategy', 'LLM_sell')
-                    logger.info(f"已发送卖出订单: ID={order_id}, 数量={actual_quantity}, 价格类型={order_type}, 价格={order_price}")
-                else:
-                    logger.warning(f"卖出订单未执行: 无多头仓位或无效数量. 当前仓位: {current_position}, 尝试卖出: {quantity}")
+                available = long_position - working
             elif instruction == 'short':
-                max_short = self.max_position + current_position
-                actual_quantity = min(quantity, max_short)
-                if actual_quantity > 0:
-                    order_id = self.xt_trader.order_stock(self.account, self.symbol, xtconstant.FUTURE_OPEN_SHORT, 
-                                                        actual_quantity, order_type, order_price, 'LLM_strategy', 'LLM_short')
-                    logger.info(f"已发送做空订单: ID={order_id}, 数量={actual_quantity}, 价格类型={order_type}, 价格={order_price}")
-                else:
-                    logger.warning(f"做空订单未执行: 已达到最大仓位或无效数量. 最大可做空: {max_short}, 尝试做空: {quantity}")
+                available = max_position + current_position - working
             elif instruction == 'cover':
-                actual_quantity = min(quantity, abs(current_position) if current_position < 0 else 0)
-                if actual_quantity > 0:
-                    order_id = self.xt_trader.order_stock(self.account, self.symbol, xtconstant.FUTURE_CLOSE_SHORT_TODAY, 
-                                                        actual_quantity, order_type, order_price, 'LLM_strategy', 'LLM_cover')
-                    logger.info(f"已发送平空订单: ID={order_id}, 数量={actual_quantity}, 价格类型={order_type}, 价格={order_price}")
-                else:
-                    logger.warning(f"平空订单未执行: 无空头仓位或无效数量. 当前仓位: {current_position}, 尝试平仓: {quantity}")
+                available = short_position - working
             else:
                 logger.warning(f"未知的交易指令: {instruction}")
                 return
 
-            # 添加交易后的位置检查
-            time.sleep(1)  # 等待一秒，让订单有时间执行
-            new_position = self.position_manager.get_current_position()
-            if new_position != current_position:
-                logger.info(f"交易成功执行. 新仓位: {new_position}")
-            else:
-                logger.warning(f"交易可能未执行. 仓位未改变: {new_position}")
-
-            self._force_close_if_needed(datetime.now(beijing_tz), price)
-
-            profits = self.position_manager.calculate_profits(price)
-            self.total_profit = profits['total_profit']
+            actual_quantity = min(quantity, available)
+            if actual_quantity <= 0:
+                logger.warning(f"{instruction} 订单未执行: 可用数量 {available}（在途 {working}），尝试数量 {quantity}")
+                return
 
-            logger.info(f"执行交易后的仓位: {self.position_manager.get_current_position()}")
-            logger.info(f"当前总盈亏: {self.total_profit:.2f}")
-            logger.info(self.position_manager.get_position_details())
+            client_order_id = make_client_order_id(self.symbol, bar_time, instruction) if bar_time is not None else None
+            order = self.order_gateway.submit(self.symbol, instruction, actual_quantity, order_price,
+                                              market=self.use_market_order, client_order_id=client_order_id)
+            logger.info(f"已提交订单: {order}")
+            logger.info(self.order_gateway.describe(self.symbol))
 
         except Exception as e:
             logger.error(f"执行交易时发生错误: {str(e)}", exc_info=True)
@@ -361,7 +349,13 @@ class LLMQMTFuturesStrategy(XtQuantTraderCallback):
     def run_strategy(self):
         """运行策略"""
         logger.info("Strategy is now running. Waiting for market data...")
-        self.xt_trader.run_forever()
+        try:
+            self.xt_trader.run_forever()
+        finally:
+            self.decision_worker.stop(timeout=5)
+            self.order_gateway.stop()
+            self.llm_dealer.shutdown()
+            logger.info(self.llm_dealer.get_latency_report())
 
 
 if __name__ == "__main__":
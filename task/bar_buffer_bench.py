@@ -0,0 +1,74 @@
+import random
+import time
+
+import pandas as pd
+
+from dealer.bar_buffer import BarBuffer
+
+
+def _make_ticks(num_symbols: int, num_updates: int):
+    symbols = [f"{600000 + i}.SH" for i in range(num_symbols)]
+    start = 1718000000000
+    ticks = []
+    for n in range(num_updates):
+        price = 10 + random.random()
+        ticks.append((symbols[n % num_symbols], {
+            'time': start + n, 'open': price, 'high': price + 0.1, 'low': price - 0.1, 'close': price,
+            'volume': 100, 'amount': price * 100, 'openInterest': 0,
+        }))
+    return symbols, ticks
+
+
+def _series_buffer(ticks):
+    """原来的做法：每次更新创建 pd.Series 再逐字段合并"""
+    buffer = {}
+    for stock, tick in ticks:
+        bar = pd.Series({
+            'datetime': pd.Timestamp(tick['time'], unit='ms', tz='UTC'),
+            'open': tick['open'], 'high': tick['high'], 'low': tick['low'], 'close': tick['close'],
+            'volume': tick['volume'], 'amount': tick['amount'], 'hold': tick['openInterest'],
+        })
+        if stock not in buffer:
+            buffer[stock] = bar
+        else:
+            buffer[stock]['high'] = max(buffer[stock]['high'], bar['high'])
+            buffer[stock]['low'] = min(buffer[stock]['low'], bar['low'])
+            buffer[stock]['close'] = bar['close']
+            buffer[stock]['volume'] += bar['volume']
+            buffer[stock]['amount'] += bar['amount']
+            buffer[stock]['hold'] = bar['hold']
+    return buffer
+
+
+def _bar_buffer(symbols, ticks):
+    buffer = BarBuffer(symbols)
+    for stock, tick in ticks:
+        buffer.update(stock, tick['time'], tick['open'], tick['high'], tick['low'], tick['close'],
+                      tick['volume'], tick['amount'], tick['openInterest'])
+    return buffer.swap()
+
+
+def runner(num_symbols: int = 500, num_updates: int = 50000):
+    symbols, ticks = _make_ticks(num_symbols, num_updates)
+
+    started = time.perf_counter()
+    _series_buffer(ticks)
+    series_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    snapshot = _bar_buffer(symbols, ticks)
+    buffer_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    snapshot.to_series_dict()
+    snapshot_elapsed = time.perf_counter() - started
+
+    print(f"{num_updates} updates over {num_symbols} symbols")
+    print(f"pd.Series buffer: {num_updates / series_elapsed:,.0f} updates/s")
+    print(f"BarBuffer:        {num_updates / buffer_elapsed:,.0f} updates/s "
+          f"({series_elapsed / buffer_elapsed:.1f}x)")
+    print(f"snapshot -> {len(snapshot)} pd.Series: {snapshot_elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    runner()
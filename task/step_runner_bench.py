@@ -0,0 +1,116 @@
+import io
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from core.interpreter.step_code_runner import StepCodeRunner
+
+
+class _FakeProvider:
+    """不访问网络的数据接口，返回形状与真实接口相近的数据"""
+
+    def __init__(self, rows: int = 250):
+        self.rows = rows
+
+    def get_baidu_hotrank(self, num: int = 20):
+        return {f"{600000 + i}": f"股票{i} 热度 {1000 - i}" for i in range(num)}
+
+    def get_stock_history(self, symbol: str, days: int = 250) -> pd.DataFrame:
+        rng = np.random.default_rng(int(symbol) % 1000)
+        close = 10 + rng.standard_normal(self.rows).cumsum() * 0.1
+        return pd.DataFrame({
+            'date': pd.date_range('2024-01-01', periods=self.rows),
+            'open': close, 'high': close + 0.2, 'low': close - 0.2, 'close': close,
+            'volume': rng.integers(1000, 10000, self.rows),
+        })
+
+
+class _FakeLLM:
+    def one_chat(self, prompt: str) -> str:
+        return json.dumps({"score": len(prompt) % 100, "reason": "ok"})
+
+
+# 有代表性的生成代码：逐股票取数、pandas 计算指标、逐行打分、调用 LLM
+_SCRIPT = """
+hot = stock_data_provider.get_baidu_hotrank(num)
+scores = {}
+for symbol in hot:
+    df = stock_data_provider.get_stock_history(symbol)
+    df['ma5'] = df['close'].rolling(5).mean()
+    df['ma20'] = df['close'].rolling(20).mean()
+    df['ret'] = df['close'].pct_change()
+    trend = 0
+    for _, row in df.tail(60).iterrows():
+        if row['ma5'] > row['ma20']:
+            trend += 1
+    volatility = df['ret'].std()
+    momentum = 0.0
+    closes = df['close'].tolist()
+    for i in range(1, len(closes)):
+        momentum += (closes[i] - closes[i - 1]) / closes[i - 1]
+    prompt = f"{symbol} 趋势 {trend} 波动 {volatility:.4f} 动量 {momentum:.4f}"
+    scores[symbol] = json.loads(llm_client.one_chat(prompt))['score']
+result = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:5]
+"""
+
+
+def _traced_run(code: str, global_vars: dict):
+    """原来的做法：exec 期间安装 sys.settrace 行追踪，每行调用一次 time.time()"""
+    last_update = [0.0]
+
+    def trace_calls(frame, event, arg):
+        if event == 'line':
+            now = time.time()
+            if now - last_update[0] >= 0.1:
+                last_update[0] = now
+        return trace_calls
+
+    exec_globals = dict(global_vars)
+    old_stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    sys.settrace(trace_calls)
+    try:
+        exec(code, exec_globals)
+    finally:
+        sys.settrace(None)
+        sys.stdout = old_stdout
+    return exec_globals
+
+
+def _timed(fn, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def runner(num_symbols: int = 20, rows: int = 250, repeat: int = 3):
+    global_vars = {'stock_data_provider': _FakeProvider(rows), 'llm_client': _FakeLLM(), 'json': json,
+                   'num': num_symbols}
+    step_runner = StepCodeRunner()
+
+    def plain():
+        exec(_SCRIPT, dict(global_vars))
+
+    def instrumented():
+        result = step_runner.run(_SCRIPT, global_vars)
+        if result['error']:
+            raise RuntimeError(result['error'])
+
+    plain_elapsed = _timed(plain, repeat)
+    traced_elapsed = _timed(lambda: _traced_run(_SCRIPT, global_vars), repeat)
+    instrumented_elapsed = _timed(instrumented, repeat)
+
+    print(f"{num_symbols} symbols x {rows} bars, best of {repeat}")
+    print(f"plain exec:            {plain_elapsed * 1000:8.1f} ms")
+    print(f"sys.settrace:          {traced_elapsed * 1000:8.1f} ms ({traced_elapsed / plain_elapsed:.2f}x)")
+    print(f"AST instrumentation:   {instrumented_elapsed * 1000:8.1f} ms ({instrumented_elapsed / plain_elapsed:.2f}x)")
+
+
+if __name__ == "__main__":
+    runner()
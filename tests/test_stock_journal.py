@@ -0,0 +1,48 @@
+from dealer.stock_journal import (PORTFOLIO, PORTFOLIO_REMOVE, PORTFOLIO_STOCK, StockStateJournal)
+
+
+def _journal(tmp_path):
+    return StockStateJournal(str(tmp_path / "state.db"))
+
+
+def test_readd_after_remove_is_written(tmp_path):
+    journal = _journal(tmp_path)
+    info = {"type": "medium_term", "target_price": None, "stop_loss": None}
+    assert journal.append(PORTFOLIO, {"A": info})
+    assert journal.append(PORTFOLIO_REMOVE, "A")
+    assert journal.append(PORTFOLIO, {"A": info})
+    assert journal.load()["portfolio"] == {"A": info}
+    journal.close()
+
+    # 重新打开后回放得到相同的状态
+    replayed = _journal(tmp_path)
+    assert replayed.load()["portfolio"] == {"A": info}
+    replayed.close()
+
+
+def test_repeated_remove_after_readd_is_written(tmp_path):
+    journal = _journal(tmp_path)
+    info = {"type": "short_term", "target_price": 10.0, "stop_loss": 9.0}
+    assert journal.append(PORTFOLIO_STOCK, {"symbol": "A", "info": info})
+    assert journal.append(PORTFOLIO_REMOVE, "A")
+    assert journal.append(PORTFOLIO_STOCK, {"symbol": "A", "info": info})
+    assert journal.append(PORTFOLIO_REMOVE, "A")
+    assert journal.load()["portfolio"] == {}
+    journal.close()
+
+
+def test_stock_update_after_portfolio_replace_is_written(tmp_path):
+    journal = _journal(tmp_path)
+    info = {"type": "short_term", "target_price": 10.0, "stop_loss": 9.0}
+    assert journal.append(PORTFOLIO_STOCK, {"symbol": "A", "info": info})
+    assert journal.append(PORTFOLIO, {})
+    assert journal.append(PORTFOLIO_STOCK, {"symbol": "A", "info": info})
+    assert journal.load()["portfolio"] == {"A": info}
+    journal.close()
+
+
+def test_identical_consecutive_event_is_skipped(tmp_path):
+    journal = _journal(tmp_path)
+    assert journal.append(PORTFOLIO, {"A": {}})
+    assert not journal.append(PORTFOLIO, {"A": {}})
+    journal.close()